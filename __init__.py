@@ -46,11 +46,20 @@ if os.path.exists(nodes_dir):
             continue
         
         name = os.path.splitext(file)[0]
+        file_path = os.path.join(nodes_dir, file)
         try:
-            # 使用绝对路径导入模块
-            spec = importlib.util.spec_from_file_location(name, os.path.join(nodes_dir, file))
-            imported_module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(imported_module)
+            # 节点之间通过sys.path互相导入，已导入的模块直接复用，避免重复执行（重复注册路由、类级状态分裂）
+            imported_module = sys.modules.get(name)
+            if imported_module is None or os.path.abspath(getattr(imported_module, '__file__', '') or '') != file_path:
+                # 使用绝对路径导入模块
+                spec = importlib.util.spec_from_file_location(name, file_path)
+                imported_module = importlib.util.module_from_spec(spec)
+                sys.modules[name] = imported_module
+                try:
+                    spec.loader.exec_module(imported_module)
+                except Exception:
+                    sys.modules.pop(name, None)
+                    raise
             
             if hasattr(imported_module, 'NODE_CLASS_MAPPINGS'):
                 NODE_CLASS_MAPPINGS.update(imported_module.NODE_CLASS_MAPPINGS)
@@ -0,0 +1,532 @@
+"""
+Cloud API Client
+云端API异步客户端 - KontextSuperPrompt的API模式（SiliconFlow、智谱、DeepSeek）
+
+功能：
+- 请求在后台事件循环线程上通过aiohttp发送，ComfyUI执行线程只等待结果
+- 每个提供商独立的令牌桶限速
+- 429/5xx与连接错误按指数退避加随机抖动重试（优先使用Retry-After）
+- 对冲请求：主提供商超过其p95延迟仍未返回时，向另一个已配置密钥的提供商发出第二个请求，先成功者胜出
+- 提供商不支持response_format（400且错误信息指向response_format/JSON模式）时记录并以普通模式重试
+- 未安装aiohttp时退回共享的同步连接池（在线程池中执行）
+
+配置（环境变量）：
+- SILICONFLOW_API_KEY / ZHIPU_API_KEY / DEEPSEEK_API_KEY 提供商密钥（节点未填写密钥时使用；对冲请求只会发往配置了密钥的提供商）
+- <PROVIDER>_RATE_LIMIT 每秒请求数，例如 DEEPSEEK_RATE_LIMIT=5
+- CLOUD_API_RETRIES 重试次数（默认2）
+- CLOUD_API_HEDGE=0 关闭对冲请求
+
+提供商选择"auto"时，根据遥测数据路由到当前最快的健康提供商（只考虑配置了环境变量密钥的提供商）。
+
+基准测试：
+    python nodes/cloud_api_client.py [--requests N]
+启动本地模拟服务（主提供商偶发延迟退化），比较有无对冲请求时的延迟分布
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+try:
+    from server import PromptServer
+    from aiohttp import web
+    WEB_AVAILABLE = True
+except ImportError:
+    WEB_AVAILABLE = False
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from http_client import http_client
+from provider_telemetry import ProviderTelemetry, provider_telemetry
+from structured_output import is_response_format_error, mark_response_format_unsupported, response_format_for
+
+# 提供商配置（rate_limit为默认的每秒请求数）
+PROVIDERS: Dict[str, Dict[str, Any]] = {
+    'siliconflow': {
+        'base_url': 'https://api.siliconflow.cn/v1/chat/completions',
+        'default_model': 'deepseek-ai/DeepSeek-V3',
+        'env_key': 'SILICONFLOW_API_KEY',
+        'rate_limit': 5.0,
+    },
+    'zhipu': {
+        'base_url': 'https://open.bigmodel.cn/api/paas/v4/chat/completions',
+        'default_model': 'glm-4.5',
+        'env_key': 'ZHIPU_API_KEY',
+        'rate_limit': 5.0,
+    },
+    'deepseek': {
+        'base_url': 'https://api.deepseek.com/v1/chat/completions',
+        'default_model': 'deepseek-chat',
+        'env_key': 'DEEPSEEK_API_KEY',
+        'rate_limit': 5.0,
+    },
+}
+DEFAULT_PROVIDER = 'siliconflow'
+AUTO_PROVIDER = 'auto'
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_RETRIES = int(os.getenv("CLOUD_API_RETRIES", 2))
+HEDGE_ENABLED = os.getenv("CLOUD_API_HEDGE", "1").lower() not in ("0", "false", "no")
+# 样本不足时的对冲等待时间；p95过小时的下限
+HEDGE_DEFAULT_DELAY = 10.0
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 20
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class CloudAPIError(Exception):
+    """云端API请求失败"""
+
+    def __init__(self, provider: str, message: str, status: Optional[int] = None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status = status
+
+
+class TokenBucket:
+    """异步令牌桶：平均每秒rate个请求，允许burst个突发"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(float(rate), 0.01)
+        self.capacity = float(burst) if burst else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """重试等待时间：服务端给出Retry-After时使用它，否则为指数退避加全抖动"""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), BACKOFF_CAP)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class CloudAPIClient:
+    """在后台事件循环上运行的云端API客户端（线程安全）"""
+
+    def __init__(self, providers: Optional[Dict[str, Dict[str, Any]]] = None,
+                 retries: int = DEFAULT_RETRIES, hedge: bool = HEDGE_ENABLED, telemetry=None):
+        self.providers = providers or PROVIDERS
+        self.telemetry = telemetry or provider_telemetry
+        self.retries = retries
+        self.hedge = hedge
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    # ---- 提供商与密钥 ----
+
+    def resolve_provider(self, provider: str) -> str:
+        """"auto"路由到最快的健康提供商，未知名称使用默认提供商"""
+        if provider == AUTO_PROVIDER:
+            return self.route()
+        return provider if provider in self.providers else DEFAULT_PROVIDER
+
+    def route(self) -> str:
+        return self.telemetry.fastest(self.configured_providers()) or DEFAULT_PROVIDER
+
+    def has_key(self, provider: str, api_key: str = "") -> bool:
+        if provider == AUTO_PROVIDER:
+            return bool(self.configured_providers())
+        return bool(self.resolve_key(provider, api_key))
+
+    def resolve_key(self, provider: str, api_key: str = "") -> str:
+        """节点填写的密钥优先，否则读取环境变量"""
+        if api_key and api_key.strip():
+            return api_key.strip()
+        config = self.providers.get(provider)
+        return os.getenv(config['env_key'], "").strip() if config else ""
+
+    def configured_providers(self) -> List[str]:
+        """配置了环境变量密钥的提供商"""
+        return [name for name in self.providers if self.resolve_key(name)]
+
+    def _rate_limit(self, provider: str) -> float:
+        value = os.getenv(f"{provider.upper()}_RATE_LIMIT")
+        try:
+            return float(value) if value else float(self.providers[provider].get('rate_limit', 5.0))
+        except ValueError:
+            return float(self.providers[provider].get('rate_limit', 5.0))
+
+    def _bucket(self, provider: str) -> TokenBucket:
+        # 只在事件循环线程中调用
+        bucket = self._buckets.get(provider)
+        if bucket is None:
+            bucket = TokenBucket(self._rate_limit(provider))
+            self._buckets[provider] = bucket
+        return bucket
+
+    # ---- 延迟统计（用于对冲） ----
+
+    def record_latency(self, provider: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(provider, deque(maxlen=200)).append(seconds)
+
+    def latency_p95(self, provider: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get(provider, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[math.ceil(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self, provider: str) -> float:
+        p95 = self.latency_p95(provider)
+        return HEDGE_DEFAULT_DELAY if p95 is None else max(p95, HEDGE_MIN_DELAY)
+
+    def hedge_candidate(self, provider: str) -> Optional[str]:
+        """对冲目标：配置了密钥、遥测判断可用（未熔断）的其他提供商中p95最低的一个"""
+        candidates = [name for name in self.configured_providers()
+                      if name != provider and self.telemetry.is_healthy(name)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda name: self.latency_p95(name) or HEDGE_DEFAULT_DELAY)
+
+    # ---- 事件循环 ----
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="cloud-api-loop", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+                self._session = None
+                self._buckets = {}
+            return self._loop
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """在后台事件循环上执行协程并同步等待结果"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=32, limit_per_host=8, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    # ---- 请求 ----
+
+    async def _post_once(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                         timeout: float):
+        """发送一次请求，返回(状态码, Retry-After, 响应正文)"""
+        if AIOHTTP_AVAILABLE:
+            session = await self._get_session()
+            async with session.post(url, headers=headers, json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=timeout, connect=5)) as response:
+                return response.status, response.headers.get('Retry-After'), await response.text()
+
+        response = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: http_client.post(url, headers=headers, json=payload, timeout=timeout))
+        return response.status_code, response.headers.get('Retry-After'), response.text
+
+    async def _request(self, provider: str, api_key: str, payload: Dict[str, Any],
+                       deadline: float) -> Dict[str, Any]:
+        """带限速与重试的单个提供商请求"""
+        config = self.providers[provider]
+        headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {api_key}'}
+        payload = dict(payload)
+        attempt = 0
+        while True:
+            await self._bucket(provider).acquire()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CloudAPIError(provider, "请求超时")
+
+            retry_after = None
+            try:
+                status, retry_after, body = await self._post_once(config['base_url'], headers, payload, remaining)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status, body = None, str(e)
+
+            if status is not None and status < 400:
+                try:
+                    return json.loads(body)
+                except ValueError:
+                    raise CloudAPIError(provider, "响应不是合法JSON", status)
+            if status == 400 and 'response_format' in payload and is_response_format_error(body):
+                # 提供商不支持response_format：记住并以普通模式重试（不计入重试次数）
+                mark_response_format_unsupported(provider)
+                payload.pop('response_format')
+                continue
+            if status is not None and status not in RETRY_STATUS_CODES:
+                raise CloudAPIError(provider, f"HTTP {status}: {body[:200]}", status)
+
+            delay = backoff_delay(attempt, retry_after)
+            if attempt >= self.retries or time.monotonic() + delay >= deadline:
+                raise CloudAPIError(provider, f"HTTP {status}" if status else body, status)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _complete(self, provider: str, api_key: str, payload: Dict[str, Any],
+                        deadline: float) -> Dict[str, Any]:
+        start = time.monotonic()
+        model = payload.get('model')
+        try:
+            result = await self._request(provider, api_key, payload, deadline)
+            content = result['choices'][0]['message']['content']
+        except asyncio.CancelledError:
+            # 对冲请求中落败的一方，不计入遥测
+            raise
+        except Exception as e:
+            self.telemetry.record(provider, model, time.monotonic() - start, False, error=str(e)[:200])
+            if isinstance(e, CloudAPIError):
+                raise
+            raise CloudAPIError(provider, "响应缺少choices" if isinstance(e, (KeyError, IndexError, TypeError)) else str(e))
+        elapsed = time.monotonic() - start
+        self.record_latency(provider, elapsed)
+        usage = result.get('usage') or {}
+        self.telemetry.record(provider, model, elapsed, True, usage.get('completion_tokens') or 0)
+        return {
+            "content": content,
+            "provider": provider,
+            "model": model,
+            "latency_ms": round(elapsed * 1000, 1),
+            "usage": usage,
+        }
+
+    def _hedge_payload(self, provider: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """对冲请求使用目标提供商的默认模型"""
+        hedge_payload = dict(payload, model=self.providers[provider]['default_model'])
+        if 'response_format' in hedge_payload and response_format_for(provider) is None:
+            hedge_payload.pop('response_format')
+        return hedge_payload
+
+    async def chat(self, provider: str, payload: Dict[str, Any], api_key: str,
+                   timeout: float = 30.0, hedge: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        发送chat/completions请求
+        开启对冲时，主请求超过p95延迟（或失败）后向备用提供商发出第二个请求，返回先成功的结果
+        """
+        deadline = time.monotonic() + timeout
+        primary = asyncio.ensure_future(self._complete(provider, api_key, payload, deadline))
+        hedge_provider = self.hedge_candidate(provider) if (self.hedge if hedge is None else hedge) else None
+        if hedge_provider is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(provider))
+        if done and not primary.exception():
+            return primary.result()
+
+        if not self.telemetry.claim(hedge_provider):
+            # 等待期间对冲目标被熔断（或半开试探名额已被占用）
+            return await primary
+        backup = asyncio.ensure_future(self._complete(
+            hedge_provider, self.resolve_key(hedge_provider),
+            self._hedge_payload(hedge_provider, payload), deadline))
+        pending = {backup} if done else {primary, backup}
+        last_error = primary.exception() if done else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        result = task.result()
+                        result["hedged"] = True
+                        return result
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def chat_completion(self, provider: str, payload: Dict[str, Any], api_key: str = "",
+                        timeout: float = 30.0, hedge: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        同步接口（ComfyUI执行线程调用）
+        :return: {"content", "provider", "model", "latency_ms", "usage"}，对冲请求胜出时带"hedged": True
+                 （provider/model为实际返回结果的提供商与模型）；失败时抛出CloudAPIError
+        """
+        if provider == AUTO_PROVIDER:
+            # 节点上的密钥与模型属于手动选择的提供商，auto只使用环境变量密钥与默认模型
+            provider = self.route()
+            api_key = ""
+            payload = dict(payload, model=None)
+        provider = self.resolve_provider(provider)
+        api_key = self.resolve_key(provider, api_key)
+        if not api_key:
+            raise CloudAPIError(provider, "未配置API密钥")
+        payload = dict(payload, model=payload.get('model') or self.providers[provider]['default_model'])
+        # 留出少量余量，让协程自己的超时先触发
+        return self.run(self.chat(provider, payload, api_key, timeout, hedge), timeout + 5)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for name in self.providers:
+            with self._lock:
+                samples = len(self._latencies.get(name, ()))
+            p95 = self.latency_p95(name)
+            stats[name] = {
+                "configured": bool(self.resolve_key(name)),
+                "healthy": self.telemetry.is_healthy(name),
+                "samples": samples,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "rate_limit": self._rate_limit(name),
+            }
+        return stats
+
+    def close(self):
+        """关闭aiohttp会话并停止后台事件循环"""
+        with self._lock:
+            loop, thread, session = self._loop, self._thread, self._session
+            self._loop, self._thread, self._session = None, None, None
+        if loop is None:
+            return
+        if session is not None:
+            asyncio.run_coroutine_threadsafe(session.close(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        if not thread.is_alive():
+            loop.close()
+
+
+# 全局实例
+cloud_client = CloudAPIClient()
+
+
+if WEB_AVAILABLE:
+    @PromptServer.instance.routes.get("/cloud_api/telemetry")
+    async def get_cloud_api_telemetry(request):
+        """按提供商/模型的延迟直方图、tokens/s与错误率，以及auto当前的路由目标"""
+        try:
+            configured = cloud_client.configured_providers()
+            return web.json_response({
+                "success": True,
+                "auto_route": cloud_client.route() if configured else None,
+                "clients": cloud_client.stats(),
+                **cloud_client.telemetry.snapshot(),
+            })
+        except Exception as e:
+            return web.json_response({"success": False, "message": str(e)}, status=500)
+
+    @PromptServer.instance.routes.post("/cloud_api/telemetry/reset")
+    async def reset_cloud_api_telemetry(request):
+        """清空遥测数据（可指定provider）"""
+        try:
+            data = await request.json() if request.can_read_body else {}
+            cloud_client.telemetry.reset(data.get("provider"))
+            return web.json_response({"success": True})
+        except Exception as e:
+            return web.json_response({"success": False, "message": str(e)}, status=500)
+
+
+def benchmark(requests_count: int = 100, slow_ratio: float = 0.04) -> Dict[str, Any]:
+    """
+    本地模拟两个提供商：主提供商通常0.2s返回，slow_ratio比例的请求退化为3s；备用提供商稳定0.3s
+    对比不对冲与对冲时的延迟分布
+    """
+    import statistics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class FakeProviderHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path.startswith("/primary"):
+                time.sleep(3.0 if random.random() < slow_ratio else 0.2)
+            else:
+                time.sleep(0.3)
+            body = json.dumps({"choices": [{"message": {"content": '{"instruction": "ok"}'}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 对冲胜出后被取消的请求
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeProviderHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.setdefault("BENCH_PRIMARY_KEY", "bench")
+    os.environ.setdefault("BENCH_BACKUP_KEY", "bench")
+    providers = {
+        "primary": {"base_url": f"{base}/primary", "default_model": "a", "env_key": "BENCH_PRIMARY_KEY", "rate_limit": 1000},
+        "backup": {"base_url": f"{base}/backup", "default_model": "b", "env_key": "BENCH_BACKUP_KEY", "rate_limit": 1000},
+    }
+    payload = {"messages": [{"role": "user", "content": "hi"}]}
+
+    def measure(client: CloudAPIClient) -> Dict[str, float]:
+        # 预热：积累p95样本
+        for _ in range(HEDGE_MIN_SAMPLES):
+            client.chat_completion("primary", payload, hedge=False)
+        samples = []
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            client.chat_completion("primary", payload)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        return {
+            "mean_ms": round(statistics.mean(samples), 1),
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 1),
+            "max_ms": round(samples[-1], 1),
+        }
+
+    results = {"requests": requests_count, "slow_ratio": slow_ratio}
+    try:
+        for name, hedge in (("no_hedge", False), ("hedged", True)):
+            client = CloudAPIClient(providers, hedge=hedge, telemetry=ProviderTelemetry(persist=False))
+            try:
+                results[name] = measure(client)
+            finally:
+                client.close()
+        return results
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="对冲请求尾延迟基准测试")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--slow-ratio", type=float, default=0.04)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.requests, args.slow_ratio), indent=2, ensure_ascii=False))
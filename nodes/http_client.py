@@ -0,0 +1,331 @@
+"""
+Shared HTTP Client
+共享HTTP客户端 - 所有LLM后端（Ollama、TextGen WebUI、云端API）复用的连接池
+
+功能：
+- 每个主机独立的连接池，HTTP keep-alive，重复生成无需重新建立TCP/TLS连接
+- 统一的超时设置（连接超时与读取超时分开）
+- 重试策略：连接失败对所有方法重试；429/502/503/504只对幂等方法重试
+- 可选HTTP/2：安装httpx[http2]并设置 HTTP_CLIENT_HTTP2=1 时，HTTPS请求使用HTTP/2
+- 熔断器：后端默认视为可用，连续失败后断开，冷却后半开试探，取代每次调用前的健康检查
+
+基准测试：
+    python nodes/http_client.py [--url URL] [--requests N]
+未指定URL时启动本地HTTP服务进行对比
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+    requests = None
+
+try:
+    import httpx
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+TimeoutType = Union[None, float, Tuple[float, float]]
+
+# 可以安全重试的状态码
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class PooledHTTPClient:
+    """按主机复用连接的HTTP客户端（线程安全）"""
+
+    def __init__(self, pool_maxsize: int = 16, retries: int = 2, backoff_factor: float = 0.3,
+                 connect_timeout: float = 5.0, http2: Optional[bool] = None):
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.connect_timeout = connect_timeout
+        if http2 is None:
+            http2 = os.getenv("HTTP_CLIENT_HTTP2", "0").lower() in ("1", "true", "yes")
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._sessions: Dict[str, Any] = {}
+        self._http2_clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _build_session(self):
+        session = requests.Session()
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            backoff_factor=self.backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session_for(self, url: str):
+        """获取主机对应的requests.Session（不存在时创建）"""
+        key = self._host_key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._build_session()
+                self._sessions[key] = session
+            return session
+
+    def _http2_client_for(self, url: str):
+        key = self._host_key(url)
+        with self._lock:
+            client = self._http2_clients.get(key)
+            if client is None:
+                # 传入transport时Client会忽略自己的limits参数，连接池上限必须设置在transport上
+                client = httpx.Client(
+                    http2=True,
+                    transport=httpx.HTTPTransport(
+                        http2=True, retries=self.retries,
+                        limits=httpx.Limits(max_keepalive_connections=self.pool_maxsize),
+                    ),
+                )
+                self._http2_clients[key] = client
+            return client
+
+    def _normalize_timeout(self, timeout: TimeoutType) -> TimeoutType:
+        """单个数值视为读取超时，连接超时使用较短的统一值"""
+        if isinstance(timeout, (int, float)):
+            return (min(self.connect_timeout, float(timeout)), float(timeout))
+        return timeout
+
+    def _record(self, url: str, elapsed: float, error: bool):
+        key = self._host_key(url)
+        with self._lock:
+            stats = self._stats.setdefault(key, {"requests": 0, "errors": 0, "total_ms": 0.0})
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["total_ms"] += elapsed * 1000
+
+    def request(self, method: str, url: str, timeout: TimeoutType = 30, **kwargs):
+        """
+        发送请求，参数与requests.request一致
+        HTTP/2开启时HTTPS非流式请求通过httpx发送（返回的响应对象接口兼容常用属性）
+        """
+        if not REQUESTS_AVAILABLE:
+            raise Exception("requests库未安装，无法发送HTTP请求")
+
+        start = time.perf_counter()
+        error = True
+        try:
+            if self.http2 and url.startswith("https://") and not kwargs.get("stream"):
+                read_timeout = self._normalize_timeout(timeout)
+                if isinstance(read_timeout, tuple):
+                    read_timeout = httpx.Timeout(read_timeout[1], connect=read_timeout[0])
+                response = self._http2_client_for(url).request(method, url, timeout=read_timeout, **kwargs)
+            else:
+                response = self.session_for(url).request(
+                    method, url, timeout=self._normalize_timeout(timeout), **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            self._record(url, time.perf_counter() - start, error)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """按主机统计请求数、错误数和平均延迟"""
+        with self._lock:
+            return {
+                host: {**values, "avg_ms": round(values["total_ms"] / values["requests"], 2) if values["requests"] else 0.0}
+                for host, values in self._stats.items()
+            }
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            for client in self._http2_clients.values():
+                client.close()
+            self._sessions.clear()
+            self._http2_clients.clear()
+
+
+class CircuitBreaker:
+    """
+    熔断器（closed → open → half_open → closed）
+    - closed: 正常放行，连续失败达到阈值后断开
+    - open: 冷却期内直接拒绝，不产生网络请求
+    - half_open: 冷却结束后只放行一个试探请求，成功则恢复，失败则重新断开
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.time() - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half_open"
+                self._probe_in_flight = False
+            # 试探请求未上报结果且超过冷却时间时，允许新的试探
+            if self._probe_in_flight and time.time() - self._probe_started < self.cooldown:
+                return False
+            self._probe_in_flight = True
+            self._probe_started = time.time()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.last_error = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Optional[str] = None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = error
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def retry_after(self) -> float:
+        """断开状态下距离半开还需等待的秒数"""
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(self.cooldown - (time.time() - self.opened_at), 0.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": round(self.retry_after(), 1),
+            "last_error": self.last_error,
+        }
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str, failure_threshold: int = 3, cooldown: float = 30.0) -> CircuitBreaker:
+    """按主机获取共享的熔断器"""
+    key = PooledHTTPClient._host_key(url) if "://" in url else url
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(failure_threshold, cooldown)
+            _circuit_breakers[key] = breaker
+        return breaker
+
+
+# 全局实例
+http_client = PooledHTTPClient()
+
+
+def benchmark(url: str, requests_count: int = 50, method: str = "GET") -> Dict[str, Any]:
+    """
+    对比每次新建连接（模块级requests调用）与连接池的单次请求延迟
+    :return: 两种方式的平均/中位延迟（毫秒）及每次请求节省的时间
+    """
+    import statistics
+
+    def measure(send) -> Dict[str, float]:
+        samples = []
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            send(method, url, timeout=10).content
+            samples.append((time.perf_counter() - start) * 1000)
+        return {"mean_ms": round(statistics.mean(samples), 3), "median_ms": round(statistics.median(samples), 3)}
+
+    client = PooledHTTPClient()
+    client.request(method, url, timeout=10)  # 预热：建立连接
+    try:
+        fresh = measure(requests.request)
+        pooled = measure(client.request)
+    finally:
+        client.close()
+
+    return {
+        "url": url,
+        "requests": requests_count,
+        "fresh_connection": fresh,
+        "pooled": pooled,
+        "saved_per_request_ms": round(fresh["mean_ms"] - pooled["mean_ms"], 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    parser = argparse.ArgumentParser(description="连接池延迟基准测试")
+    parser.add_argument("--url", help="测试地址，例如 http://127.0.0.1:11434/api/tags 或云端API的models接口")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        class KeepAliveHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 头部与正文分两次写入，关闭Nagle避免与延迟ACK叠加产生40ms停顿
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                body = b'{"models": []}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/tags"
+
+    try:
+        print(json.dumps(benchmark(url, args.requests), indent=2, ensure_ascii=False))
+    finally:
+        if server is not None:
+            server.shutdown()
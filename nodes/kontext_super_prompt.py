@@ -293,6 +293,22 @@ try:
 except ImportError:
     COMFY_AVAILABLE = False
 
+try:
+    from ollama_service_manager import keep_alive_scheduler
+    SCHEDULER_AVAILABLE = True
+except ImportError:
+    keep_alive_scheduler = None
+    SCHEDULER_AVAILABLE = False
+
+from ollama_endpoint_pool import endpoint_pool
+from prompt_cache import prompt_cache
+from ollama_streaming import stream_generate, instruction_complete, apply_reasoning_mode, record_reasoning_result
+from cloud_api_client import cloud_client, PROVIDERS, AUTO_PROVIDER
+from response_cleaner import (clean_api_response, extract_prompt_from_api_output,
+                              extract_prompt_from_ollama_output, has_cjk)
+from structured_output import (STRUCTURED_OUTPUT_ENABLED, with_json_rule, ollama_format, response_format_for,
+                               parse_instruction, instruction_json_complete)
+
 CATEGORY_TYPE = "🎨 Super Canvas"
 
 class KontextSuperPrompt:
@@ -411,6 +427,9 @@ class KontextSuperPrompt:
                 "ollama_custom_guidance": ("STRING", {"default": "", "multiline": True}),
                 "ollama_enable_visual": ("BOOLEAN", {"default": ollama_settings.get("enable_visual", False)}),
                 "ollama_auto_unload": ("BOOLEAN", {"default": ollama_settings.get("auto_unload", False)}),
+                "ollama_stream": ("BOOLEAN", {"default": True}),
+                # 提前停止需显式开启，默认返回完整输出
+                "ollama_early_stop": ("BOOLEAN", {"default": False}),
                 
                 # 兼容旧版本 - 保留原始字段
                 "description": ("STRING", {"default": "", "multiline": True}),
@@ -513,7 +532,7 @@ class KontextSuperPrompt:
                            ollama_temperature=0.7, ollama_editing_intent="general_editing", 
                            ollama_processing_style="auto_smart", ollama_seed=42, 
                            ollama_custom_guidance="", ollama_enable_visual=False,
-                           ollama_auto_unload=False):
+                           ollama_auto_unload=False, ollama_stream=True, ollama_early_stop=False):
         """
         处理Kontext超级提示词生成
         """
@@ -526,13 +545,15 @@ class KontextSuperPrompt:
                     
                     # 如果是API模式，保存API设置和密钥
                     if tab_mode == "api":
-                        if api_key and api_key.strip():
+                        # auto不是真实提供商，密钥按路由选中的提供商各自读取，不能存到"auto"名下
+                        is_auto = api_provider == AUTO_PROVIDER
+                        if api_key and api_key.strip() and not is_auto:
                             save_api_key(api_provider, api_key.strip())
                         
                         save_api_settings(api_provider, api_model, api_editing_intent, api_processing_style)
                         
                         # 如果没有提供API密钥，尝试从配置加载
-                        if not api_key or not api_key.strip():
+                        if not is_auto and (not api_key or not api_key.strip()):
                             saved_key = get_api_key(api_provider)
                             if saved_key:
                                 api_key = saved_key
@@ -563,7 +584,7 @@ class KontextSuperPrompt:
                     print(f"[DEBUG] 内容前100字符: {generated_prompt[:100]}...")
                     final_generated_prompt = self._extract_clean_prompt_from_api_output(generated_prompt.strip())
                     print(f"[DEBUG] 清理后: {final_generated_prompt}")
-                elif api_key:
+                elif cloud_client.has_key(api_provider, api_key):
                     final_generated_prompt = self.process_api_mode(
                         layer_info, description, api_provider, api_key, api_model,
                         api_editing_intent, api_processing_style, api_seed, 
@@ -583,7 +604,8 @@ class KontextSuperPrompt:
                     final_generated_prompt = self.process_ollama_mode(
                         layer_info, description, ollama_url, ollama_model, ollama_temperature,
                         ollama_editing_intent, ollama_processing_style, ollama_seed,
-                        ollama_custom_guidance, ollama_enable_visual, ollama_auto_unload, image
+                        ollama_custom_guidance, ollama_enable_visual, ollama_auto_unload, image,
+                        stream=ollama_stream, node_id=unique_id, early_stop=ollama_early_stop
                     )
                 else:
                     final_generated_prompt = ""
@@ -782,32 +804,30 @@ class KontextSuperPrompt:
                         editing_intent, processing_style, seed, custom_guidance, image):
         """处理API模式的提示词生成"""
         try:
-            import requests
             import re
             import hashlib
             
+            # 节点未填写密钥时使用环境变量中的密钥
+            # auto：路由到当前最快的健康提供商，节点上的密钥与模型属于手动选择的提供商，因此不使用
+            auto_route = api_provider == AUTO_PROVIDER
+            provider = cloud_client.resolve_provider(api_provider)
+            api_key = cloud_client.resolve_key(provider, "" if auto_route else api_key)
             if not api_key:
                 return f"API密钥为空: {description or '无描述'}"
             
-            # API提供商配置
-            api_configs = {
-                'siliconflow': {
-                    'base_url': 'https://api.siliconflow.cn/v1/chat/completions',
-                    'default_model': 'deepseek-ai/DeepSeek-V3'
-                },
-                'zhipu': {
-                    'base_url': 'https://open.bigmodel.cn/api/paas/v4/chat/completions',
-                    'default_model': 'glm-4.5'
-                },
-                'deepseek': {
-                    'base_url': 'https://api.deepseek.com/v1/chat/completions',
-                    'default_model': 'deepseek-chat'
-                }
-            }
+            # 提示词中包含时间随机量，缓存键使用随机化之前的节点输入
+            cache_key = prompt_cache.make_key(
+                "super_prompt_api", f"{api_provider}/{api_model}", user_prompt=description, seed=seed,
+                editing_intent=editing_intent, processing_style=processing_style,
+                custom_guidance=custom_guidance, layer_info=layer_info,
+                structured_output=STRUCTURED_OUTPUT_ENABLED
+            )
+            cached_prompt = prompt_cache.get(cache_key)
+            if cached_prompt:
+                return cached_prompt
             
             # 获取API配置
-            api_config = api_configs.get(api_provider, api_configs['siliconflow'])
-            model = api_model or api_config['default_model']
+            model = (None if auto_route else api_model) or PROVIDERS[provider]['default_model']
             
             # 使用智能约束生成器生成优化提示词
             constraint_generator = IntelligentConstraintGenerator()
@@ -909,11 +929,10 @@ Confidence target: {optimized_prompt.execution_confidence:.2f}
 
 REMEMBER: ENGLISH ONLY! Apply all constraints from system prompt!"""
             
-            # 发送API请求
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {api_key}'
-            }
+            # 结构化输出：要求模型直接返回{"instruction": ...}
+            response_format = response_format_for(provider) if STRUCTURED_OUTPUT_ENABLED else None
+            if response_format:
+                system_prompt = with_json_rule(system_prompt)
             
             data = {
                 'model': model,
@@ -928,20 +947,20 @@ REMEMBER: ENGLISH ONLY! Apply all constraints from system prompt!"""
                 'frequency_penalty': 0.1,  # 增加多样性
                 'language': 'en'  # 强制英文输出（某些API支持）
             }
+            if response_format:
+                data['response_format'] = response_format
             
-            response = requests.post(api_config['base_url'], headers=headers, json=data, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            api_response = result['choices'][0]['message']['content']
+            # 限速、重试与对冲请求由云端客户端处理
+            completion = cloud_client.chat_completion(provider, data, api_key=api_key, timeout=30)
+            api_response = completion['content']
             
             # 调试：显示原始响应
             
-            # 清理响应，提取纯净提示词
-            cleaned_response = self._clean_api_response(api_response)
+            # 结构化输出解析成功时无需清理，否则提取纯净提示词
+            cleaned_response = parse_instruction(api_response) or self._clean_api_response(api_response)
             
             # 二次验证：确保没有中文
-            if cleaned_response and any('\u4e00' <= char <= '\u9fff' for char in cleaned_response):
+            if cleaned_response and has_cjk(cleaned_response):
                 # 根据描述生成备用英文
                 if 'color' in description.lower() or '颜色' in description:
                     return "Transform the selected area to the specified color with natural blending"
@@ -954,6 +973,9 @@ REMEMBER: ENGLISH ONLY! Apply all constraints from system prompt!"""
                 else:
                     return "Edit the selected area according to the specified requirements"
             
+            # 对冲请求胜出时结果来自其他提供商的模型，不能缓存在用户选择的提供商/模型键下
+            if cleaned_response and not completion.get("hedged"):
+                prompt_cache.set(cache_key, cleaned_response, "super_prompt_api")
             return cleaned_response if cleaned_response else "Apply professional editing to the marked area"
                 
         except Exception as e:
@@ -961,10 +983,25 @@ REMEMBER: ENGLISH ONLY! Apply all constraints from system prompt!"""
     
     def process_ollama_mode(self, layer_info, description, ollama_url, ollama_model, 
                            temperature, editing_intent, processing_style, seed,
-                           custom_guidance, enable_visual, auto_unload, image):
-        """处理Ollama模式的提示词生成 - 集成增强约束系统"""
+                           custom_guidance, enable_visual, auto_unload, image,
+                           stream=False, node_id=None, early_stop=False):
+        """
+        处理Ollama模式的提示词生成 - 集成增强约束系统
+        stream为True时流式推送到前端；early_stop为True时得到满50词的完整句子即停止
+        """
         try:
-            import requests
+            cache_key = prompt_cache.make_key(
+                "super_prompt_ollama", ollama_model, user_prompt=description, temperature=temperature,
+                seed=seed, editing_intent=editing_intent, processing_style=processing_style,
+                custom_guidance=custom_guidance, layer_info=layer_info,
+                # 不同主机上的同名模型可能是不同的权重
+                ollama_url=(ollama_url or "").rstrip("/"),
+                # 提前停止的结果与完整输出、JSON与自由文本的结果不能互相复用
+                early_stop=bool(early_stop), structured_output=STRUCTURED_OUTPUT_ENABLED
+            )
+            cached_prompt = prompt_cache.get(cache_key)
+            if cached_prompt:
+                return cached_prompt
             
             # 使用智能约束生成器
             constraint_generator = IntelligentConstraintGenerator()
@@ -1028,36 +1065,69 @@ APPLY ALL SYSTEM CONSTRAINTS and generate precise English instruction (50-100 wo
 
 OUTPUT IN ENGLISH ONLY with enhanced constraint application!"""
             
+            if STRUCTURED_OUTPUT_ENABLED:
+                system_prompt = with_json_rule(system_prompt)
+            
             # 调用Ollama API
-            response = requests.post(
-                f"{ollama_url}/api/generate",
-                json={
-                    "model": ollama_model,
-                    "prompt": user_prompt,
-                    "system": system_prompt,
-                    "temperature": temperature,
-                    "seed": seed,
-                    "stream": False,
-                    "options": {
-                        "num_predict": 200,  # 限制输出长度
-                        "stop": ["\n\n", "###", "---"],  # 停止标记
-                    }
-                },
-                timeout=30
-            )
+            payload = {
+                "model": ollama_model,
+                "prompt": user_prompt,
+                "system": system_prompt,
+                "temperature": temperature,
+                "seed": seed,
+                "stream": False,
+                "options": {
+                    "num_predict": 200,  # 限制输出长度
+                    "stop": ["\n\n", "###", "---"],  # 停止标记
+                }
+            }
+            if STRUCTURED_OUTPUT_ENABLED:
+                # 按JSON Schema约束输出，JSON闭合即结束
+                payload["format"] = ollama_format()
+            if SCHEDULER_AVAILABLE:
+                # 由调度器统一管理keep_alive，保持模型常驻以避免冷加载（调度器关闭时不设置）
+                keep_alive = keep_alive_scheduler.get_keep_alive(ollama_model)
+                if keep_alive is not None:
+                    payload["keep_alive"] = keep_alive
+            
+            # 推理模型：服务端支持时关闭思考，否则强制流式（early_stop时截断思考之后的指令）
+            reasoning_mode = apply_reasoning_mode(payload, ollama_model, ollama_url)
             
-            if response.status_code == 200:
-                result = response.json()
+            if stream or reasoning_mode == "stream_cut":
+                # 流式生成：结构化输出时JSON闭合即停止；自由文本只在early_stop时累计满50词的完整句子后停止
+                if STRUCTURED_OUTPUT_ENABLED:
+                    stop_when = instruction_json_complete
+                else:
+                    stop_when = instruction_complete(min_words=50) if early_stop else None
+                result, endpoint_url = stream_generate(
+                    payload, model=ollama_model, base_url=ollama_url, timeout=30, node_id=node_id,
+                    stop_when=stop_when
+                )
+                status_code = 200
+            else:
+                # 通过端点池路由（多主机时负载均衡并自动故障转移）
+                response, endpoint_url = endpoint_pool.post(
+                    "/api/generate", payload, model=ollama_model, base_url=ollama_url, timeout=30
+                )
+                status_code = response.status_code
+                result = response.json() if status_code == 200 else {}
+            if SCHEDULER_AVAILABLE:
+                keep_alive_scheduler.touch(ollama_model, endpoint_url)
+            record_reasoning_result(ollama_model, reasoning_mode, result, payload["options"]["num_predict"])
+            
+            if status_code == 200:
                 generated_text = result.get('response', '')
                 
-                # 清理和验证输出
-                cleaned_text = self._clean_api_response(generated_text)
+                # 结构化输出解析成功时无需清理，否则清理和验证输出
+                cleaned_text = parse_instruction(generated_text) or self._clean_api_response(generated_text)
                 
                 # 检查是否包含中文字符
-                if any('\u4e00' <= char <= '\u9fff' for char in cleaned_text):
+                if has_cjk(cleaned_text):
                     # 如果包含中文，返回默认英文
                     return f"Transform marked area as requested: {description}"
                 
+                if cleaned_text:
+                    prompt_cache.set(cache_key, cleaned_text, "super_prompt_ollama")
                 return cleaned_text if cleaned_text else f"Transform marked area: {description}"
             else:
                 return f"Ollama request failed: {description}"
@@ -1068,160 +1138,15 @@ OUTPUT IN ENGLISH ONLY with enhanced constraint application!"""
     
     def _clean_api_response(self, response):
         """清理API响应，确保只输出英文提示词"""
-        import re
-        
-        if not response:
-            return "Edit the selected area as requested"
-        
-        # 检测中文字符
-        chinese_pattern = re.compile('[\u4e00-\u9fff]+')
-        has_chinese = bool(chinese_pattern.search(response))
-        
-        # 如果包含中文，进行强力处理
-        if has_chinese:
-            
-            # 尝试提取所有英文句子
-            english_sentences = re.findall(r'[A-Z][a-zA-Z\s,\.\-;:]+[\.]', response)
-            if english_sentences:
-                # 找到最长的英文句子
-                longest = max(english_sentences, key=len)
-                if len(longest) > 30:
-                    return longest.strip()
-            
-            # 尝试提取任何英文片段
-            english_parts = re.findall(r'[a-zA-Z][a-zA-Z\s,\.\-]+', response)
-            if english_parts:
-                # 过滤太短的片段
-                valid_parts = [p for p in english_parts if len(p) > 10]
-                if valid_parts:
-                    # 合并有效的英文部分
-                    english_text = ' '.join(valid_parts)
-                    if len(english_text) > 20:
-                        return english_text.strip()
-            
-            # 如果无法提取有效英文，返回通用英文指令
-            return "Apply the requested editing to the marked area with professional quality"
-        
-        # 如果响应包含多个Prompt编号，只提取第一个
-        if '### Prompt' in response or 'Prompt 1:' in response:
-            
-            # 尝试提取第一个引号内的提示词
-            first_quoted_match = re.search(r'"([^"]{30,})"', response)
-            if first_quoted_match:
-                return first_quoted_match.group(1).strip()
-            
-            # 尝试提取第一个提示词段落
-            first_prompt_match = re.search(r'(?:Prompt \d+:.*?)"([^"]+)"', response, re.DOTALL)
-            if first_prompt_match:
-                return first_prompt_match.group(1).strip()
-        
-        # 尝试提取引号中的提示词
-        quoted_match = re.search(r'"([^"]{30,})"', response)
-        if quoted_match:
-            return quoted_match.group(1).strip()
-        
-        # 清理标题和前缀
-        patterns_to_remove = [
-            r'^###.*$',            # 移除Markdown标题
-            r'^Prompt \d+:.*$',    # 移除"Prompt 1:"等
-            r'^---.*$',            # 移除分隔线
-            r'^.*?prompt:\s*',     # 移除prompt前缀
-        ]
-        
-        cleaned = response.strip()
-        
-        # 尝试提取代码块中的提示词
-        code_block_match = re.search(r'```[^`]*?\n(.*?)\n```', response, re.DOTALL)
-        if code_block_match and len(code_block_match.group(1).strip()) > 20:
-            return code_block_match.group(1).strip()
-        
-        # 应用清理模式
-        for pattern in patterns_to_remove:
-            cleaned = re.sub(pattern, '', cleaned, flags=re.MULTILINE | re.IGNORECASE)
-        
-        # 清理多余空行
-        cleaned = re.sub(r'\n{2,}', '\n', cleaned).strip()
-        
-        # 如果没有做任何处理或结果太短，返回原始内容
-        if not cleaned or len(cleaned) < 10:
-            return response.strip()
-        
-        return cleaned.strip()
+        return clean_api_response(response)
     
     def _extract_clean_prompt_from_api_output(self, api_output):
         """从API输出中提取纯净的提示词"""
-        
-        # 调试输出
-        print(f"[DEBUG] 开始提取，输入长度: {len(api_output)}")
-        
-        # 方法1: 查找"生成的提示词:"并提取之后的所有内容
-        markers = ['生成的提示词:', '生成的提示词：']
-        for marker in markers:
-            if marker in api_output:
-                # 找到标记的位置
-                idx = api_output.index(marker)
-                # 提取标记后的所有内容
-                after_marker = api_output[idx + len(marker):].strip()
-                
-                # 如果有内容，处理并返回
-                if after_marker:
-                    # 按行分割，取第一个非空行（通常就是提示词）
-                    lines = after_marker.split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if line and not line.startswith('✅'):
-                            # 去除可能的引号
-                            clean = line.strip('"').strip("'").strip()
-                            print(f"[DEBUG] 提取成功: {clean}")
-                            return clean
-        
-        # 方法2: 提取最后一个有意义的行
-        lines = api_output.strip().split('\n')
-        for line in reversed(lines):
-            line = line.strip()
-            # 跳过调试信息行
-            if (line and 
-                not line.startswith('✅') and 
-                not line.startswith('模型:') and 
-                not line.startswith('输入:') and
-                len(line) > 20):  # 确保是实际的提示词，不是短标签
-                clean = line.strip('"').strip("'").strip()
-                print(f"[DEBUG] 通过最后一行提取: {clean}")
-                return clean
-        
-        # 如果都失败了，返回原始内容
-        print(f"[DEBUG] 提取失败，返回原始内容")
-        return api_output.strip()
+        return extract_prompt_from_api_output(api_output)
     
     def _extract_clean_prompt_from_ollama_output(self, ollama_output):
         """从Ollama输出中提取纯净的提示词"""
-        import re
-        
-        # 与_extract_clean_prompt_from_api_output类似的逻辑
-        if '生成的提示词:' in ollama_output or '生成的提示词\uff1a' in ollama_output:
-            pattern = r'生成的提示词[:：]\s*\n?(.+?)$'
-            match = re.search(pattern, ollama_output, re.DOTALL)
-            if match:
-                clean_prompt = match.group(1).strip()
-                clean_prompt = clean_prompt.strip('"').strip("'").strip()
-                return clean_prompt
-        
-        if 'generated prompt:' in ollama_output.lower() or 'prompt:' in ollama_output.lower():
-            pattern = r'(?:generated prompt:|prompt:)\s*(.+?)(?:\n\n|$)'
-            match = re.search(pattern, ollama_output, re.IGNORECASE | re.DOTALL)
-            if match:
-                clean_prompt = match.group(1).strip()
-                clean_prompt = clean_prompt.strip('"').strip("'").strip()
-                return clean_prompt
-        
-        # 提取最后一行有效内容
-        lines = ollama_output.strip().split('\n')
-        for line in reversed(lines):
-            line = line.strip()
-            if line and not line.startswith('✅') and not line.startswith('模型:') and not line.startswith('输入:'):
-                return line.strip('"').strip("'").strip()
-        
-        return ollama_output.strip()
+        return extract_prompt_from_ollama_output(ollama_output)
 
 
 # 注册节点
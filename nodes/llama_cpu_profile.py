@@ -0,0 +1,307 @@
+"""
+Llama CPU Profile
+llama.cpp执行参数自动调优 - 面向纯CPU服务器
+
+功能：
+- 线程数按物理核心（而非逻辑线程）计算，并为其他节点预留核心
+- 多NUMA节点时使用ISOLATE策略，线程固定在当前节点，线程数取该节点的物理核心数
+- n_ctx根据模型模板（系统提示词与格式说明）、max_tokens与编辑要求的余量按2的幂取整，
+  每个模型与模板只确定一次，不再固定分配4096的KV缓存
+- KV缓存量化为q8_0（需要flash_attn；flash_attn、type_k、type_v作为一组，旧版llama-cpp-python
+  不支持flash_attn时整组跳过，创建上下文失败时由注册表改用f16 KV缓存重试）
+- 基准测试：在本机比较多组线程数与KV类型，最佳结果按机器与模型保存到user_data
+
+配置（环境变量）：
+- LLAMA_RESERVED_CORES 为其他节点预留的物理核心数（默认1）
+- LLAMA_KV_QUANT=0 关闭KV缓存量化
+- LLAMA_REQUEST_HEADROOM 为编辑要求预留的token数（默认512）
+
+基准测试：
+    python nodes/llama_cpu_profile.py path/to/model.gguf [--max-tokens 128]
+"""
+
+import glob
+import inspect
+import json
+import os
+import platform
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    from llama_cpp import Llama
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# 基准测试结果保存位置
+PROFILE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "user_data", "llama_cpu_profile.json"
+)
+
+# ggml类型与NUMA策略编号（与llama.cpp枚举一致）
+GGML_TYPE_F16 = 1
+GGML_TYPE_Q8_0 = 8
+GGML_NUMA_STRATEGY_ISOLATE = 2
+
+MIN_CONTEXT = 512
+MAX_CONTEXT = 32768
+# 编辑要求（每次请求不同的部分）预留的token数
+REQUEST_HEADROOM = int(os.getenv("LLAMA_REQUEST_HEADROOM", 512))
+# KV缓存量化参数：llama.cpp只在flash_attn开启时接受量化的V缓存，三者必须一起保留或一起去掉
+KV_QUANT_KEYS = ("flash_attn", "type_k", "type_v")
+
+
+def _parse_cpulist(text: str) -> List[int]:
+    """解析"0-3,8-11"格式的CPU列表"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes() -> List[List[int]]:
+    """返回每个NUMA节点的CPU编号（非Linux或无法读取时视为单节点）"""
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        try:
+            with open(path, "r") as f:
+                cpus = _parse_cpulist(f.read())
+            if cpus:
+                nodes.append(cpus)
+        except OSError:
+            continue
+    return nodes
+
+
+def physical_cores() -> int:
+    """当前进程可用的物理核心数"""
+    logical = os.cpu_count() or 1
+    physical = (psutil.cpu_count(logical=False) if PSUTIL_AVAILABLE else None) or max(logical // 2, 1)
+    if hasattr(os, "sched_getaffinity"):
+        # 受cgroup/taskset限制时按可用逻辑CPU等比例折算
+        allowed = len(os.sched_getaffinity(0))
+        physical = max(round(physical * allowed / logical), 1)
+    return physical
+
+
+def cpu_topology() -> Dict[str, Any]:
+    nodes = numa_nodes()
+    physical = physical_cores()
+    logical = os.cpu_count() or 1
+    cores_per_node = max(physical // len(nodes), 1) if len(nodes) > 1 else physical
+    return {
+        "physical_cores": physical,
+        "logical_cpus": logical,
+        "numa_nodes": max(len(nodes), 1),
+        "cores_per_numa_node": cores_per_node,
+    }
+
+
+def machine_fingerprint() -> str:
+    topology = cpu_topology()
+    return f"{platform.machine()}|{platform.processor() or platform.system()}|{topology['physical_cores']}c|{topology['numa_nodes']}n"
+
+
+def estimate_tokens(text: str) -> int:
+    """保守估计token数：中文约1 token/字（UTF-8 3字节），英文约4字符/token"""
+    return len(text.encode("utf-8")) // 3 + 16
+
+
+def context_size(prompt: str, max_tokens: int) -> int:
+    """
+    根据提示词与max_tokens计算n_ctx（2的幂，最少512）
+    取整后同一节点的不同请求通常落在同一档位，模型注册表无需重新加载
+    """
+    needed = max(estimate_tokens(prompt), MIN_CONTEXT) + max_tokens
+    n_ctx = MIN_CONTEXT
+    while n_ctx < needed and n_ctx < MAX_CONTEXT:
+        n_ctx *= 2
+    return n_ctx
+
+
+def _supported_params() -> Optional[set]:
+    if not LLAMA_CPP_AVAILABLE:
+        return None
+    try:
+        return set(inspect.signature(Llama.__init__).parameters)
+    except (TypeError, ValueError):
+        return None
+
+
+def without_kv_quant(params: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉KV缓存量化参数（使用默认的f16 KV缓存）"""
+    return {k: v for k, v in params.items() if k not in KV_QUANT_KEYS}
+
+
+def _filter_supported(params: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉当前llama-cpp-python版本不支持的参数（KV缓存量化参数整组去掉）"""
+    supported = _supported_params()
+    if supported is None:
+        return params
+    if any(k in params for k in KV_QUANT_KEYS) and not all(k in supported for k in KV_QUANT_KEYS):
+        params = without_kv_quant(params)
+    return {k: v for k, v in params.items() if k in supported}
+
+
+class CPUProfileStore:
+    """按机器与模型保存的最佳参数（JSON）"""
+
+    def __init__(self, path: str = PROFILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+
+    def _load(self) -> Dict[str, Any]:
+        if self._data is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, model_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            machine = self._load().get(machine_fingerprint(), {})
+            return machine.get(os.path.basename(model_path)) or machine.get("*")
+
+    def save(self, model_path: str, result: Dict[str, Any]):
+        with self._lock:
+            data = self._load()
+            data.setdefault(machine_fingerprint(), {})[os.path.basename(model_path)] = result
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+# 全局实例
+profile_store = CPUProfileStore()
+
+
+def default_cpu_params() -> Dict[str, Any]:
+    """未做基准测试时的CPU参数"""
+    topology = cpu_topology()
+    reserved = int(os.getenv("LLAMA_RESERVED_CORES", 1))
+    params: Dict[str, Any] = {}
+    if topology["numa_nodes"] > 1:
+        # 线程固定在当前NUMA节点，避免跨节点访问内存
+        params["numa"] = GGML_NUMA_STRATEGY_ISOLATE
+        cores = topology["cores_per_numa_node"]
+    else:
+        cores = topology["physical_cores"]
+    params["n_threads"] = max(cores - reserved, 1)
+    # 提示词评估是批量计算，可以使用全部物理核心
+    params["n_threads_batch"] = cores
+    if os.getenv("LLAMA_KV_QUANT", "1").lower() not in ("0", "false", "no"):
+        params.update({"flash_attn": True, "type_k": GGML_TYPE_Q8_0, "type_v": GGML_TYPE_Q8_0})
+    return params
+
+
+def build_model_params(model_path: str, template: str, max_tokens: int, use_gpu: bool = False,
+                       prompt: Optional[str] = None) -> Dict[str, Any]:
+    """
+    生成llama.cpp加载参数
+    n_ctx由模板（空编辑要求的完整提示词）、max_tokens与REQUEST_HEADROOM决定，同一模型与模板的请求
+    落在同一档位；只有编辑要求超过余量时才按实际提示词扩大（注册表会复用已加载的更大上下文）
+    GPU可用时全部层放到GPU；纯CPU时使用基准测试结果或默认CPU参数
+    """
+    n_ctx = context_size(template, max_tokens + REQUEST_HEADROOM)
+    if prompt:
+        n_ctx = max(n_ctx, context_size(prompt, max_tokens))
+    params: Dict[str, Any] = {
+        "n_ctx": n_ctx,
+        "n_batch": min(512, n_ctx),
+        "verbose": False,
+    }
+    if use_gpu:
+        params["n_gpu_layers"] = -1
+        params["n_threads"] = -1
+    else:
+        tuned = profile_store.get(model_path)
+        params.update(tuned["params"] if tuned else default_cpu_params())
+    return _filter_supported(params)
+
+
+def benchmark(model_path: str, prompt: str = "请将背景改为蓝天白云，增加温暖的阳光效果。",
+              max_tokens: int = 128, save: bool = True) -> Dict[str, Any]:
+    """
+    在本机比较多组线程数与KV缓存类型，返回每组的tokens/s并保存最佳参数
+    贪心解码（temperature=0）保证各组生成相同数量的token
+    """
+    if not LLAMA_CPP_AVAILABLE:
+        raise Exception("llama-cpp-python not installed. Please run: pip install llama-cpp-python")
+
+    topology = cpu_topology()
+    base = default_cpu_params()
+    cores = base["n_threads_batch"]
+    thread_options = sorted({cores, max(cores - 1, 1), max(cores // 2, 1)}, reverse=True)
+    kv_options = [
+        {"flash_attn": True, "type_k": GGML_TYPE_Q8_0, "type_v": GGML_TYPE_Q8_0},
+        {"type_k": GGML_TYPE_F16, "type_v": GGML_TYPE_F16},
+    ]
+    n_ctx = context_size(prompt, max_tokens)
+
+    results = []
+    for threads in thread_options:
+        for kv in kv_options:
+            candidate = without_kv_quant(base)
+            candidate.update({"n_threads": threads, **kv})
+            load_params = _filter_supported({
+                "model_path": model_path, "n_ctx": n_ctx, "n_batch": min(512, n_ctx),
+                "verbose": False, **candidate,
+            })
+            try:
+                start = time.perf_counter()
+                llm = Llama(**load_params)
+                load_s = time.perf_counter() - start
+                start = time.perf_counter()
+                output = llm(prompt, max_tokens=max_tokens, temperature=0.0)
+                elapsed = time.perf_counter() - start
+                tokens = output["usage"]["completion_tokens"]
+                results.append({
+                    "params": {k: v for k, v in load_params.items()
+                               if k not in ("model_path", "n_ctx", "n_batch", "verbose")},
+                    "tokens_per_second": round(tokens / elapsed, 2) if elapsed else 0.0,
+                    "load_s": round(load_s, 2),
+                })
+                if hasattr(llm, "close"):
+                    llm.close()
+                del llm
+            except Exception as e:
+                results.append({"params": candidate, "error": str(e)})
+
+    valid = [r for r in results if "tokens_per_second" in r]
+    best = max(valid, key=lambda r: r["tokens_per_second"]) if valid else None
+    if best and save:
+        profile_store.save(model_path, {**best, "measured_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+    return {"topology": topology, "n_ctx": n_ctx, "results": results, "best": best}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="llama.cpp CPU参数基准测试")
+    parser.add_argument("model", help="GGUF模型路径")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--no-save", action="store_true", help="只输出结果，不保存最佳参数")
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.model, max_tokens=args.max_tokens, save=not args.no_save),
+                     indent=2, ensure_ascii=False))
@@ -0,0 +1,455 @@
+"""
+Llama Model Registry
+llama.cpp模型常驻注册表 - 进程内所有CustomModelPromptGenerator实例共享
+
+功能：
+- 同一GGUF（相同加载参数）只加载一次，新节点实例与模型来回切换无需重新读盘
+- 按内存预算进行LRU淘汰，正在推理的模型（引用计数>0）不会被淘汰；
+  每个模型的占用按实际计算：GGUF文件 + KV缓存（按n_ctx和模型结构估算） + 草稿模型 + 前缀状态快照
+- 默认use_mmap：淘汰后文件页仍在系统页缓存中，切换回来的加载代价很低；可选use_mlock锁定内存
+- 下拉框切换模型时后台预加载
+- 记录加载耗时、模型大小、使用次数和进程内存
+- 提示词前缀KV状态缓存：固定的系统提示词/模板前缀只评估一次，之后每次请求恢复状态，
+  只需评估用户的编辑要求；上下文中已是该前缀时（单模板的常见情况）直接复用，不做load_state；
+  状态快照的大小计入模型的内存占用
+
+配置（环境变量）：
+- LLAMA_MODEL_BUDGET_MB 常驻模型内存预算（默认为物理内存的一半，无法获取时8192）
+- LLAMA_USE_MMAP=0 关闭mmap
+- LLAMA_USE_MLOCK=1 锁定模型内存，避免被换出
+- LLAMA_PREFIX_STATES 每个模型缓存的前缀状态数（默认4，0为关闭）
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    from llama_cpp import Llama
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+from llama_cpu_profile import without_kv_quant
+
+try:
+    from llama_speculative import create_draft_model, check_vocab_compatible
+    SPECULATIVE_SUPPORT = True
+except ImportError:
+    SPECULATIVE_SUPPORT = False
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes")
+
+
+def _default_budget_bytes() -> int:
+    if os.getenv("LLAMA_MODEL_BUDGET_MB"):
+        return int(float(os.environ["LLAMA_MODEL_BUDGET_MB"]) * 1024 * 1024)
+    if PSUTIL_AVAILABLE:
+        return psutil.virtual_memory().total // 2
+    return 8192 * 1024 * 1024
+
+
+def estimate_kv_bytes(llm) -> int:
+    """
+    估算llama.cpp上下文的KV缓存大小
+    优先按GGUF元数据计算：2(K和V) × 层数 × n_ctx × KV头数 × 头维度 × 2字节(f16)；
+    元数据不全时退回llama_state_get_size（状态大小的上界，包含KV缓存）
+    """
+    try:
+        n_ctx = llm.n_ctx()
+        metadata = getattr(llm, "metadata", None) or {}
+        arch = metadata.get("general.architecture")
+        if arch and f"{arch}.block_count" in metadata:
+            n_layer = int(metadata[f"{arch}.block_count"])
+            n_embd = int(metadata[f"{arch}.embedding_length"])
+            n_head = int(metadata[f"{arch}.attention.head_count"])
+            n_head_kv = int(metadata.get(f"{arch}.attention.head_count_kv", n_head))
+            head_dim = n_embd // n_head
+            k_dim = int(metadata.get(f"{arch}.attention.key_length", head_dim))
+            v_dim = int(metadata.get(f"{arch}.attention.value_length", head_dim))
+            return n_layer * n_ctx * n_head_kv * (k_dim + v_dim) * 2
+    except Exception:
+        pass
+    try:
+        import llama_cpp
+        ctx = llm._ctx.ctx
+        get_size = getattr(llama_cpp, "llama_state_get_size", None) or llama_cpp.llama_get_state_size
+        return int(get_size(ctx))
+    except Exception:
+        return 0
+
+
+class _ModelEntry:
+    """注册表中的一个已加载模型"""
+
+    def __init__(self, key: str, model_path: str, params: Dict[str, Any]):
+        self.key = key
+        self.model_path = model_path
+        self.params = params
+        self.llm = None
+        self.size_bytes = 0
+        self.kv_bytes = 0
+        self.draft_bytes = 0
+        self.load_ms = 0.0
+        self.loaded_at = 0.0
+        self.last_used = 0.0
+        self.refcount = 0
+        self.uses = 0
+        self.error: Optional[str] = None
+        self.ready = threading.Event()
+        # llama.cpp上下文不是线程安全的，同一模型的推理串行执行
+        self.inference_lock = threading.Lock()
+        # 前缀文本 -> (前缀token, LlamaState)（持有inference_lock时访问）
+        self.prefix_states: "OrderedDict[str, Any]" = OrderedDict()
+        self.prefix_bytes = 0
+        self.prefix_hits = 0
+        self.prefix_resident_hits = 0
+        self.prefix_misses = 0
+        self.prefix_tokens = 0
+        self.prefix_prime_ms = 0.0
+
+    @property
+    def total_bytes(self) -> int:
+        """计入内存预算的占用"""
+        return self.size_bytes + self.kv_bytes + self.draft_bytes + self.prefix_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model": os.path.basename(self.model_path),
+            "loaded": self.llm is not None,
+            "size_mb": round(self.size_bytes / 1024 / 1024, 1),
+            "kv_mb": round(self.kv_bytes / 1024 / 1024, 1),
+            "draft_mb": round(self.draft_bytes / 1024 / 1024, 1),
+            "total_mb": round(self.total_bytes / 1024 / 1024, 1),
+            "load_ms": round(self.load_ms, 1),
+            "refcount": self.refcount,
+            "uses": self.uses,
+            "idle_s": round(time.time() - self.last_used, 1) if self.last_used else None,
+            "use_mmap": self.params.get("use_mmap"),
+            "use_mlock": self.params.get("use_mlock"),
+            "speculative": self.params.get("speculative", "none"),
+            "prefix_states": len(self.prefix_states),
+            "prefix_states_mb": round(self.prefix_bytes / 1024 / 1024, 1),
+            "prefix_hits": self.prefix_hits,
+            "prefix_resident_hits": self.prefix_resident_hits,
+            "prefix_misses": self.prefix_misses,
+            "prefix_tokens": self.prefix_tokens,
+            "prefix_prime_ms": round(self.prefix_prime_ms, 1),
+            "error": self.error,
+        }
+
+
+class LlamaModelRegistry:
+    """进程级llama.cpp模型注册表（线程安全）"""
+
+    def __init__(self, budget_bytes: Optional[int] = None):
+        self.budget_bytes = budget_bytes if budget_bytes is not None else _default_budget_bytes()
+        self.use_mmap = _env_flag("LLAMA_USE_MMAP", True)
+        self.use_mlock = _env_flag("LLAMA_USE_MLOCK", False)
+        self.max_prefix_states = int(os.getenv("LLAMA_PREFIX_STATES", 4))
+        self._entries: "OrderedDict[str, _ModelEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._preload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama-preload")
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_path: str, params: Dict[str, Any]) -> str:
+        """模型路径 + 加载参数（不同n_ctx等参数视为不同实例）"""
+        extra = {k: v for k, v in params.items() if k != "model_path"}
+        return f"{os.path.abspath(model_path)}|{json.dumps(extra, sort_keys=True, default=str)}"
+
+    @staticmethod
+    def _context_free_key(model_path: str, params: Dict[str, Any]) -> str:
+        return LlamaModelRegistry.make_key(
+            model_path, {k: v for k, v in params.items() if k not in ("n_ctx", "n_batch")})
+
+    def _larger_context_locked(self, model_path: str, params: Dict[str, Any]) -> Optional[_ModelEntry]:
+        """
+        已加载的同一模型（其余参数相同）且上下文不小于所需时直接复用，
+        避免只因n_ctx不同而加载第二份相同的GGUF（调用方持有锁）
+        """
+        wanted = self._context_free_key(model_path, params)
+        n_ctx = params.get("n_ctx", 0)
+        candidates = [
+            entry for entry in self._entries.values()
+            if entry.llm is not None and entry.params.get("n_ctx", 0) >= n_ctx
+            and self._context_free_key(entry.model_path, entry.params) == wanted
+        ]
+        return min(candidates, key=lambda entry: entry.params.get("n_ctx", 0)) if candidates else None
+
+    def _full_params(self, model_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        full = {"use_mmap": self.use_mmap, "use_mlock": self.use_mlock, **params}
+        full["model_path"] = model_path
+        return full
+
+    def acquire(self, model_path: str, params: Dict[str, Any]):
+        """
+        获取已加载的模型并增加引用计数（未加载时在当前线程加载，同一模型并发请求只加载一次）
+        使用完毕必须调用release，推荐使用use()上下文管理器
+        """
+        if not LLAMA_CPP_AVAILABLE:
+            raise Exception("llama-cpp-python not installed. Please run: pip install llama-cpp-python")
+        params = self._full_params(model_path, params)
+        key = self.make_key(model_path, params)
+
+        with self._lock:
+            entry = self._entries.get(key) or self._larger_context_locked(model_path, params)
+            if entry is not None:
+                key = entry.key
+            if entry is not None and entry.ready.is_set() and entry.llm is None:
+                # 上次加载失败，重新尝试
+                del self._entries[key]
+                entry = None
+            owner = entry is None
+            if owner:
+                entry = _ModelEntry(key, model_path, params)
+                self._entries[key] = entry
+            else:
+                self.hits += 1
+            entry.refcount += 1
+            self._entries.move_to_end(key)
+
+        if owner:
+            self._load(entry)
+            if entry.llm is not None:
+                self._drop_smaller_contexts(entry)
+        else:
+            entry.ready.wait()
+
+        if entry.llm is None:
+            self.release(entry)
+            raise Exception(f"模型加载失败: {entry.error}")
+        entry.uses += 1
+        entry.last_used = time.time()
+        return entry
+
+    def _drop_smaller_contexts(self, entry: _ModelEntry):
+        """加载了更大上下文后，卸载同一模型的空闲小上下文实例（之后的请求复用大上下文）"""
+        wanted = self._context_free_key(entry.model_path, entry.params)
+        with self._lock:
+            for key, other in list(self._entries.items()):
+                if (other is not entry and other.refcount == 0 and other.llm is not None
+                        and other.params.get("n_ctx", 0) < entry.params.get("n_ctx", 0)
+                        and self._context_free_key(other.model_path, other.params) == wanted):
+                    del self._entries[key]
+                    self._close(other)
+                    self.evictions += 1
+
+    def release(self, entry: _ModelEntry):
+        with self._lock:
+            entry.refcount = max(entry.refcount - 1, 0)
+            entry.last_used = time.time()
+            self._evict_locked()
+
+    @contextmanager
+    def use(self, model_path: str, params: Dict[str, Any], prefix: Optional[str] = None):
+        """
+        with registry.use(path, params) as llm: ...
+        :param prefix: 提示词的固定前缀，指定时先恢复（或首次计算并保存）前缀的KV状态
+        """
+        entry = self.acquire(model_path, params)
+        try:
+            with entry.inference_lock:
+                if prefix and self.max_prefix_states > 0:
+                    self._restore_prefix(entry, prefix)
+                yield entry.llm
+        finally:
+            self.release(entry)
+
+    @staticmethod
+    def _tokenize(llm, text: str):
+        try:
+            return llm.tokenize(text.encode("utf-8"), add_bos=True, special=True)
+        except TypeError:
+            # 旧版llama-cpp-python没有special参数
+            return llm.tokenize(text.encode("utf-8"), add_bos=True)
+
+    @staticmethod
+    def _state_bytes(state) -> int:
+        size = getattr(state, "llama_state_size", 0) or 0
+        for name in ("input_ids", "scores"):
+            size += getattr(getattr(state, name, None), "nbytes", 0) or 0
+        return int(size)
+
+    @staticmethod
+    def _context_starts_with(llm, tokens) -> bool:
+        """上下文中已评估的token是否以tokens开头"""
+        input_ids = getattr(llm, "_input_ids", None)
+        if input_ids is None or len(input_ids) < len(tokens):
+            return False
+        return list(input_ids[:len(tokens)]) == list(tokens)
+
+    def _restore_prefix(self, entry: _ModelEntry, prefix: str):
+        """
+        恢复前缀的KV状态（调用方持有inference_lock）
+        上下文中已是该前缀时不做任何操作：llama-cpp-python会与上一次的token做最长前缀匹配；
+        否则从快照恢复。随后的生成只评估前缀之后的部分，即使分词边界与完整提示词不一致，
+        也只是从分歧处重新评估，结果不受影响
+        """
+        llm = entry.llm
+        try:
+            cached = entry.prefix_states.get(prefix)
+            if cached is not None:
+                tokens, state = cached
+                entry.prefix_states.move_to_end(prefix)
+                if self._context_starts_with(llm, tokens):
+                    entry.prefix_resident_hits += 1
+                else:
+                    llm.load_state(state)
+                    entry.prefix_hits += 1
+                return
+
+            start = time.perf_counter()
+            tokens = self._tokenize(llm, prefix)
+            llm.reset()
+            llm.eval(tokens)
+            state = llm.save_state()
+            entry.prefix_states[prefix] = (tokens, state)
+            entry.prefix_bytes += self._state_bytes(state)
+            while len(entry.prefix_states) > self.max_prefix_states:
+                _, (_, evicted) = entry.prefix_states.popitem(last=False)
+                entry.prefix_bytes -= self._state_bytes(evicted)
+            entry.prefix_misses += 1
+            entry.prefix_tokens = len(tokens)
+            entry.prefix_prime_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            # 前缀缓存失败时退回完整评估
+            print(f"[LlamaModelRegistry] 前缀状态缓存失败: {e}")
+            cached = entry.prefix_states.pop(prefix, None)
+            if cached is not None:
+                entry.prefix_bytes -= self._state_bytes(cached[1])
+            llm.reset()
+
+    def _load(self, entry: _ModelEntry):
+        start = time.perf_counter()
+        try:
+            entry.size_bytes = os.path.getsize(entry.model_path)
+            with self._lock:
+                # 先为新模型腾出预算
+                self._evict_locked(reserve=entry.size_bytes)
+            llama_params = dict(entry.params)
+            # 推测解码选项以字符串保存在参数中（保证注册表键稳定），加载时创建草稿模型
+            speculative = llama_params.pop("speculative", None)
+            draft_model = None
+            if speculative and SPECULATIVE_SUPPORT:
+                draft_model = create_draft_model(speculative, llama_params, os.path.dirname(entry.model_path))
+            if draft_model is not None:
+                llama_params["draft_model"] = draft_model
+            try:
+                entry.llm = Llama(**llama_params)
+            except Exception as e:
+                # 量化KV缓存与当前llama.cpp构建不兼容时（如不支持flash_attn）改用f16 KV缓存
+                fallback_params = without_kv_quant(llama_params)
+                if fallback_params == llama_params:
+                    raise
+                print(f"[LlamaModelRegistry] 量化KV缓存创建上下文失败，改用f16 KV缓存重试: {e}")
+                entry.llm = Llama(**fallback_params)
+            draft_llm = getattr(draft_model, "llm", None)
+            if draft_model is not None and not check_vocab_compatible(entry.llm, draft_model):
+                print(f"[LlamaModelRegistry] 草稿模型与主模型词表不一致，已关闭推测解码: {speculative}")
+                entry.llm.draft_model = None
+                if draft_llm is not None:
+                    draft_llm.close()
+                    draft_llm = None
+            entry.kv_bytes = estimate_kv_bytes(entry.llm)
+            if draft_llm is not None:
+                # GGUF草稿模型本身也常驻内存（prompt_lookup不占额外内存）
+                entry.draft_bytes = os.path.getsize(draft_model.model_path) + estimate_kv_bytes(draft_llm)
+            entry.loaded_at = time.time()
+            self.loads += 1
+            if entry.kv_bytes or entry.draft_bytes:
+                # 加载前只预留了文件大小，按实际占用再检查一次预算
+                with self._lock:
+                    self._evict_locked()
+        except Exception as e:
+            traceback.print_exc()
+            entry.error = str(e)
+        finally:
+            entry.load_ms = (time.perf_counter() - start) * 1000
+            entry.ready.set()
+
+    def _evict_locked(self, reserve: int = 0):
+        """按LRU淘汰空闲模型直到满足预算（调用方持有锁），最近使用的模型始终保留"""
+        total = sum(e.total_bytes for e in self._entries.values() if e.llm is not None) + reserve
+        for key in list(self._entries)[:-1]:
+            if total <= self.budget_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refcount > 0 or entry.llm is None:
+                continue
+            del self._entries[key]
+            total -= entry.total_bytes
+            self._close(entry)
+            self.evictions += 1
+
+    @staticmethod
+    def _close(entry: _ModelEntry):
+        llm, entry.llm = entry.llm, None
+        entry.prefix_states.clear()
+        entry.prefix_bytes = 0
+        # Llama.close()不会关闭草稿模型自己的上下文
+        draft_llm = getattr(getattr(llm, "draft_model", None), "llm", None)
+        entry.draft_bytes = 0
+        for model in (llm, draft_llm):
+            try:
+                if model is not None and hasattr(model, "close"):
+                    model.close()
+            except Exception:
+                pass
+
+    def preload(self, model_path: str, params: Dict[str, Any]) -> Future:
+        """后台加载模型（加载后引用计数归零，按LRU参与淘汰）"""
+        def task():
+            entry = self.acquire(model_path, params)
+            self.release(entry)
+            return entry.load_ms
+        return self._preload_executor.submit(task)
+
+    def unload(self, model_path: Optional[str] = None) -> int:
+        """卸载空闲模型（可指定路径），返回卸载数量"""
+        removed = 0
+        with self._lock:
+            for key in list(self._entries):
+                entry = self._entries[key]
+                if entry.refcount > 0 or (model_path and os.path.abspath(model_path) != os.path.abspath(entry.model_path)):
+                    continue
+                del self._entries[key]
+                self._close(entry)
+                removed += 1
+        return removed
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            models = [entry.to_dict() for entry in self._entries.values()]
+            resident = sum(e.total_bytes for e in self._entries.values() if e.llm is not None)
+        metrics = {
+            "budget_mb": round(self.budget_bytes / 1024 / 1024, 1),
+            "resident_mb": round(resident / 1024 / 1024, 1),
+            "loads": self.loads,
+            "hits": self.hits,
+            "evictions": self.evictions,
+            "models": models,
+        }
+        if PSUTIL_AVAILABLE:
+            metrics["process_rss_mb"] = round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+        return metrics
+
+
+# 全局实例
+model_registry = LlamaModelRegistry()
@@ -0,0 +1,134 @@
+"""
+Llama Speculative Decoding
+llama.cpp推测解码 - 为CustomModelPromptGenerator提供草稿模型
+
+支持两种草稿来源（通过llama-cpp-python的draft_model接口）：
+- prompt_lookup：从提示词中查找n-gram作为草稿（LlamaPromptLookupDecoding），无需额外模型
+- 同目录下的小型GGUF（需与主模型使用相同词表）：贪心生成若干token作为草稿
+
+主模型逐个验证草稿token，只接受与自身采样结果一致的部分，因此输出不变，只提升每秒token数。
+
+基准测试：
+    python nodes/llama_speculative.py main.gguf --draft draft.gguf|prompt_lookup [--max-tokens 128]
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+try:
+    import numpy as np
+    from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+    SPECULATIVE_AVAILABLE = True
+except ImportError:
+    SPECULATIVE_AVAILABLE = False
+    LlamaDraftModel = object
+
+SPECULATIVE_NONE = "none"
+SPECULATIVE_PROMPT_LOOKUP = "prompt_lookup"
+# 每次推测的草稿token数
+DEFAULT_DRAFT_TOKENS = int(os.getenv("LLAMA_DRAFT_TOKENS", 8))
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """用小型GGUF模型贪心生成草稿token"""
+
+    def __init__(self, model_path: str, num_pred_tokens: int = DEFAULT_DRAFT_TOKENS, **params):
+        self.model_path = model_path
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, **params)
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = []
+        # generate会与上一次评估的token做最长前缀匹配，只评估新增部分
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+def create_draft_model(spec: str, main_params: Dict[str, Any],
+                       model_dir: Optional[str] = None) -> Optional[Any]:
+    """
+    根据选项创建草稿模型
+    :param spec: "none"、"prompt_lookup"或草稿GGUF文件名
+    :param main_params: 主模型的加载参数（草稿模型沿用上下文长度与线程设置）
+    """
+    if not SPECULATIVE_AVAILABLE or not spec or spec == SPECULATIVE_NONE:
+        return None
+    if spec == SPECULATIVE_PROMPT_LOOKUP:
+        return LlamaPromptLookupDecoding(num_pred_tokens=DEFAULT_DRAFT_TOKENS)
+
+    draft_path = os.path.join(model_dir, spec) if model_dir else spec
+    if not os.path.exists(draft_path):
+        raise FileNotFoundError(f"草稿模型不存在: {draft_path}")
+    draft_params = {k: v for k, v in main_params.items()
+                    if k in ("n_ctx", "n_batch", "n_threads", "n_threads_batch", "n_gpu_layers",
+                             "use_mmap", "use_mlock", "verbose")}
+    return GGUFDraftModel(draft_path, **draft_params)
+
+
+def check_vocab_compatible(llm, draft_model) -> bool:
+    """草稿GGUF必须与主模型词表一致，否则草稿token没有意义"""
+    if not isinstance(draft_model, GGUFDraftModel):
+        return True
+    return llm.n_vocab() == draft_model.llm.n_vocab()
+
+
+def benchmark(model_path: str, draft: str = SPECULATIVE_PROMPT_LOOKUP,
+              prompt: str = "请将背景改为蓝天白云，增加温暖的阳光效果，输出英文提示词，包含 high quality, detailed, professional。",
+              max_tokens: int = 128, n_ctx: int = 2048) -> Dict[str, Any]:
+    """
+    比较有无草稿模型时的生成速度
+    使用贪心解码（temperature=0），两次输出应完全一致
+    """
+    if not SPECULATIVE_AVAILABLE:
+        raise Exception("llama-cpp-python (with llama_speculative) not installed")
+
+    params = {"n_ctx": n_ctx, "verbose": False}
+    model_dir = os.path.dirname(os.path.abspath(model_path))
+
+    def run(draft_model) -> Dict[str, Any]:
+        llm = Llama(model_path=model_path, draft_model=draft_model, **params)
+        try:
+            start = time.perf_counter()
+            output = llm(prompt, max_tokens=max_tokens, temperature=0.0)
+            elapsed = time.perf_counter() - start
+        finally:
+            if hasattr(llm, "close"):
+                llm.close()
+        tokens = output["usage"]["completion_tokens"]
+        return {
+            "text": output["choices"][0]["text"],
+            "completion_tokens": tokens,
+            "seconds": round(elapsed, 3),
+            "tokens_per_second": round(tokens / elapsed, 2) if elapsed else 0.0,
+        }
+
+    baseline = run(None)
+    speculative = run(create_draft_model(draft, params, model_dir))
+    return {
+        "draft": draft,
+        "baseline": baseline,
+        "speculative": speculative,
+        "speedup": round(speculative["tokens_per_second"] / baseline["tokens_per_second"], 2)
+        if baseline["tokens_per_second"] else None,
+        "identical_output": baseline["text"] == speculative["text"],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="推测解码速度对比")
+    parser.add_argument("model", help="主模型GGUF路径")
+    parser.add_argument("--draft", default=SPECULATIVE_PROMPT_LOOKUP, help="草稿GGUF路径或prompt_lookup")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.model, args.draft, max_tokens=args.max_tokens), indent=2, ensure_ascii=False))
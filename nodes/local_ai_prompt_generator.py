@@ -16,6 +16,14 @@ from typing import Optional, Dict, Any, Tuple, List
 import folder_paths
 import glob
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from prompt_cache import prompt_cache
+from llama_model_registry import model_registry
+from llama_cpu_profile import build_model_params
+from llama_speculative import SPECULATIVE_NONE, SPECULATIVE_PROMPT_LOOKUP
+from response_cleaner import post_process_output
+from structured_output import STRUCTURED_OUTPUT_ENABLED, llama_grammar, parse_instruction
+
 # 尝试导入llama-cpp-python
 try:
     from llama_cpp import Llama
@@ -86,9 +94,7 @@ class CustomModelPromptGenerator:
     """
     
     def __init__(self):
-        self.model = None
-        self.current_model_path = None
-        self.model_cache = {}
+        # 模型由进程级注册表持有，节点实例之间共享
         
         # 默认的提示词模板
         self.prompt_templates = {
@@ -147,6 +153,10 @@ class CustomModelPromptGenerator:
                     "default": "",
                     "placeholder": "自定义系统提示词（可选）",
                     "rows": 3
+                }),
+                "speculative_decoding": ([SPECULATIVE_NONE, SPECULATIVE_PROMPT_LOOKUP] + [f for f in model_files if f.endswith(".gguf")], {
+                    "default": SPECULATIVE_NONE,
+                    "tooltip": "推测解码：prompt_lookup或同目录下与主模型词表相同的小型GGUF作为草稿模型，输出不变，提升生成速度"
                 })
             }
         }
@@ -156,50 +166,53 @@ class CustomModelPromptGenerator:
     FUNCTION = "generate_prompt"
     CATEGORY = "🎨 Super Canvas"
     
-    def load_model(self, model_file: str) -> bool:
-        """加载量化模型"""
+    @staticmethod
+    def get_model_path(model_file: str) -> str:
+        """构建完整的模型路径"""
+        return os.path.join(get_custom_model_directory(), model_file)
+    
+    @staticmethod
+    def get_model_params(model_path: str, template: str = "", max_tokens: int = 512,
+                         speculative_decoding: str = SPECULATIVE_NONE, prompt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        llama.cpp加载参数（mmap/mlock由模型注册表统一设置）
+        n_ctx按模板与max_tokens确定（不随编辑要求变化）；纯CPU时线程数、NUMA与KV缓存类型使用本机调优结果
+        :param template: 空编辑要求时的完整提示词
+        :param prompt: 实际提示词，仅在超过模板预留余量时扩大n_ctx
+        """
+        params = build_model_params(model_path, template, max_tokens, use_gpu=torch.cuda.is_available(), prompt=prompt)
+        if speculative_decoding and speculative_decoding != SPECULATIVE_NONE \
+                and speculative_decoding != os.path.basename(model_path):
+            params["speculative"] = speculative_decoding
+        return params
+    
+    def load_model(self, model_file: str, max_tokens: int = 512, model_name: str = "",
+                   custom_system: str = "") -> bool:
+        """预加载量化模型到注册表（已加载时立即返回）"""
         if not LLAMA_CPP_AVAILABLE:
             raise Exception("llama-cpp-python not installed. Please run: pip install llama-cpp-python")
         
-        # 构建完整的模型路径
-        model_dir = get_custom_model_directory()
-        model_path = os.path.join(model_dir, model_file)
-        
+        model_path = self.get_model_path(model_file)
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"模型文件不存在: {model_path}")
         
-        # 检查是否已经加载了相同的模型
-        if self.current_model_path == model_path and self.model is not None:
-            return True
-        
+        template = self.build_prompt("", model_name or os.path.splitext(model_file)[0], custom_system)
         try:
-            
-            # 根据模型类型设置参数
-            model_params = {
-                "model_path": model_path,
-                "n_ctx": 4096,  # 上下文长度
-                "n_batch": 512,  # 批处理大小
-                "n_threads": -1,  # 使用所有CPU线程
-                "verbose": False
-            }
-            
-            # 检查是否有GPU支持
-            if torch.cuda.is_available():
-                model_params["n_gpu_layers"] = -1  # 使用所有GPU层
-            
-            self.model = Llama(**model_params)
-            self.current_model_path = model_path
-            
-            return True
-            
+            with model_registry.use(model_path, self.get_model_params(model_path, template, max_tokens)):
+                return True
         except Exception as e:
             traceback.print_exc()
-            self.model = None
-            self.current_model_path = None
             return False
     
     def build_prompt(self, editing_request: str, model_name: str, custom_system: str = "") -> str:
         """构建适合模型的提示词"""
+        return self.build_prompt_parts(editing_request, model_name, custom_system)[1]
+    
+    def build_prompt_parts(self, editing_request: str, model_name: str, custom_system: str = "") -> Tuple[str, str]:
+        """
+        构建提示词并返回(固定前缀, 完整提示词)
+        编辑要求放在最后，前缀（模板、系统提示词、格式说明）在请求之间保持不变，可复用KV状态
+        """
         
         # 根据模型名称选择模板
         if "qwen" in model_name.lower():
@@ -213,10 +226,10 @@ class CustomModelPromptGenerator:
         # 使用自定义系统提示词或默认提示词
         system_prompt = custom_system.strip() if custom_system.strip() else template_config["system"]
         
-        # 构建用户输入
-        user_input = f"""请根据以下图像编辑要求，生成一个详细的、结构化的提示词：
-
-编辑要求：{editing_request}
+        # 构建用户输入（编辑要求位于末尾，之前的内容全部为固定前缀）
+        request_marker = "\x00editing_request\x00"
+        json_rule = '\n- 以JSON格式输出：{"instruction": "提示词"}' if STRUCTURED_OUTPUT_ENABLED else ""
+        user_input = f"""请根据以下图像编辑要求，生成一个详细的、结构化的提示词。
 
 请生成符合以下格式的提示词：
 1. 主要编辑内容描述
@@ -227,19 +240,24 @@ class CustomModelPromptGenerator:
 - 使用英文描述
 - 结构清晰，逗号分隔
 - 包含质量标签如 "high quality, detailed, professional"
-- 避免负面描述"""
+- 避免负面描述{json_rule}
+
+编辑要求：{request_marker}"""
         
         # 应用模板
-        full_prompt = template_config["template"].format(
+        templated = template_config["template"].format(
             system=system_prompt,
             user_input=user_input
         )
+        prefix = templated.split(request_marker, 1)[0]
+        full_prompt = templated.replace(request_marker, editing_request, 1)
         
-        return full_prompt
+        return prefix, full_prompt
     
     def generate_prompt(self, editing_request: str, model_name: str, model_file: str, 
                        max_tokens: int, temperature: float, top_p: float,
-                       layers_info=None, image=None, custom_system_prompt: str = "") -> Tuple[str, str]:
+                       layers_info=None, image=None, custom_system_prompt: str = "",
+                       speculative_decoding: str = SPECULATIVE_NONE) -> Tuple[str, str]:
         """生成增强的提示词"""
         
         try:
@@ -266,13 +284,24 @@ class CustomModelPromptGenerator:
                     # 其他格式的图层信息
                     enhanced_request += f"\n图层数据: {str(layers_info)[:100]}..."
             
-            # 加载模型
-            if not self.load_model(model_file):
-                raise Exception("模型加载失败")
-            
             # 构建提示词
-            full_prompt = self.build_prompt(enhanced_request, model_name, custom_system_prompt)
+            prompt_prefix, full_prompt = self.build_prompt_parts(enhanced_request, model_name, custom_system_prompt)
+            
+            # 相同模型文件与输入命中缓存时无需加载模型
+            model_path = self.get_model_path(model_file)
+            model_mtime = os.path.getmtime(model_path) if os.path.exists(model_path) else 0
+            cache_key = prompt_cache.make_key(
+                "custom_model", model_file, user_prompt=full_prompt, temperature=temperature,
+                max_tokens=max_tokens, top_p=top_p, model_mtime=model_mtime
+            )
+            cached_output = prompt_cache.get(cache_key)
+            if cached_output:
+                return (self.post_process_output(parse_instruction(cached_output) or cached_output), cached_output)
             
+            if not LLAMA_CPP_AVAILABLE:
+                raise Exception("llama-cpp-python not installed. Please run: pip install llama-cpp-python")
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"模型文件不存在: {model_path}")
             
             # 生成参数
             generation_params = {
@@ -284,14 +313,23 @@ class CustomModelPromptGenerator:
                 "echo": False
             }
             
-            # 执行推理
-            response = self.model(**generation_params)
+            # 结构化输出：GBNF语法约束模型只输出{"instruction": ...}
+            grammar = llama_grammar() if STRUCTURED_OUTPUT_ENABLED else None
+            if grammar is not None:
+                generation_params["grammar"] = grammar
+            
+            # 执行推理（从注册表获取常驻模型，推理期间不会被淘汰；固定前缀的KV状态直接恢复）
+            template = self.build_prompt("", model_name, custom_system_prompt)
+            model_params = self.get_model_params(model_path, template, max_tokens, speculative_decoding, prompt=full_prompt)
+            with model_registry.use(model_path, model_params, prefix=prompt_prefix) as model:
+                response = model(**generation_params)
             
             # 提取生成的文本
             raw_output = response['choices'][0]['text'].strip()
+            prompt_cache.set(cache_key, raw_output, "custom_model")
             
-            # 后处理：提取有效的提示词部分
-            enhanced_prompt = self.post_process_output(raw_output)
+            # 后处理：结构化输出直接取instruction字段，否则提取有效的提示词部分
+            enhanced_prompt = self.post_process_output(parse_instruction(raw_output) or raw_output)
             
             
             return (enhanced_prompt, raw_output)
@@ -303,37 +341,7 @@ class CustomModelPromptGenerator:
     
     def post_process_output(self, raw_output: str) -> str:
         """后处理模型输出，提取干净的提示词"""
-        
-        # 移除常见的前缀和后缀
-        prefixes_to_remove = [
-            "根据您的编辑要求",
-            "以下是生成的提示词",
-            "生成的提示词如下",
-            "Based on your editing request",
-            "Here is the generated prompt",
-            "The generated prompt is"
-        ]
-        
-        processed = raw_output.strip()
-        
-        # 移除前缀
-        for prefix in prefixes_to_remove:
-            if processed.lower().startswith(prefix.lower()):
-                processed = processed[len(prefix):].strip()
-                if processed.startswith("：") or processed.startswith(":"):
-                    processed = processed[1:].strip()
-        
-        # 移除多余的换行和空格
-        processed = " ".join(processed.split())
-        
-        # 确保以高质量标签结尾
-        quality_tags = ["high quality", "detailed", "professional", "8k", "masterpiece"]
-        has_quality_tag = any(tag in processed.lower() for tag in quality_tags)
-        
-        if not has_quality_tag:
-            processed += ", high quality, detailed, professional"
-        
-        return processed
+        return post_process_output(raw_output)
 
 # Web API接口 - 用于动态刷新模型列表
 try:
@@ -365,6 +373,53 @@ if WEB_API_AVAILABLE:
                 "success": False,
                 "error": str(e)
             }, status=500)
+    
+    @PromptServer.instance.routes.post("/custom_model_generator/preload")
+    async def preload_custom_model(request):
+        """下拉框切换模型时在后台预加载"""
+        try:
+            data = await request.json()
+            model_file = data.get("model_file", "")
+            max_tokens = int(data.get("max_tokens", 512))
+            speculative_decoding = data.get("speculative_decoding", SPECULATIVE_NONE)
+            if not LLAMA_CPP_AVAILABLE:
+                return web.json_response({"success": False, "error": "llama-cpp-python not installed"})
+            model_path = CustomModelPromptGenerator.get_model_path(model_file)
+            if not model_file.endswith(".gguf") or not os.path.exists(model_path):
+                return web.json_response({"success": False, "error": f"模型文件不存在: {model_file}"}, status=404)
+            # 使用与执行时相同的模型名称与系统提示词构建模板，n_ctx档位与实际执行一致
+            model_name = data.get("model_name") or os.path.splitext(model_file)[0]
+            template = CustomModelPromptGenerator().build_prompt("", model_name, data.get("custom_system_prompt", ""))
+            model_registry.preload(model_path, CustomModelPromptGenerator.get_model_params(
+                model_path, template, max_tokens, speculative_decoding))
+            return web.json_response({"success": True, "model_file": model_file, "status": "loading"})
+        except Exception as e:
+            return web.json_response({"success": False, "error": str(e)}, status=500)
+    
+    @PromptServer.instance.routes.post("/custom_model_generator/benchmark")
+    async def benchmark_custom_model(request):
+        """在本机测试多组CPU参数并保存最佳结果（耗时较长，在线程池中执行）"""
+        try:
+            import asyncio
+            from llama_cpu_profile import benchmark
+            data = await request.json()
+            model_path = CustomModelPromptGenerator.get_model_path(data.get("model_file", ""))
+            if not os.path.exists(model_path):
+                return web.json_response({"success": False, "error": f"模型文件不存在: {model_path}"}, status=404)
+            max_tokens = int(data.get("max_tokens", 128))
+            result = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: benchmark(model_path, max_tokens=max_tokens))
+            return web.json_response({"success": True, **result})
+        except Exception as e:
+            return web.json_response({"success": False, "error": str(e)}, status=500)
+    
+    @PromptServer.instance.routes.get("/custom_model_generator/metrics")
+    async def get_custom_model_metrics(request):
+        """常驻模型的加载耗时与内存统计"""
+        try:
+            return web.json_response({"success": True, **model_registry.metrics()})
+        except Exception as e:
+            return web.json_response({"success": False, "error": str(e)}, status=500)
 
 # 注册节点
 NODE_CLASS_MAPPINGS = {
@@ -0,0 +1,289 @@
+"""
+Ollama Endpoint Pool
+Ollama多端点连接池 - 多主机/多GPU实例的负载均衡与故障转移
+
+功能：
+- 最少未完成请求(least-outstanding-requests)路由
+- 模型亲和：优先路由到已加载该模型的主机（基于/api/ps）
+- 连续失败的端点暂时剔除，冷却后重新探测
+- 请求失败时自动重试到其他端点
+- 流式请求在连接关闭时才释放端点的未完成请求计数
+
+连接池成员通过环境变量 OLLAMA_HOSTS 配置（逗号分隔）。只有节点地址属于配置的成员时
+才会在成员之间负载均衡与故障转移；其他地址单独使用（仍记录统计），请求不会被转发到别的主机。
+未配置时行为与单端点一致。
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+try:
+    import requests
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+    requests = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ollama_model_catalog import model_catalog, DEFAULT_OLLAMA_URL
+from http_client import http_client
+
+
+class OllamaEndpoint:
+    """单个Ollama端点的运行状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.loaded_models: set = set()
+        self.ps_fetched_at = 0.0
+        self.ps_refreshing = False
+        self.total_requests = 0
+        self.total_errors = 0
+        self.latency_ewma = 0.0  # 指数加权平均延迟（秒）
+
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.ejected_until
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+            "loaded_models": sorted(self.loaded_models),
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+            "latency_ms": round(self.latency_ewma * 1000, 1),
+        }
+
+
+class PooledStreamResponse:
+    """流式响应包装：close()（或离开with块）时才结束端点上的这次请求，其余属性透传"""
+
+    def __init__(self, response, on_close):
+        self._response = response
+        self._on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        try:
+            self._response.close()
+        finally:
+            if on_close is not None:
+                on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # 调用方忘记关闭时兜底，避免端点的未完成计数一直偏高
+        if self.__dict__.get("_on_close") is not None:
+            self.close()
+
+
+class OllamaEndpointPool:
+    """Ollama端点池"""
+
+    def __init__(self, urls: Optional[List[str]] = None, eject_after: int = 3,
+                 eject_seconds: float = 30.0, ps_ttl: float = 5.0, affinity_slack: int = 2):
+        self.eject_after = eject_after
+        self.affinity_slack = affinity_slack
+        self.eject_seconds = eject_seconds
+        self.ps_ttl = ps_ttl
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, OllamaEndpoint] = {}
+
+        if urls is None:
+            urls = [u for u in os.getenv("OLLAMA_HOSTS", "").split(",") if u.strip()]
+        # 显式配置的成员，只在它们之间故障转移
+        self._members: List[str] = []
+        for url in urls:
+            endpoint = self.add_endpoint(url)
+            if endpoint.url not in self._members:
+                self._members.append(endpoint.url)
+
+    @staticmethod
+    def _normalize_url(url: str) -> str:
+        url = url.strip().rstrip('/')
+        if not url.startswith(("http://", "https://")):
+            url = f"http://{url}"
+        # localhost与127.0.0.1视为同一服务（与模型目录一致）
+        return url.replace("://localhost", "://127.0.0.1")
+
+    def add_endpoint(self, url: str) -> OllamaEndpoint:
+        """添加端点（已存在时返回现有端点）"""
+        url = self._normalize_url(url)
+        with self._lock:
+            endpoint = self._endpoints.get(url)
+            if endpoint is None:
+                endpoint = OllamaEndpoint(url)
+                self._endpoints[url] = endpoint
+            return endpoint
+
+    def urls(self) -> List[str]:
+        """所有用过或配置的端点地址"""
+        with self._lock:
+            return list(self._endpoints.keys())
+
+    def members_for(self, url: str) -> List[str]:
+        """请求可以路由到的端点：地址属于配置的成员时为全部成员，否则只有它自己"""
+        url = self._normalize_url(url)
+        return list(self._members) if url in self._members else [url]
+
+    def _refresh_loaded_models(self, endpoint: OllamaEndpoint):
+        """通过/api/ps刷新端点已加载的模型"""
+        try:
+            response = http_client.get(f"{endpoint.url}/api/ps", timeout=2)
+            if response.status_code == 200:
+                models = response.json().get('models') or []
+                endpoint.loaded_models = {m.get('name') for m in models if m.get('name')}
+        except Exception as e:
+            pass
+        finally:
+            endpoint.ps_fetched_at = time.time()
+            endpoint.ps_refreshing = False
+
+    def _maybe_refresh_affinity(self, endpoints: List[OllamaEndpoint]):
+        """亲和信息过期时后台刷新，不阻塞当前请求"""
+        now = time.time()
+        for endpoint in endpoints:
+            if not endpoint.ps_refreshing and now - endpoint.ps_fetched_at >= self.ps_ttl:
+                endpoint.ps_refreshing = True
+                threading.Thread(target=self._refresh_loaded_models, args=(endpoint,), daemon=True).start()
+
+    def _has_model(self, endpoint: OllamaEndpoint, model: Optional[str]) -> bool:
+        """根据共享模型目录判断端点是否拥有该模型（未知时视为可能拥有）"""
+        if not model:
+            return True
+        models = model_catalog.get_models(endpoint.url, block=False)
+        return models is None or model in models
+
+    def choose(self, model: Optional[str] = None, exclude: Optional[set] = None,
+               urls: Optional[List[str]] = None) -> Optional[OllamaEndpoint]:
+        """
+        选择端点：健康 > 拥有模型 > 已加载模型 > 未完成请求最少 > 延迟最低
+        :param urls: 候选端点（默认为配置的成员）
+        """
+        exclude = exclude or set()
+        urls = self._members if urls is None else urls
+        with self._lock:
+            candidates = [self._endpoints[url] for url in urls if url in self._endpoints and url not in exclude]
+        if not candidates:
+            return None
+
+        self._maybe_refresh_affinity(candidates)
+
+        # 所有端点都被剔除时仍然尝试，相当于冷却前的主动探测
+        healthy = [e for e in candidates if e.healthy] or candidates
+        owning = [e for e in healthy if self._has_model(e, model)] or healthy
+        warm = [e for e in owning if model and model in e.loaded_models] or owning
+
+        with self._lock:
+            load_key = lambda e: (e.outstanding, e.latency_ewma)
+            best_warm = min(warm, key=load_key)
+            best_any = min(owning, key=load_key)
+            # 已加载模型的主机过于繁忙时放弃亲和，让吞吐量随端点数量扩展
+            if best_warm.outstanding - best_any.outstanding >= self.affinity_slack:
+                return best_any
+            return best_warm
+
+    def _record_result(self, endpoint: OllamaEndpoint, success: bool, elapsed: float,
+                       model: Optional[str] = None):
+        with self._lock:
+            endpoint.outstanding = max(endpoint.outstanding - 1, 0)
+            endpoint.total_requests += 1
+            if success:
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.0
+                endpoint.latency_ewma = elapsed if endpoint.latency_ewma == 0 else 0.8 * endpoint.latency_ewma + 0.2 * elapsed
+                if model:
+                    endpoint.loaded_models.add(model)
+            else:
+                endpoint.total_errors += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.eject_after:
+                    endpoint.ejected_until = time.time() + self.eject_seconds
+
+    def _release(self, endpoint: OllamaEndpoint):
+        """中性结束：只释放未完成计数，不影响延迟、健康状态与模型亲和性"""
+        with self._lock:
+            endpoint.outstanding = max(endpoint.outstanding - 1, 0)
+
+    def post(self, path: str, payload: Dict[str, Any], model: Optional[str] = None,
+             base_url: Optional[str] = None, timeout: float = 60,
+             max_attempts: Optional[int] = None, **kwargs) -> Tuple[Any, str]:
+        """
+        向池中的端点发送POST请求，失败时故障转移
+        :param base_url: 节点配置的地址；属于OLLAMA_HOSTS成员时在成员间路由，否则只请求该地址
+        :param kwargs: 传递给HTTP客户端的其他参数（如stream=True）
+        :return: (response, 实际使用的端点地址)
+                 stream=True时返回PooledStreamResponse，读取完毕后必须close()（或使用with）
+        """
+        if not REQUESTS_AVAILABLE:
+            raise Exception("requests库未安装，无法调用Ollama API")
+
+        base_url = self.add_endpoint(base_url or DEFAULT_OLLAMA_URL).url
+        candidates = self.members_for(base_url)
+        attempts = max_attempts or len(candidates)
+        tried = set()
+        last_error = None
+
+        for _ in range(attempts):
+            endpoint = self.choose(model, exclude=tried, urls=candidates)
+            if endpoint is None:
+                break
+            tried.add(endpoint.url)
+
+            with self._lock:
+                endpoint.outstanding += 1
+            start = time.perf_counter()
+            try:
+                response = http_client.post(f"{endpoint.url}{path}", json=payload, timeout=timeout, **kwargs)
+            except Exception as e:
+                self._record_result(endpoint, False, time.perf_counter() - start)
+                last_error = e
+                continue
+
+            if response.status_code >= 500:
+                # 先读取错误内容再关闭连接
+                error_text = response.text[:200]
+                response.close()
+                self._record_result(endpoint, False, time.perf_counter() - start)
+                last_error = Exception(f"HTTP {response.status_code}: {error_text}")
+                continue
+            if response.status_code == 404 and len(tried) < attempts:
+                # 该端点没有此模型，不计入健康失败，换下一个端点
+                response.close()
+                self._release(endpoint)
+                last_error = Exception(f"模型不存在于 {endpoint.url}")
+                continue
+
+            if kwargs.get("stream"):
+                # 生成仍在进行，连接关闭时才释放未完成计数并按完整耗时记录
+                return PooledStreamResponse(response, lambda endpoint=endpoint, start=start: self._record_result(
+                    endpoint, True, time.perf_counter() - start, model)), endpoint.url
+            self._record_result(endpoint, True, time.perf_counter() - start, model)
+            return response, endpoint.url
+
+        raise last_error or Exception("没有可用的Ollama端点")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [e.to_dict() for e in self._endpoints.values()]
+
+
+# 全局实例
+endpoint_pool = OllamaEndpointPool()
@@ -8,6 +8,8 @@ Ollama Kontext Prompt Generator - 纯后端Ollama提示词生成节点
 - 自动检测可用Ollama模型
 - 支持云端和本地环境
 - 专业的提示词模板系统
+- 流式输出：实时推送部分文本；可选early_stop，生成完整指令句后提前结束
+- 共享磁盘缓存：相同输入和种子重复执行时不再调用模型
 """
 
 import json
@@ -31,6 +33,29 @@ except ImportError:
     TORCH_AVAILABLE = False
     torch = None
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+try:
+    from ollama_service_manager import keep_alive_scheduler
+    SCHEDULER_AVAILABLE = True
+except ImportError:
+    keep_alive_scheduler = None
+    SCHEDULER_AVAILABLE = False
+
+try:
+    from ollama_model_catalog import model_catalog
+    CATALOG_AVAILABLE = True
+    # 提前在后台预热模型目录，节点定义加载时即可命中缓存
+    model_catalog.refresh_in_background()
+except ImportError:
+    model_catalog = None
+    CATALOG_AVAILABLE = False
+
+from ollama_endpoint_pool import endpoint_pool
+from prompt_cache import prompt_cache
+from ollama_streaming import stream_generate, instruction_complete, apply_reasoning_mode, record_reasoning_result
+from response_cleaner import clean_ollama_response
+from structured_output import STRUCTURED_OUTPUT_ENABLED, with_json_rule, ollama_format, parse_instruction, instruction_json_complete
+
 CATEGORY_TYPE = "🎨 Super Canvas"
 
 class OllamaKontextPromptGenerator:
@@ -102,6 +127,21 @@ class OllamaKontextPromptGenerator:
                     "default": "http://127.0.0.1:11434",
                     "placeholder": "Ollama服务地址"
                 }),
+                "stream_output": ("BOOLEAN", {
+                    "default": True,
+                    "label_on": "流式输出",
+                    "label_off": "完整输出",
+                    "tooltip": "实时显示生成文本，输出与完整输出相同"
+                }),
+                "early_stop": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "首句即停",
+                    "label_off": "生成完整",
+                    "tooltip": "得到第一句完整指令后即停止生成（更快，但输出可能比完整输出短）"
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
     
@@ -113,18 +153,16 @@ class OllamaKontextPromptGenerator:
     
     @classmethod
     def _get_available_models(cls):
-        """获取可用的Ollama模型列表"""
+        """获取可用的Ollama模型列表（读取共享模型目录缓存，不阻塞网络）"""
         try:
-            if not REQUESTS_AVAILABLE:
+            if not REQUESTS_AVAILABLE or not CATALOG_AVAILABLE:
                 return ["deepseek-r1:1.5b", "qwen3:4b", "qwen3:8b"]
             
-            response = requests.get("http://127.0.0.1:11434/api/tags", timeout=3)
-            if response.status_code == 200:
-                models_data = response.json()
-                models = [model['name'] for model in models_data.get('models', [])]
-                return models if models else ["deepseek-r1:1.5b"]
-            else:
+            models = model_catalog.get_models("http://127.0.0.1:11434", block=False)
+            if models is None:
+                # 目录尚未获取成功（服务未启动或首次加载），后台刷新完成后下次即可获取
                 return ["deepseek-r1:1.5b", "qwen3:4b", "qwen3:8b"]
+            return models if models else ["deepseek-r1:1.5b"]
         except:
             return ["deepseek-r1:1.5b", "qwen3:4b", "qwen3:8b"]
     
@@ -373,8 +411,10 @@ class OllamaKontextPromptGenerator:
         return f"{selected_intent}, {selected_scenario}"
     
     def _call_ollama_api(self, prompt: str, model: str, temperature: float, 
-                        seed: int, ollama_url: str) -> str:
-        """调用Ollama API生成提示词"""
+                        seed: int, ollama_url: str, stream: bool = False,
+                        node_id: Optional[str] = None, cache_key: Optional[str] = None,
+                        early_stop: bool = False) -> str:
+        """调用Ollama API生成提示词（stream为True时流式推送；early_stop为True时在完整指令句后提前结束）"""
         try:
             if not REQUESTS_AVAILABLE:
                 raise Exception("requests库未安装，无法调用Ollama API")
@@ -391,8 +431,10 @@ Example format: "Transform the selected area to red color with natural blending
 
 Your instruction:"""
             
+            if STRUCTURED_OUTPUT_ENABLED:
+                system_prompt = with_json_rule(system_prompt)
+            
             # 调用Ollama API
-            api_url = f"{ollama_url}/api/generate"
             payload = {
                 "model": model,
                 "prompt": user_prompt,
@@ -407,20 +449,49 @@ Your instruction:"""
                     "repeat_penalty": 1.05
                 }
             }
+            if STRUCTURED_OUTPUT_ENABLED:
+                # 按JSON Schema约束输出，JSON闭合即结束
+                payload["format"] = ollama_format()
+            if SCHEDULER_AVAILABLE:
+                # 由调度器统一管理keep_alive，保持模型常驻以避免冷加载（调度器关闭时不设置）
+                keep_alive = keep_alive_scheduler.get_keep_alive(model)
+                if keep_alive is not None:
+                    payload["keep_alive"] = keep_alive
             
+            # 推理模型：服务端支持时关闭思考，否则强制流式（early_stop时在</think>后的第一句指令处截断）
+            reasoning_mode = apply_reasoning_mode(payload, model, ollama_url)
             
-            response = requests.post(api_url, json=payload, timeout=60)
-            response.raise_for_status()
+            if stream or reasoning_mode == "stream_cut":
+                # 流式生成：部分文本实时推送到前端；JSON闭合即是完整结果，自由文本只在early_stop时提前停止
+                if STRUCTURED_OUTPUT_ENABLED:
+                    stop_when = instruction_json_complete
+                else:
+                    stop_when = instruction_complete() if early_stop else None
+                result, endpoint_url = stream_generate(
+                    payload, model=model, base_url=ollama_url, timeout=60, node_id=node_id,
+                    stop_when=stop_when
+                )
+            else:
+                # 通过端点池路由（多主机时负载均衡并自动故障转移）
+                response, endpoint_url = endpoint_pool.post(
+                    "/api/generate", payload, model=model, base_url=ollama_url, timeout=60
+                )
+                response.raise_for_status()
+                result = response.json()
+            if SCHEDULER_AVAILABLE:
+                keep_alive_scheduler.touch(model, endpoint_url)
+            record_reasoning_result(model, reasoning_mode, result, payload["options"]["num_predict"])
             
-            result = response.json()
             generated_text = result.get('response', '').strip()
             
             
             if not generated_text:
                 raise Exception(f"模型返回空响应: {result}")
             
-            # 清理响应
-            cleaned_text = self._clean_response(generated_text)
+            # 结构化输出解析成功时无需清理，否则清理响应
+            cleaned_text = parse_instruction(generated_text) or self._clean_response(generated_text)
+            if cache_key:
+                prompt_cache.set(cache_key, cleaned_text, "ollama_kontext")
             
             return cleaned_text
             
@@ -430,63 +501,7 @@ Your instruction:"""
     
     def _clean_response(self, response: str) -> str:
         """清理Ollama响应，提取实际的编辑指令"""
-        import re
-        
-        if not response:
-            return "Apply professional editing to the selected area with high quality results"
-        
-        
-        # 1. 处理 <think> 标签 - 提取思考后的内容
-        if '<think>' in response:
-            # 查找 </think> 后的内容
-            think_end = response.find('</think>')
-            if think_end != -1:
-                after_think = response[think_end + 8:].strip()
-                if after_think:
-                    response = after_think
-                else:
-                    # 如果 </think> 后没有内容，尝试提取 <think> 内的最后一句
-                    think_content = response[response.find('<think>') + 7:think_end]
-                    # 查找最后一个完整的英文句子
-                    sentences = re.findall(r'[A-Z][^.!?]*[.!?]', think_content)
-                    if sentences:
-                        response = sentences[-1].strip()
-        
-        # 2. 提取英文编辑指令句子
-        # 查找以动词开头的完整英文句子
-        instruction_patterns = [
-            r'(Transform[^.!?]*[.!?])',
-            r'(Remove[^.!?]*[.!?])',
-            r'(Add[^.!?]*[.!?])',
-            r'(Enhance[^.!?]*[.!?])',
-            r'(Apply[^.!?]*[.!?])',
-            r'(Change[^.!?]*[.!?])',
-            r'(Convert[^.!?]*[.!?])',
-            r'([A-Z][a-z]+\s+the\s+selected[^.!?]*[.!?])'
-        ]
-        
-        for pattern in instruction_patterns:
-            matches = re.findall(pattern, response, re.IGNORECASE)
-            if matches:
-                instruction = matches[0].strip()
-                return instruction
-        
-        # 3. fallback - 查找任何完整的英文句子
-        english_sentences = re.findall(r'[A-Z][a-zA-Z\s,\.;:\-!?()]+[\.!?]', response)
-        if english_sentences:
-            # 选择最长的句子
-            longest = max(english_sentences, key=len)
-            if len(longest) > 15:
-                return longest.strip()
-        
-        # 4. 最终清理
-        cleaned = re.sub(r'^[:\-\s<>]+', '', response)  # 移除开头的符号
-        cleaned = re.sub(r'[<>].*?[<>]', '', cleaned)   # 移除标签
-        cleaned = re.sub(r'\n+', ' ', cleaned)          # 替换换行符
-        cleaned = re.sub(r'\s+', ' ', cleaned)          # 合并多余空格
-        
-        result = cleaned.strip()
-        return result if result else "Apply professional editing to the selected area with high quality results"
+        return clean_ollama_response(response)
     
     def _get_fallback_prompt(self, description: str) -> str:
         """生成备用提示词"""
@@ -508,9 +523,24 @@ Your instruction:"""
     
     def generate_prompt(self, description: str, editing_intent: str, application_scenario: str,
                        ollama_model: str, temperature: float, seed: int,
-                       custom_guidance: str = "", ollama_url: str = "http://127.0.0.1:11434"):
+                       custom_guidance: str = "", ollama_url: str = "http://127.0.0.1:11434",
+                       stream_output: bool = True, early_stop: bool = False,
+                       unique_id: Optional[str] = None):
         """生成Kontext提示词"""
         try:
+            # 引导模板包含随机选择，缓存键使用随机化之前的输入
+            cache_key = prompt_cache.make_key(
+                "ollama_kontext", ollama_model, user_prompt=description, temperature=temperature, seed=seed,
+                editing_intent=editing_intent, application_scenario=application_scenario,
+                custom_guidance=custom_guidance,
+                # 不同主机上的同名模型可能是不同的权重
+                ollama_url=(ollama_url or "").rstrip("/"),
+                # 提前停止的结果与完整输出、JSON与自由文本的结果不能互相复用
+                early_stop=bool(early_stop), structured_output=STRUCTURED_OUTPUT_ENABLED
+            )
+            cached_prompt = prompt_cache.get(cache_key)
+            if cached_prompt:
+                return (cached_prompt,)
             
             # 构建完整的提示词
             if custom_guidance:
@@ -535,7 +565,11 @@ Your instruction:"""
                 model=ollama_model,
                 temperature=temperature,
                 seed=seed,
-                ollama_url=ollama_url
+                ollama_url=ollama_url,
+                stream=stream_output,
+                node_id=unique_id,
+                cache_key=cache_key,
+                early_stop=early_stop
             )
             
             
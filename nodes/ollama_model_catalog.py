@@ -0,0 +1,232 @@
+"""
+Ollama Model Catalog
+Ollama模型目录服务 - 所有节点和路由共享的模型列表缓存
+
+功能：
+- TTL缓存，节点定义刷新时直接读取缓存，不阻塞网络
+- 基于模型digest的变更检测（服务端返回ETag时同时使用If-None-Match）
+- 同一地址的并发刷新合并为一次请求（single-flight）
+- /api/show元数据缓存（按模型digest失效），用于识别推理模型；查询失败同样缓存ttl秒，
+  服务不可达时每次生成不会再多等一个超时
+"""
+
+import os
+import sys
+import hashlib
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+try:
+    import requests
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+    requests = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from http_client import http_client
+
+DEFAULT_OLLAMA_URL = "http://127.0.0.1:11434"
+
+
+class OllamaModelCatalog:
+    """共享的Ollama模型目录"""
+
+    def __init__(self, ttl: float = 30.0, timeout: float = 3.0):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, threading.Event] = {}
+        self._show_cache: Dict[Tuple[str, str], Tuple[Optional[str], Dict[str, Any]]] = {}
+        # (url, model) -> 失败缓存的到期时间
+        self._show_failures: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize_url(url: Optional[str]) -> str:
+        url = (url or DEFAULT_OLLAMA_URL).strip().rstrip('/')
+        # localhost与127.0.0.1视为同一服务，共享缓存
+        return url.replace("://localhost", "://127.0.0.1")
+
+    def _get_entry(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(url)
+
+    def _fetch(self, url: str) -> Dict[str, Any]:
+        """请求/api/tags并更新缓存条目"""
+        previous = self._get_entry(url) or {}
+        entry = {
+            "models": previous.get("models", []),
+            "details": previous.get("details", []),
+            "digest": previous.get("digest"),
+            "etag": previous.get("etag"),
+            "version": previous.get("version", 0),
+            "reachable": False,
+            "fetched_at": time.time(),
+        }
+
+        if not REQUESTS_AVAILABLE:
+            return entry
+
+        headers = {"If-None-Match": previous["etag"]} if previous.get("etag") else {}
+        try:
+            response = http_client.get(f"{url}/api/tags", headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                entry["reachable"] = True
+            elif response.status_code == 200:
+                details = response.json().get('models', [])
+                # 以“名称@digest”计算目录指纹，模型增删或重新导入都会改变指纹
+                fingerprint = hashlib.sha256("\n".join(sorted(
+                    f"{model.get('name', '')}@{model.get('digest', '')}" for model in details
+                )).encode('utf-8')).hexdigest()
+                if fingerprint != entry["digest"]:
+                    entry["version"] += 1
+                entry.update({
+                    "models": [model['name'] for model in details if model.get('name')],
+                    "details": details,
+                    "digest": fingerprint,
+                    "etag": response.headers.get("ETag"),
+                    "reachable": True,
+                })
+        except Exception as e:
+            pass
+
+        entry["fetched_at"] = time.time()
+        return entry
+
+    def refresh(self, url: Optional[str] = None) -> Dict[str, Any]:
+        """刷新指定地址的模型列表，并发调用只会触发一次网络请求"""
+        url = self._normalize_url(url)
+        with self._lock:
+            event = self._inflight.get(url)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._inflight[url] = event
+
+        if not leader:
+            event.wait(self.timeout + 1.0)
+            return self._get_entry(url) or {}
+
+        try:
+            entry = self._fetch(url)
+            with self._lock:
+                self._entries[url] = entry
+            return entry
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            event.set()
+
+    def refresh_in_background(self, url: Optional[str] = None):
+        """在后台线程刷新（已有刷新进行中时直接返回）"""
+        url = self._normalize_url(url)
+        with self._lock:
+            if url in self._inflight:
+                return
+        threading.Thread(target=self.refresh, args=(url,), daemon=True).start()
+
+    def get_models(self, url: Optional[str] = None, block: bool = False,
+                   max_age: Optional[float] = None) -> Optional[List[str]]:
+        """
+        获取模型名称列表
+        :param block: 缓存过期时是否等待刷新完成；False时返回旧数据并在后台刷新
+        :param max_age: 可接受的缓存年龄（秒），默认使用TTL
+        :return: 模型名称列表；从未成功获取过时返回None
+        """
+        url = self._normalize_url(url)
+        max_age = self.ttl if max_age is None else max_age
+        entry = self._get_entry(url)
+
+        if entry is None or time.time() - entry["fetched_at"] >= max_age:
+            if block:
+                entry = self.refresh(url)
+            else:
+                self.refresh_in_background(url)
+
+        if not entry or (not entry.get("reachable") and not entry.get("models")):
+            return None
+        return list(entry["models"])
+
+    def get_model_details(self, url: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取缓存中的模型详细信息（/api/tags原始条目）"""
+        entry = self._get_entry(self._normalize_url(url)) or {}
+        return list(entry.get("details", []))
+
+    def get_version(self, url: Optional[str] = None) -> int:
+        """目录版本号，模型列表变化时递增"""
+        entry = self._get_entry(self._normalize_url(url)) or {}
+        return entry.get("version", 0)
+
+    def is_reachable(self, url: Optional[str] = None, max_age: float = 2.0) -> bool:
+        """检查服务是否可达，复用足够新的缓存结果"""
+        url = self._normalize_url(url)
+        entry = self._get_entry(url)
+        if entry is None or time.time() - entry["fetched_at"] >= max_age:
+            entry = self.refresh(url)
+        return bool(entry and entry.get("reachable"))
+
+    def _model_digest(self, url: str, model: str) -> Optional[str]:
+        for detail in self.get_model_details(url):
+            if detail.get('name') in (model, f"{model}:latest"):
+                return detail.get('digest')
+        return None
+    
+    def get_model_info(self, model: str, url: Optional[str] = None) -> Dict[str, Any]:
+        """获取/api/show返回的模型元数据（模型重新导入后自动失效）"""
+        url = self._normalize_url(url)
+        digest = self._model_digest(url, model)
+        with self._lock:
+            cached = self._show_cache.get((url, model))
+            failed_until = self._show_failures.get((url, model), 0)
+        if cached is not None and (digest is None or cached[0] == digest):
+            return cached[1]
+        if time.time() < failed_until:
+            return {}
+        
+        info: Dict[str, Any] = {}
+        if REQUESTS_AVAILABLE:
+            try:
+                response = http_client.post(f"{url}/api/show", json={"model": model}, timeout=self.timeout)
+                if response.status_code == 200:
+                    info = response.json()
+            except Exception as e:
+                pass
+        with self._lock:
+            if info:
+                self._show_cache[(url, model)] = (digest, info)
+                self._show_failures.pop((url, model), None)
+            else:
+                self._show_failures[(url, model)] = time.time() + self.ttl
+        return info
+    
+    def get_reasoning_support(self, model: str, url: Optional[str] = None) -> Tuple[bool, bool]:
+        """
+        判断是否为推理模型
+        :return: (是否会输出思考过程, 服务端是否支持think参数关闭思考)
+        新版Ollama在capabilities中声明"thinking"，此时可以直接关闭思考；
+        旧版只能从模板中的<think>标记识别，需要流式截断
+        """
+        info = self.get_model_info(model, url)
+        if "thinking" in (info.get("capabilities") or []):
+            return True, True
+        template = info.get("template") or ""
+        return "<think>" in template, False
+    
+    def invalidate(self, url: Optional[str] = None):
+        """使缓存失效（url为None时清空全部）"""
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                self._show_cache.clear()
+                self._show_failures.clear()
+            else:
+                url = self._normalize_url(url)
+                self._entries.pop(url, None)
+                self._show_cache = {key: value for key, value in self._show_cache.items() if key[0] != url}
+                self._show_failures = {key: value for key, value in self._show_failures.items() if key[0] != url}
+
+
+# 全局实例
+model_catalog = OllamaModelCatalog()
@@ -6,15 +6,28 @@ Ollama模型转换器 - 将GGUF模型自动转换为Ollama格式
 - 扫描指定目录的GGUF文件
 - 生成Modelfile配置
 - 调用ollama create命令转换模型
+- 后台任务队列，支持并发转换、进度和取消
+- 内容哈希索引：未变化的文件不重复哈希，相同内容的模型跳过或直接别名
+- blob导入模式：通过/api/blobs流式上传；配置了服务端的模型目录（OLLAMA_MODELS）且位于同一
+  文件系统时，使用reflink直接放入blob存储
 - 与现有Ollama集成无缝对接
 """
 
 import os
+import re
+import sys
 import json
+import mmap
+import shutil
+import hashlib
+import uuid
+import queue
+import asyncio
 import subprocess
+import threading
 import time
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 try:
     import requests
@@ -29,6 +42,156 @@ try:
 except ImportError:
     WEB_AVAILABLE = False
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ollama_model_catalog import model_catalog, DEFAULT_OLLAMA_URL
+from http_client import http_client
+
+# 转换模式: cli=ollama create命令, blob=blob API, auto=优先blob API，失败时回退到命令行
+CONVERSION_MODES = ("auto", "blob", "cli")
+
+# Linux FICLONE ioctl（btrfs/xfs等支持写时复制的文件系统）
+FICLONE = 0x40049409
+
+# Modelfile指令（值可以是三引号包裹的多行文本）
+MODELFILE_COMMAND_PATTERN = re.compile(r'^\s*(\w+)\s+("{3}(.*?)"{3}|(.*?))\s*$', re.M | re.S)
+
+# GGUF内容哈希索引文件位置
+HASH_INDEX_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "user_data", "gguf_hash_index.json"
+)
+
+
+def sha256_file(file_path: str, chunk_size: int = 64 * 1024 * 1024,
+                progress_callback=None) -> str:
+    """使用mmap流式计算文件sha256，避免把多GB模型读入Python对象"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, chunk_size):
+                    digest.update(view[offset:offset + chunk_size])
+                    if progress_callback is not None:
+                        progress_callback(min(offset + chunk_size, size) / size)
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def modelfile_config_hash(modelfile_path: str) -> str:
+    """Modelfile除FROM行以外内容的哈希，用于判断两个模型的配置是否一致"""
+    try:
+        with open(modelfile_path, 'r', encoding='utf-8') as f:
+            lines = [line.rstrip() for line in f
+                     if not line.strip().upper().startswith("FROM ")]
+    except Exception as e:
+        return ""
+    return hashlib.sha256("\n".join(lines).encode('utf-8')).hexdigest()
+
+
+class GGUFHashIndex:
+    """
+    GGUF内容哈希索引
+    (路径, 大小, mtime) → sha256，并记录每个digest已经导入成的Ollama模型
+    文件大小和mtime未变化时直接复用哈希，重新扫描大型模型库无需重新读取文件
+    """
+    
+    def __init__(self, index_path: str = HASH_INDEX_PATH):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+    
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get("files", {}) if isinstance(data, dict) else {}
+        except Exception as e:
+            return {}
+    
+    def _save(self):
+        """原子写入索引文件（调用方持有锁）"""
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": 1, "files": self._entries}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"[GGUFHashIndex] 保存索引失败: {e}")
+    
+    def lookup(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """返回仍然有效的索引条目（文件大小或mtime变化时返回None）"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                return dict(entry)
+        return None
+    
+    def get_digest(self, file_path: str, progress_callback=None) -> str:
+        """获取文件sha256，只有新文件或已变化的文件才重新计算"""
+        entry = self.lookup(file_path)
+        if entry is not None:
+            return entry["sha256"]
+        
+        stat = os.stat(file_path)
+        digest = sha256_file(file_path, progress_callback=progress_callback)
+        with self._lock:
+            previous = self._entries.get(file_path) or {}
+            self._entries[file_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest,
+                # 内容变化后旧的导入记录不再适用
+                "conversions": previous.get("conversions", {}) if previous.get("sha256") == digest else {},
+            }
+            self._save()
+        return digest
+    
+    def record_conversion(self, file_path: str, ollama_name: str, config_hash: str):
+        """记录文件已导入为指定Ollama模型"""
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None:
+                return
+            entry.setdefault("conversions", {})[ollama_name] = config_hash
+            self._save()
+    
+    def find_conversion(self, digest: str, config_hash: str,
+                        exclude: Optional[str] = None) -> Optional[str]:
+        """查找由相同内容、相同配置导入的现有模型名称"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.get("sha256") != digest:
+                    continue
+                for name, recorded_hash in entry.get("conversions", {}).items():
+                    if name != exclude and recorded_hash == config_hash:
+                        return name
+        return None
+    
+    def get_conversion_hash(self, file_path: str, ollama_name: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(file_path) or {}
+            return entry.get("conversions", {}).get(ollama_name)
+    
+    def prune(self, existing_paths: Set[str]):
+        """移除已删除文件的条目"""
+        with self._lock:
+            stale = [path for path in self._entries if path not in existing_paths]
+            for path in stale:
+                del self._entries[path]
+            if stale:
+                self._save()
+
+
 class OllamaModelConverter:
     """Ollama模型转换器"""
     
@@ -42,64 +205,124 @@ class OllamaModelConverter:
         self.import_dir.mkdir(parents=True, exist_ok=True)
         self.modelfiles_dir.mkdir(parents=True, exist_ok=True)
         
+        # 扫描结果缓存: (目录签名, 文件信息列表)
+        self._scan_cache = None
+        self._scan_lock = threading.Lock()
+        
+        # 内容哈希索引
+        self.hash_index = GGUFHashIndex()
+        
+        # 转换模式
+        mode = os.getenv("OLLAMA_CONVERT_MODE", "auto").lower()
+        self.conversion_mode = mode if mode in CONVERSION_MODES else "auto"
+        
+        # Ollama服务端的模型目录，只有显式配置时才直接链接到blob存储（不猜测~/.ollama/models，
+        # 服务可能以其他用户或在容器中运行，使用的是另一个存储）
+        self.ollama_models_dir = os.getenv("OLLAMA_MODELS") or None
+        
     
-    def scan_gguf_models(self) -> List[Dict]:
-        """扫描目录中的GGUF模型文件"""
+    def _scan_signature(self) -> Tuple:
+        """目录与GGUF文件的(mtime, size)签名，用于判断扫描缓存是否仍然有效"""
+        entries = []
+        for root, dirs, files in os.walk(self.import_dir):
+            dirs.sort()
+            entries.append((root, os.stat(root).st_mtime_ns))
+            for name in sorted(files):
+                if name.endswith(".gguf") or name == "Modelfile":
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((os.path.join(root, name), stat.st_size, stat.st_mtime_ns))
+        return tuple(entries)
+    
+    def _scan_files(self) -> List[Dict]:
+        """扫描GGUF文件信息（不含转换状态）"""
         models = []
+        for file_path in sorted(self.import_dir.glob("**/*.gguf")):
+            if file_path.is_file():
+                model_name = file_path.stem
+                
+                # 检查同目录下是否存在Modelfile
+                model_dir = file_path.parent
+                existing_modelfile = model_dir / "Modelfile"
+                has_existing_modelfile = existing_modelfile.exists() and existing_modelfile.is_file()
+                
+                # 确定使用的Modelfile路径
+                if has_existing_modelfile:
+                    modelfile_path = str(existing_modelfile)
+                else:
+                    modelfile_path = str(self.modelfiles_dir / f"{model_name}.modelfile")
+                
+                models.append({
+                    'name': model_name,
+                    'file_path': str(file_path),
+                    'file_size': file_path.stat().st_size,
+                    'ollama_name': f"custom-{model_name}",
+                    'modelfile_path': modelfile_path,
+                    'has_existing_modelfile': has_existing_modelfile
+                })
+        return models
+    
+    def get_converted_models(self) -> Set[str]:
+        """获取Ollama中已有的模型名称集合（每次扫描只查询一次）"""
+        names = model_catalog.get_models(block=True, max_age=2.0)
+        if names is None:
+            # 服务不可达时退回到ollama list
+            names = []
+            try:
+                result = subprocess.run(
+                    ["ollama", "list"],
+                    capture_output=True,
+                    text=True,
+                    timeout=10
+                )
+                if result.returncode == 0:
+                    # 跳过表头，第一列是模型名称
+                    names = [line.split()[0] for line in result.stdout.splitlines()[1:] if line.strip()]
+            except Exception as e:
+                pass
         
+        converted = set()
+        for name in names:
+            converted.add(name)
+            # 兼容带有默认:latest标签的名称
+            if name.endswith(":latest"):
+                converted.add(name[:-len(":latest")])
+        return converted
+    
+    def scan_gguf_models(self) -> List[Dict]:
+        """扫描目录中的GGUF模型文件（文件列表按目录/文件签名缓存）"""
         try:
-            for file_path in self.import_dir.glob("**/*.gguf"):
-                if file_path.is_file():
-                    # 检查是否已经转换
-                    model_name = file_path.stem
-                    is_converted = self.check_if_converted(model_name)
-                    
-                    # 检查同目录下是否存在Modelfile
-                    model_dir = file_path.parent
-                    existing_modelfile = model_dir / "Modelfile"
-                    has_existing_modelfile = existing_modelfile.exists() and existing_modelfile.is_file()
-                    
-                    # 确定使用的Modelfile路径
-                    if has_existing_modelfile:
-                        modelfile_path = str(existing_modelfile)
-                    else:
-                        modelfile_path = str(self.modelfiles_dir / f"{model_name}.modelfile")
-                    
-                    model_info = {
-                        'name': model_name,
-                        'file_path': str(file_path),
-                        'file_size': file_path.stat().st_size,
-                        'is_converted': is_converted,
-                        'ollama_name': f"custom-{model_name}",
-                        'modelfile_path': modelfile_path,
-                        'has_existing_modelfile': has_existing_modelfile
-                    }
-                    models.append(model_info)
-            
-            return models
+            signature = self._scan_signature()
+            with self._scan_lock:
+                if self._scan_cache is None or self._scan_cache[0] != signature:
+                    self._scan_cache = (signature, self._scan_files())
+                    self.hash_index.prune({model['file_path'] for model in self._scan_cache[1]})
+                cached_models = self._scan_cache[1]
+            
+            # 转换状态每次扫描只查询一次Ollama，然后按集合匹配
+            converted = self.get_converted_models()
+            results = []
+            for model in cached_models:
+                # 扫描只读取已索引的哈希，不触发文件读取
+                entry = self.hash_index.lookup(model['file_path'])
+                is_converted = model['ollama_name'] in converted
+                results.append({
+                    **model,
+                    'is_converted': is_converted,
+                    'sha256': entry['sha256'] if entry else None,
+                    # 已导入但文件在导入后发生了变化
+                    'needs_update': is_converted and entry is None
+                                    and self.hash_index.get_conversion_hash(model['file_path'], model['ollama_name']) is not None,
+                })
+            return results
             
         except Exception as e:
             return []
     
-    def check_if_converted(self, model_name: str) -> bool:
+    def check_if_converted(self, model_name: str, converted: Optional[Set[str]] = None) -> bool:
         """检查模型是否已经转换到Ollama"""
-        try:
-            # 检查ollama list中是否存在
-            result = subprocess.run(
-                ["ollama", "list"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            if result.returncode == 0:
-                ollama_name = f"custom-{model_name}"
-                return ollama_name in result.stdout
-            
-        except Exception as e:
-            pass
-        
-        return False
+        if converted is None:
+            converted = self.get_converted_models()
+        return f"custom-{model_name}" in converted
     
     def generate_modelfile(self, model_info: Dict) -> str:
         """生成Modelfile配置"""
@@ -161,8 +384,8 @@ Assistant: {{{{ .Response }}}}
         except Exception as e:
             return False
     
-    def convert_model(self, model_info: Dict) -> Tuple[bool, str]:
-        """转换模型到Ollama格式"""
+    def convert_model(self, model_info: Dict, job: Optional["ConversionJob"] = None) -> Tuple[bool, str]:
+        """转换模型到Ollama格式（传入job时上报进度并支持取消）"""
         try:
             # 检查是否使用现有Modelfile
             if model_info.get('has_existing_modelfile', False):
@@ -173,46 +396,518 @@ Assistant: {{{{ .Response }}}}
                 if not self.create_modelfile(model_info):
                     return False, "Modelfile创建失败"
             
-            # 执行ollama create命令
             modelfile_path = model_info['modelfile_path']
             ollama_name = model_info['ollama_name']
+            file_path = model_info['file_path']
             
+            # 计算内容哈希（未变化的文件直接使用索引）
+            def report_hash_progress(fraction):
+                if job is not None:
+                    job.stage = "计算文件哈希"
+                    job.progress = fraction
+            digest = self.hash_index.get_digest(file_path, report_hash_progress)
+            config_hash = modelfile_config_hash(modelfile_path)
+            if job is not None and job.cancel_requested:
+                return False, "转换已取消"
             
-            result = subprocess.run(
-                ["ollama", "create", ollama_name, "-f", modelfile_path],
-                capture_output=True,
-                text=True,
-                timeout=300  # 5分钟超时
-            )
+            converted = self.get_converted_models()
+            # 同名模型已由相同内容和配置导入，跳过
+            if ollama_name in converted and self.hash_index.get_conversion_hash(file_path, ollama_name) == config_hash:
+                return True, f"模型 {ollama_name} 未发生变化，已跳过转换"
+            
+            # 相同内容和配置已导入为其他模型，直接复制清单作为别名
+            existing = self.hash_index.find_conversion(digest, config_hash, exclude=ollama_name)
+            if existing and existing in converted and self._copy_model(existing, ollama_name):
+                self.hash_index.record_conversion(file_path, ollama_name, config_hash)
+                model_catalog.invalidate()
+                return True, f"模型 {ollama_name} 与 {existing} 内容相同，已创建别名"
             
-            if result.returncode == 0:
+            # blob API导入：文件已在blob存储中时无需再次复制
+            if self.conversion_mode != "cli":
+                result = self._convert_via_blob(model_info, digest, job)
+                if result is not None:
+                    success, message = result
+                    if success:
+                        self.hash_index.record_conversion(file_path, ollama_name, config_hash)
+                        model_catalog.invalidate()
+                    if success or self.conversion_mode == "blob" or (job is not None and job.cancel_requested):
+                        return success, message
+            
+            # 执行ollama create命令
+            returncode, output = self._run_ollama_create(ollama_name, modelfile_path, job)
+            
+            if job is not None and job.cancel_requested:
+                return False, "转换已取消"
+            if returncode == 0:
+                self.hash_index.record_conversion(file_path, ollama_name, config_hash)
+                model_catalog.invalidate()
                 return True, f"模型 {ollama_name} 转换成功"
             else:
-                error_msg = result.stderr or result.stdout or "未知错误"
+                error_msg = output or "未知错误"
                 return False, f"转换失败: {error_msg}"
                 
         except subprocess.TimeoutExpired:
-            return False, "转换超时（5分钟）"
+            return False, "转换超时（5分钟无输出）"
         except Exception as e:
             return False, f"转换异常: {str(e)}"
     
+    @staticmethod
+    def parse_modelfile(modelfile_path: str) -> Optional[Dict[str, Any]]:
+        """
+        解析Modelfile为/api/create参数
+        只支持FROM/PARAMETER/SYSTEM/TEMPLATE，包含其他指令时返回None（交由命令行处理）
+        """
+        try:
+            with open(modelfile_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except Exception as e:
+            return None
+        
+        def only_comments(text: str) -> bool:
+            return all(not line.strip() or line.strip().startswith("#") for line in text.splitlines())
+        
+        result: Dict[str, Any] = {"parameters": {}}
+        position = 0
+        for match in MODELFILE_COMMAND_PATTERN.finditer(content):
+            # 指令之间只允许空白和注释
+            if not only_comments(content[position:match.start()]):
+                return None
+            position = match.end()
+            
+            command = match.group(1).upper()
+            value = match.group(3) if match.group(3) is not None else match.group(4).strip()
+            if command == "FROM":
+                result["from"] = value
+            elif command in ("SYSTEM", "TEMPLATE"):
+                result[command.lower()] = value
+            elif command == "PARAMETER":
+                parts = value.split(None, 1)
+                if len(parts) != 2:
+                    return None
+                key, raw = parts[0], parts[1].strip()
+                if raw.startswith('"') and raw.endswith('"'):
+                    raw = raw[1:-1]
+                else:
+                    try:
+                        raw = int(raw)
+                    except ValueError:
+                        try:
+                            raw = float(raw)
+                        except ValueError:
+                            pass
+                if key == "stop":
+                    result["parameters"].setdefault("stop", []).append(raw)
+                else:
+                    result["parameters"][key] = raw
+            else:
+                return None
+        
+        if not only_comments(content[position:]):
+            return None
+        return result if "from" in result else None
+    
+    def get_ollama_models_dir(self) -> Optional[Path]:
+        """配置的Ollama服务端模型存储目录（OLLAMA_MODELS或转换器配置），未配置时返回None"""
+        return Path(self.ollama_models_dir).expanduser() if self.ollama_models_dir else None
+    
+    def _blob_exists(self, digest: str) -> bool:
+        try:
+            response = http_client.head(f"{DEFAULT_OLLAMA_URL}/api/blobs/sha256:{digest}", timeout=5)
+            return response.status_code == 200
+        except Exception as e:
+            return False
+    
+    def _link_into_blob_store(self, file_path: str, digest: str) -> Optional[str]:
+        """
+        在同一文件系统上用reflink把GGUF直接放入Ollama blob存储（写时复制，源文件之后被修改也不影响blob）
+        只在配置了服务端模型目录时进行，并通过/api/blobs确认服务端能看到该blob，否则撤销链接；
+        不使用硬链接：blob会与用户的GGUF共享数据，原地修改源文件会损坏已导入的模型
+        :return: "reflink"，不适用时返回None（由调用方流式上传）
+        """
+        models_dir = self.get_ollama_models_dir()
+        if models_dir is None:
+            return None
+        blobs_dir = models_dir / "blobs"
+        try:
+            if not blobs_dir.is_dir() or os.stat(blobs_dir).st_dev != os.stat(file_path).st_dev:
+                return None
+        except OSError:
+            return None
+        
+        target = blobs_dir / f"sha256-{digest}"
+        if target.exists():
+            # 调用方已确认服务端没有该blob，说明这里不是服务端使用的存储
+            return None
+        tmp_target = blobs_dir / f"sha256-{digest}-partial-{uuid.uuid4().hex[:8]}"
+        
+        try:
+            import fcntl
+            with open(file_path, 'rb') as src, open(tmp_target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(file_path, tmp_target)
+            os.replace(tmp_target, target)
+        except Exception as e:
+            try:
+                os.unlink(tmp_target)
+            except OSError:
+                pass
+            return None
+        
+        if not self._blob_exists(digest):
+            # 配置的目录不是服务端实际使用的存储：删除刚放入的文件，改为上传
+            try:
+                os.unlink(target)
+            except OSError:
+                pass
+            return None
+        return "reflink"
+    
+    def _upload_blob(self, file_path: str, digest: str, job: Optional["ConversionJob"] = None,
+                     chunk_size: int = 8 * 1024 * 1024) -> bool:
+        """流式上传GGUF到/api/blobs（不会把整个文件读入内存）"""
+        total = os.path.getsize(file_path)
+        
+        def stream():
+            sent = 0
+            with open(file_path, 'rb') as f:
+                while True:
+                    if job is not None and job.cancel_requested:
+                        raise IOError("转换已取消")
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    if job is not None:
+                        job.stage = "上传模型文件"
+                        job.progress = sent / total if total else 1.0
+                    yield chunk
+        
+        response = http_client.post(
+            f"{DEFAULT_OLLAMA_URL}/api/blobs/sha256:{digest}",
+            data=stream(),
+            headers={"Content-Length": str(total), "Content-Type": "application/octet-stream"},
+            timeout=(10, 600)
+        )
+        return response.status_code in (200, 201)
+    
+    def _convert_via_blob(self, model_info: Dict, digest: str,
+                          job: Optional["ConversionJob"] = None) -> Optional[Tuple[bool, str]]:
+        """
+        通过blob API导入：blob已存在或可链接时不复制数据，否则流式上传一次，
+        再用/api/create引用该digest创建模型
+        :return: (成功, 消息)；不适用blob模式时返回None
+        """
+        if not REQUESTS_AVAILABLE:
+            return None
+        spec = self.parse_modelfile(model_info['modelfile_path'])
+        if spec is None:
+            return None
+        from_path = Path(spec["from"]).expanduser()
+        if not from_path.is_absolute():
+            from_path = Path(model_info['modelfile_path']).parent / from_path
+        if not from_path.is_file() or os.path.realpath(from_path) != os.path.realpath(model_info['file_path']):
+            # FROM指向其他模型或文件时交给命令行
+            return None
+        if not model_catalog.is_reachable(DEFAULT_OLLAMA_URL):
+            return None
+        
+        ollama_name = model_info['ollama_name']
+        try:
+            method = "existing" if self._blob_exists(digest) else None
+            if method is None:
+                if job is not None:
+                    job.stage = "链接到Ollama存储"
+                method = self._link_into_blob_store(model_info['file_path'], digest)
+            if method is None:
+                if not self._upload_blob(model_info['file_path'], digest, job):
+                    return False, "blob上传失败"
+                method = "upload"
+            
+            payload: Dict[str, Any] = {
+                "model": ollama_name,
+                "files": {os.path.basename(model_info['file_path']): f"sha256:{digest}"},
+                "stream": True,
+            }
+            for key in ("system", "template"):
+                if spec.get(key):
+                    payload[key] = spec[key]
+            if spec["parameters"]:
+                payload["parameters"] = spec["parameters"]
+            
+            response = http_client.post(f"{DEFAULT_OLLAMA_URL}/api/create", json=payload, stream=True, timeout=(10, 600))
+            if response.status_code != 200:
+                # 旧版Ollama不支持files参数，auto模式回退到命令行
+                if self.conversion_mode == "auto":
+                    return None
+                return False, f"转换失败: HTTP {response.status_code} {response.text[:200]}"
+            
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                status = json.loads(line)
+                if status.get("error"):
+                    return False, f"转换失败: {status['error']}"
+                if job is not None:
+                    if job.cancel_requested:
+                        response.close()
+                        return False, "转换已取消"
+                    job.update_from_output(status.get("status", ""))
+            
+            method_names = {"existing": "复用已有blob", "reflink": "reflink", "upload": "流式上传"}
+            return True, f"模型 {ollama_name} 转换成功（{method_names.get(method, method)}）"
+        except Exception as e:
+            if job is not None and job.cancel_requested:
+                return False, "转换已取消"
+            if self.conversion_mode == "auto":
+                return None
+            return False, f"转换异常: {str(e)}"
+    
+    def _copy_model(self, source: str, destination: str) -> bool:
+        """通过/api/copy为已有模型创建别名（不复制blob）"""
+        if not REQUESTS_AVAILABLE:
+            return False
+        try:
+            response = http_client.post(
+                f"{DEFAULT_OLLAMA_URL}/api/copy",
+                json={"source": source, "destination": destination},
+                timeout=30
+            )
+            return response.status_code == 200
+        except Exception as e:
+            return False
+    
+    def _run_ollama_create(self, ollama_name: str, modelfile_path: str,
+                           job: Optional["ConversionJob"] = None, idle_timeout: float = 300) -> Tuple[int, str]:
+        """
+        流式执行ollama create，逐行解析输出
+        idle_timeout为无输出超时，大模型导入只要仍有进度输出就不会被中断
+        """
+        process = subprocess.Popen(
+            ["ollama", "create", ollama_name, "-f", modelfile_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        if job is not None:
+            job.process = process
+        
+        lines: List[str] = []
+        last_activity = [time.time()]
+        
+        def read_output():
+            buffer = b""
+            while True:
+                chunk = process.stdout.read1(4096)
+                if not chunk:
+                    break
+                last_activity[0] = time.time()
+                buffer += chunk
+                # 进度条使用\r刷新同一行，按\r和\n切分
+                parts = re.split(rb"[\r\n]", buffer)
+                buffer = parts.pop()
+                for part in parts:
+                    line = ANSI_ESCAPE_PATTERN.sub("", part.decode("utf-8", errors="replace")).strip()
+                    if line:
+                        lines.append(line)
+                        if job is not None:
+                            job.update_from_output(line)
+            tail = ANSI_ESCAPE_PATTERN.sub("", buffer.decode("utf-8", errors="replace")).strip()
+            if tail:
+                lines.append(tail)
+        
+        reader = threading.Thread(target=read_output, daemon=True)
+        reader.start()
+        
+        while process.poll() is None:
+            if job is not None and job.cancel_requested:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                break
+            if time.time() - last_activity[0] > idle_timeout:
+                process.kill()
+                raise subprocess.TimeoutExpired(process.args, idle_timeout)
+            time.sleep(0.2)
+        
+        reader.join(timeout=2)
+        return process.wait(), "\n".join(lines[-20:])
+    
     def get_available_models(self) -> List[Dict]:
         """获取可用的GGUF模型列表"""
         return self.scan_gguf_models()
     
-    def convert_model_by_name(self, model_name: str) -> Tuple[bool, str]:
-        """根据模型名称转换模型"""
-        models = self.scan_gguf_models()
-        
-        for model in models:
+    def find_model(self, model_name: str) -> Optional[Dict]:
+        """根据名称查找GGUF模型信息"""
+        for model in self.scan_gguf_models():
             if model['name'] == model_name:
-                return self.convert_model(model)
+                return model
+        return None
+    
+    def convert_model_by_name(self, model_name: str, job: Optional["ConversionJob"] = None) -> Tuple[bool, str]:
+        """根据模型名称转换模型"""
+        model = self.find_model(model_name)
+        if model is not None:
+            return self.convert_model(model, job)
         
         return False, f"未找到模型: {model_name}"
 
 
+# 去除ollama进度条中的ANSI控制序列
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)%")
+
+
+class ConversionJob:
+    """单个模型转换任务"""
+    
+    def __init__(self, model_name: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.model_name = model_name
+        self.status = "queued"  # queued, running, succeeded, failed, cancelled
+        self.stage = "排队中"
+        self.progress: Optional[float] = None
+        self.message = ""
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.process = None
+        self.done = threading.Event()
+    
+    def update_from_output(self, line: str):
+        """解析ollama create输出的阶段与百分比"""
+        match = PERCENT_PATTERN.search(line)
+        if match:
+            self.progress = min(float(match.group(1)), 100.0) / 100.0
+        self.stage = line[:200]
+    
+    def finish(self, status: str, message: str):
+        self.status = status
+        self.message = message
+        self.finished_at = time.time()
+        if status == "succeeded":
+            self.progress = 1.0
+        self.process = None
+        self.done.set()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "model_name": self.model_name,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ConversionJobQueue:
+    """
+    后台转换任务队列
+    转换在工作线程中执行，aiohttp事件循环不再被ollama create阻塞
+    """
+    
+    def __init__(self, converter: OllamaModelConverter, max_concurrent: Optional[int] = None, history: int = 50):
+        self.converter = converter
+        self.max_concurrent = max(int(max_concurrent or os.getenv("OLLAMA_CONVERT_CONCURRENCY", 1)), 1)
+        self.history = history
+        self._queue: "queue.Queue[ConversionJob]" = queue.Queue()
+        self._jobs: Dict[str, ConversionJob] = {}
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+    
+    def set_max_concurrent(self, max_concurrent: int):
+        """调整并发转换数量（增加时立即生效，减少时在当前任务结束后生效）"""
+        with self._lock:
+            self.max_concurrent = max(int(max_concurrent), 1)
+        self._ensure_workers()
+    
+    def _ensure_workers(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.max_concurrent:
+                worker = threading.Thread(target=self._worker_loop, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+    
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                # queued -> running与cancel()在同一把锁下进行，已取消的任务不会再被执行
+                with self._lock:
+                    if job.cancel_requested or job.done.is_set():
+                        continue
+                    job.status = "running"
+                    job.started_at = time.time()
+                self._run_job(job)
+            finally:
+                self._queue.task_done()
+            with self._lock:
+                # 并发数被调小时，多余的工作线程退出
+                alive = [w for w in self._workers if w.is_alive()]
+                if len(alive) > self.max_concurrent:
+                    self._workers.remove(threading.current_thread())
+                    return
+    
+    def _run_job(self, job: ConversionJob):
+        job.stage = "准备中"
+        try:
+            success, message = self.converter.convert_model_by_name(job.model_name, job)
+        except Exception as e:
+            success, message = False, f"转换异常: {str(e)}"
+        
+        if job.cancel_requested:
+            job.finish("cancelled", "转换已取消")
+        else:
+            job.finish("succeeded" if success else "failed", message)
+    
+    def submit(self, model_name: str) -> ConversionJob:
+        """提交转换任务，同一模型已有未完成任务时直接返回该任务"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.model_name == model_name and job.status in ("queued", "running"):
+                    return job
+            
+            job = ConversionJob(model_name)
+            self._jobs[job.id] = job
+            
+            # 只保留最近的已完成任务
+            finished = sorted((j for j in self._jobs.values() if j.done.is_set()), key=lambda j: j.created_at)
+            for old_job in finished[:max(len(self._jobs) - self.history, 0)]:
+                del self._jobs[old_job.id]
+        
+        self._queue.put(job)
+        self._ensure_workers()
+        return job
+    
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的任务（运行中的任务由工作线程在转换中止后结束）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return False
+            job.cancel_requested = True
+            if job.status == "queued":
+                job.finish("cancelled", "转换已取消")
+        return True
+    
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        return self._jobs.get(job_id)
+    
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in sorted(jobs, key=lambda j: j.created_at, reverse=True)]
+
+
 # 全局转换器实例
 model_converter = OllamaModelConverter()
+conversion_queue = ConversionJobQueue(model_converter)
 
 
 # API端点
@@ -221,14 +916,20 @@ if WEB_AVAILABLE:
     async def get_models(request):
         """获取可用模型列表"""
         try:
-            models = model_converter.get_available_models()
+            # 扫描涉及文件系统和Ollama查询，放到线程池中执行，避免阻塞事件循环
+            loop = asyncio.get_running_loop()
+            models = await loop.run_in_executor(None, model_converter.get_available_models)
             return web.json_response({"models": models})
         except Exception as e:
             return web.json_response({"error": str(e)}, status=500)
     
     @PromptServer.instance.routes.post("/ollama_converter/convert")
     async def convert_model_api(request):
-        """转换模型API"""
+        """
+        转换模型API
+        async=true时立即返回job_id，通过任务状态接口查询进度；
+        否则在不阻塞事件循环的前提下等待转换完成后返回结果
+        """
         try:
             data = await request.json()
             model_name = data.get('model_name')
@@ -236,15 +937,67 @@ if WEB_AVAILABLE:
             if not model_name:
                 return web.json_response({"error": "缺少model_name参数"}, status=400)
             
-            success, message = model_converter.convert_model_by_name(model_name)
+            job = conversion_queue.submit(model_name)
+            if data.get('async'):
+                return web.json_response({"success": True, "message": "转换任务已提交", **job.to_dict()})
+            
+            while not job.done.is_set():
+                await asyncio.sleep(0.5)
             
             return web.json_response({
-                "success": success,
-                "message": message
+                "success": job.status == "succeeded",
+                "message": job.message,
+                "job_id": job.id
             })
             
         except Exception as e:
             return web.json_response({"error": str(e)}, status=500)
     
+    @PromptServer.instance.routes.get("/ollama_converter/jobs")
+    async def list_conversion_jobs(request):
+        """列出转换任务"""
+        return web.json_response({
+            "jobs": conversion_queue.list_jobs(),
+            "max_concurrent": conversion_queue.max_concurrent
+        })
+    
+    @PromptServer.instance.routes.get("/ollama_converter/jobs/{job_id}")
+    async def get_conversion_job(request):
+        """查询转换任务状态"""
+        job = conversion_queue.get(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({"error": "任务不存在"}, status=404)
+        return web.json_response(job.to_dict())
+    
+    @PromptServer.instance.routes.post("/ollama_converter/jobs/{job_id}/cancel")
+    async def cancel_conversion_job(request):
+        """取消转换任务"""
+        success = conversion_queue.cancel(request.match_info["job_id"])
+        return web.json_response({
+            "success": success,
+            "message": "已请求取消" if success else "任务不存在或已结束"
+        })
+    
+    @PromptServer.instance.routes.post("/ollama_converter/config")
+    async def update_converter_config(request):
+        """设置并发转换数量与转换模式"""
+        try:
+            data = await request.json()
+            if 'max_concurrent' in data:
+                conversion_queue.set_max_concurrent(int(data['max_concurrent']))
+            if data.get('mode') in CONVERSION_MODES:
+                model_converter.conversion_mode = data['mode']
+            if 'ollama_models_dir' in data:
+                # Ollama服务端的模型目录（与OLLAMA_MODELS相同），用于reflink导入；空值表示关闭
+                model_converter.ollama_models_dir = data['ollama_models_dir'] or None
+            return web.json_response({
+                "success": True,
+                "max_concurrent": conversion_queue.max_concurrent,
+                "mode": model_converter.conversion_mode,
+                "ollama_models_dir": model_converter.ollama_models_dir
+            })
+        except Exception as e:
+            return web.json_response({"error": str(e)}, status=500)
+    
 else:
     pass
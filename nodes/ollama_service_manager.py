@@ -7,11 +7,21 @@ Ollama服务管理节点 - 一键启动/停止Ollama服务
 
 import subprocess
 import time
+import json
+import asyncio
+import threading
 import psutil
 import requests
 import os
+import sys
 import platform
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
 
 try:
     from server import PromptServer
@@ -20,8 +30,22 @@ try:
 except ImportError:
     WEB_AVAILABLE = False
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ollama_model_catalog import model_catalog
+from ollama_endpoint_pool import endpoint_pool
+from http_client import http_client
+from ollama_streaming import reasoning_stats
+
 CATEGORY_TYPE = "🎨 Super Canvas"
 
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+# 调度器配置文件位置
+SCHEDULER_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "user_data", "ollama_scheduler.json"
+)
+
 class OllamaServiceManager:
     """
     🦙 Ollama Service Manager
@@ -33,6 +57,14 @@ class OllamaServiceManager:
     _ollama_process = None
     _service_status = "stopped"  # stopped, starting, running, stopping
     
+    # 类级别的aiohttp连接池（绑定到创建它的事件循环）
+    _http_session = None
+    _http_session_loop = None
+    # 从事件循环线程发起的后台卸载任务（保持引用，避免任务被回收）
+    _unload_tasks: set = set()
+    # 卸载后等待/api/ps中模型消失的最长时间（秒）
+    UNLOAD_SETTLE_TIMEOUT = 5.0
+    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -70,9 +102,8 @@ class OllamaServiceManager:
     def check_ollama_status(cls) -> str:
         """检查Ollama服务状态"""
         try:
-            # 方法1: 检查端口11434是否开放
-            response = requests.get("http://localhost:11434/api/tags", timeout=2)
-            if response.status_code == 200:
+            # 方法1: 检查端口11434是否开放（复用共享模型目录的/api/tags结果）
+            if model_catalog.is_reachable(OLLAMA_BASE_URL, max_age=2.0):
                 cls._service_status = "running"
                 return "运行中"
         except:
@@ -187,8 +218,234 @@ class OllamaServiceManager:
             return {"success": False, "message": f"停止失败: {str(e)}"}
     
     @classmethod
-    def unload_ollama_models(cls) -> Dict[str, Any]:
-        """释放Ollama模型内存"""
+    async def _get_http_session(cls):
+        """获取复用的aiohttp会话，事件循环变化时重新创建"""
+        loop = asyncio.get_running_loop()
+        if cls._http_session is None or cls._http_session.closed or cls._http_session_loop is not loop:
+            await cls._close_stale_session(loop)
+            connector = aiohttp.TCPConnector(limit=32, limit_per_host=16, keepalive_timeout=60)
+            cls._http_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=10, connect=3)
+            )
+            cls._http_session_loop = loop
+        return cls._http_session
+    
+    @classmethod
+    async def _close_stale_session(cls, loop):
+        """关闭绑定在其他事件循环上的旧会话，而不是直接丢弃（否则其连接不会被释放）"""
+        session, session_loop = cls._http_session, cls._http_session_loop
+        cls._http_session = None
+        cls._http_session_loop = None
+        if session is None or session.closed or session_loop is loop:
+            return
+        try:
+            if session_loop is not None and session_loop.is_running():
+                # 旧循环仍在运行：在它自己的线程上关闭
+                asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+            else:
+                await session.close()
+        except Exception:
+            pass
+    
+    @classmethod
+    async def _wait_until_unloaded(cls, session, names: List[str], base_url: str,
+                                   before: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        轮询/api/ps直到卸载的模型消失（Ollama收到keep_alive=0后异步释放内存）
+        超时后返回最后一次的结果
+        """
+        after = before
+        deadline = time.perf_counter() + cls.UNLOAD_SETTLE_TIMEOUT
+        while True:
+            loaded = await cls._fetch_loaded_models(session, base_url)
+            if loaded is not None:
+                after = loaded
+                if not {m.get('name') for m in loaded} & set(names):
+                    return after
+            if time.perf_counter() >= deadline:
+                return after
+            await asyncio.sleep(0.2)
+    
+    @classmethod
+    async def _fetch_loaded_models(cls, session, base_url: str = OLLAMA_BASE_URL) -> Optional[List[Dict[str, Any]]]:
+        """通过/api/ps获取当前驻留的模型，失败时返回None"""
+        try:
+            async with session.get(f"{base_url}/api/ps", timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status != 200:
+                    return None
+                data = await response.json(content_type=None)
+                return data.get('models') or []
+        except Exception:
+            return None
+    
+    @classmethod
+    async def _unload_single_model(cls, session, model_name: str, base_url: str = OLLAMA_BASE_URL) -> Dict[str, Any]:
+        """使用keep_alive=0卸载单个模型，并记录耗时"""
+        start = time.perf_counter()
+        try:
+            async with session.post(
+                f"{base_url}/api/generate",
+                json={"model": model_name, "prompt": "", "keep_alive": 0}
+            ) as response:
+                await response.read()
+                success = response.status in [200, 404]
+                error = None if success else f"HTTP {response.status}"
+        except Exception as e:
+            success = False
+            error = str(e)
+        
+        return {
+            "name": model_name,
+            "success": success,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "error": error,
+        }
+    
+    @staticmethod
+    def _format_bytes(size: int) -> str:
+        """格式化字节数"""
+        if size >= 1024 ** 3:
+            return f"{size / 1024 ** 3:.2f}GB"
+        return f"{size / 1024 ** 2:.0f}MB"
+    
+    @classmethod
+    async def unload_ollama_models_async(cls, min_size_gb: float = 0.0,
+                                         base_url: str = OLLAMA_BASE_URL) -> Dict[str, Any]:
+        """
+        并发释放Ollama模型内存
+        
+        :param min_size_gb: 选择性卸载阈值，仅卸载占用大于该值(GB)的模型，0表示全部卸载
+        :return: 包含每个模型卸载耗时和/api/ps差值计算的释放内存的结果
+        """
+        if not AIOHTTP_AVAILABLE:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, cls._unload_ollama_models_sequential, min_size_gb
+            )
+        
+        try:
+            loop = asyncio.get_running_loop()
+            is_local = base_url == OLLAMA_BASE_URL
+            if is_local:
+                status = await loop.run_in_executor(None, cls.check_ollama_status)
+                if status != "运行中":
+                    return {"success": False, "message": "Ollama服务未运行"}
+            
+            session = await cls._get_http_session()
+            before = await cls._fetch_loaded_models(session, base_url)
+            if before is None:
+                if not is_local:
+                    return {"success": False, "message": f"无法获取 {base_url} 的模型列表"}
+                # /api/ps不可用时使用通用卸载或重启服务
+                return await loop.run_in_executor(None, cls._unload_ollama_models_fallback)
+            
+            if not before:
+                return {"success": True, "message": "当前没有加载的模型", "models": []}
+            
+            threshold = int(max(min_size_gb, 0.0) * 1024 ** 3)
+            targets = [m for m in before if m.get('name') and m.get('size', 0) >= threshold]
+            skipped = [m['name'] for m in before if m.get('name') and m not in targets]
+            if not targets:
+                return {
+                    "success": True,
+                    "message": f"没有超过{min_size_gb}GB的模型需要卸载",
+                    "models": [],
+                    "skipped": skipped,
+                }
+            
+            start = time.perf_counter()
+            results = await asyncio.gather(*[
+                cls._unload_single_model(session, m['name'], base_url) for m in targets
+            ])
+            total_ms = round((time.perf_counter() - start) * 1000, 1)
+            
+            # 等模型从/api/ps中消失后，通过前后差值计算实际释放的内存
+            after = await cls._wait_until_unloaded(
+                session, [r["name"] for r in results if r["success"]], base_url, before
+            )
+            after_by_name = {m.get('name'): m for m in after}
+            for result, model in zip(results, targets):
+                remaining = after_by_name.get(model['name'], {})
+                result["freed_bytes"] = max(model.get('size', 0) - remaining.get('size', 0), 0)
+                result["freed_vram_bytes"] = max(model.get('size_vram', 0) - remaining.get('size_vram', 0), 0)
+            
+            freed_bytes = sum(r["freed_bytes"] for r in results)
+            freed_vram_bytes = sum(r["freed_vram_bytes"] for r in results)
+            unloaded = [r for r in results if r["success"]]
+            
+            details = ", ".join(
+                f"{r['name']} ({r['latency_ms']:.0f}ms, 释放{cls._format_bytes(r['freed_bytes'])})"
+                for r in unloaded
+            )
+            return {
+                "success": bool(unloaded),
+                "message": f"已卸载模型: {details}" if unloaded else "模型卸载失败",
+                "models": results,
+                "skipped": skipped,
+                "freed_bytes": freed_bytes,
+                "freed_vram_bytes": freed_vram_bytes,
+                "total_latency_ms": total_ms,
+            }
+            
+        except Exception as e:
+            return {"success": False, "message": f"释放模型失败: {str(e)}"}
+    
+    @classmethod
+    async def unload_all_endpoints_async(cls, min_size_gb: float = 0.0) -> Dict[str, Any]:
+        """并发释放端点池中所有Ollama主机的模型内存"""
+        remote_urls = [url for url in endpoint_pool.urls()
+                       if url.replace("127.0.0.1", "localhost") != OLLAMA_BASE_URL]
+        if not remote_urls:
+            return await cls.unload_ollama_models_async(min_size_gb)
+        
+        base_urls = [OLLAMA_BASE_URL] + remote_urls
+        results = await asyncio.gather(*[
+            cls.unload_ollama_models_async(min_size_gb, base_url) for base_url in base_urls
+        ])
+        return {
+            "success": any(r.get("success") for r in results),
+            "message": "; ".join(f"{url}: {r.get('message', '')}" for url, r in zip(base_urls, results)),
+            "endpoints": dict(zip(base_urls, results)),
+            "freed_bytes": sum(r.get("freed_bytes", 0) for r in results),
+            "freed_vram_bytes": sum(r.get("freed_vram_bytes", 0) for r in results),
+        }
+    
+    @classmethod
+    def unload_ollama_models(cls, min_size_gb: float = 0.0) -> Dict[str, Any]:
+        """
+        释放Ollama模型内存（同步入口）
+        在事件循环线程中调用时不阻塞该线程：卸载作为任务在当前循环中后台执行，立即返回
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        
+        if running_loop is not None:
+            task = running_loop.create_task(cls.unload_ollama_models_async(min_size_gb))
+            cls._unload_tasks.add(task)
+            task.add_done_callback(cls._unload_tasks.discard)
+            return {"success": True, "scheduled": True, "message": "已在后台开始释放模型内存"}
+        
+        # aiohttp不可用时退回顺序卸载（不在事件循环线程中，阻塞无妨）
+        if not AIOHTTP_AVAILABLE:
+            return cls._unload_ollama_models_sequential(min_size_gb)
+        
+        async def run_once():
+            try:
+                return await cls.unload_ollama_models_async(min_size_gb)
+            finally:
+                # 临时事件循环结束前关闭其会话，避免遗留未关闭的连接
+                if cls._http_session is not None and cls._http_session_loop is asyncio.get_running_loop():
+                    await cls._http_session.close()
+                    cls._http_session = None
+                    cls._http_session_loop = None
+        
+        return asyncio.run(run_once())
+    
+    @classmethod
+    def _unload_ollama_models_sequential(cls, min_size_gb: float = 0.0) -> Dict[str, Any]:
+        """顺序卸载（aiohttp不可用时使用）"""
         try:
             # 检查服务是否运行
             if cls.check_ollama_status() != "运行中":
@@ -197,17 +454,18 @@ class OllamaServiceManager:
             # 方法1: 获取当前加载的模型列表并逐一卸载
             try:
                 # 获取当前运行的模型
-                ps_response = requests.get("http://localhost:11434/api/ps", timeout=5)
+                ps_response = http_client.get(f"{OLLAMA_BASE_URL}/api/ps", timeout=5)
                 if ps_response.status_code == 200:
                     models_data = ps_response.json()
                     if 'models' in models_data and models_data['models']:
+                        threshold = int(max(min_size_gb, 0.0) * 1024 ** 3)
                         unloaded_models = []
                         for model in models_data['models']:
                             model_name = model.get('name', '')
-                            if model_name:
+                            if model_name and model.get('size', 0) >= threshold:
                                 # 使用keep_alive=0卸载特定模型
-                                unload_response = requests.post(
-                                    "http://localhost:11434/api/generate",
+                                unload_response = http_client.post(
+                                    f"{OLLAMA_BASE_URL}/api/generate",
                                     json={
                                         "model": model_name,
                                         "prompt": "",
@@ -220,15 +478,25 @@ class OllamaServiceManager:
                         
                         if unloaded_models:
                             return {"success": True, "message": f"已卸载模型: {', '.join(unloaded_models)}"}
+                        return {"success": True, "message": f"没有超过{min_size_gb}GB的模型需要卸载"}
                     else:
                         return {"success": True, "message": "当前没有加载的模型"}
             except Exception as api_error:
                 pass
             
+            return cls._unload_ollama_models_fallback()
+                
+        except Exception as e:
+            return {"success": False, "message": f"释放模型失败: {str(e)}"}
+    
+    @classmethod
+    def _unload_ollama_models_fallback(cls) -> Dict[str, Any]:
+        """无法逐个卸载时的兜底方案：通用卸载API，最后重启服务"""
+        try:
             # 方法2: 通用卸载API
             try:
-                response = requests.post(
-                    "http://localhost:11434/api/generate",
+                response = http_client.post(
+                    f"{OLLAMA_BASE_URL}/api/generate",
                     json={"model": "", "keep_alive": 0},
                     timeout=10
                 )
@@ -253,6 +521,226 @@ class OllamaServiceManager:
         except Exception as e:
             return {"success": False, "message": f"释放模型失败: {str(e)}"}
 
+class OllamaKeepAliveScheduler:
+    """
+    Ollama模型预热与keep_alive调度器
+    
+    - 启动时或加载工作流时预加载配置的模型
+    - 为每个模型单独设置keep_alive，提示词生成保持在热路径
+    - 空闲超时或显存紧张时主动卸载，为图像模型让出显存
+    只管理config["models"]中配置的模型；其他模型的请求不带keep_alive，沿用Ollama自身的设置
+    （如OLLAMA_KEEP_ALIVE），也不会被空闲卸载
+    """
+    
+    DEFAULT_CONFIG = {
+        "enabled": True,
+        "preload_on_startup": False,
+        "base_url": OLLAMA_BASE_URL,
+        # 模型名 -> {"keep_alive": "30m", "idle_timeout": 900}
+        "models": {},
+        # 配置的模型未单独设置时使用的值；None表示不设置keep_alive
+        "default_keep_alive": None,
+        "default_idle_timeout": 0,    # 秒，0表示不按空闲卸载
+        "vram_min_free_gb": 0.0,      # 显存空闲低于该值(GB)时卸载，0表示关闭
+        "check_interval": 15,         # 后台检查间隔（秒）
+    }
+    
+    def __init__(self, config_path: str = SCHEDULER_CONFIG_PATH):
+        self.config_path = config_path
+        self.config = self._load_config()
+        self._lock = threading.Lock()
+        self._last_used: Dict[tuple, float] = {}  # (base_url, model) -> 最近使用时间
+        self._monitor_thread = None
+        self._stop_event = threading.Event()
+    
+    def _load_config(self) -> Dict[str, Any]:
+        """加载调度配置"""
+        config = json.loads(json.dumps(self.DEFAULT_CONFIG))
+        try:
+            if os.path.exists(self.config_path):
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    config.update(json.load(f))
+        except Exception as e:
+            pass
+        return config
+    
+    def update_config(self, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """更新并保存调度配置"""
+        with self._lock:
+            for key, value in updates.items():
+                if key in self.DEFAULT_CONFIG:
+                    self.config[key] = value
+            try:
+                os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
+                with open(self.config_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.config, f, ensure_ascii=False, indent=4)
+            except Exception as e:
+                pass
+        if self.config.get("models"):
+            self._ensure_monitor()
+        return dict(self.config)
+    
+    def is_managed(self, model: str) -> bool:
+        """模型是否在config["models"]中配置"""
+        return model in (self.config.get("models") or {})
+    
+    def _model_setting(self, model: str, key: str):
+        """配置的模型的设置（未单独设置时使用default_<key>），未配置的模型返回None"""
+        if not self.is_managed(model):
+            return None
+        model_config = self.config["models"].get(model) or {}
+        return model_config.get(key, self.config.get(f"default_{key}"))
+    
+    def get_keep_alive(self, model: str):
+        """
+        获取模型的keep_alive设置，用于请求负载中的keep_alive字段
+        调度器关闭（"enabled": false）或模型未配置时返回None，请求不带keep_alive，沿用Ollama自身的设置
+        """
+        if not self.config.get("enabled", True):
+            return None
+        return self._model_setting(model, "keep_alive")
+    
+    def touch(self, model: str, base_url: Optional[str] = None):
+        """
+        记录模型的一次使用，并返回该模型应使用的keep_alive（调度器关闭或模型未配置时为None）
+        提示词生成节点在每次调用Ollama前调用；未配置的模型不记录，不参与空闲卸载
+        """
+        if not self.is_managed(model):
+            return None
+        base_url = (base_url or self.config.get("base_url") or OLLAMA_BASE_URL).rstrip('/')
+        with self._lock:
+            self._last_used[(base_url, model)] = time.time()
+        if self.config.get("enabled", True):
+            self._ensure_monitor()
+        return self.get_keep_alive(model)
+    
+    def preload(self, models: Optional[List[str]] = None, base_url: Optional[str] = None) -> List[Dict[str, Any]]:
+        """预加载模型（空prompt的generate请求只加载模型，不生成内容）"""
+        base_url = (base_url or self.config.get("base_url") or OLLAMA_BASE_URL).rstrip('/')
+        models = models if models is not None else list(self.config.get("models", {}).keys())
+        results = []
+        
+        def load(model):
+            start = time.perf_counter()
+            try:
+                # 预加载是显式操作，调度器关闭时也使用配置的keep_alive
+                payload = {"model": model, "prompt": ""}
+                keep_alive = self._model_setting(model, "keep_alive")
+                if keep_alive is not None:
+                    payload["keep_alive"] = keep_alive
+                response = http_client.post(f"{base_url}/api/generate", json=payload, timeout=120)
+                success = response.status_code == 200
+            except Exception as e:
+                success = False
+            if success:
+                with self._lock:
+                    self._last_used[(base_url, model)] = time.time()
+            results.append({
+                "name": model,
+                "success": success,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            })
+        
+        threads = [threading.Thread(target=load, args=(model,), daemon=True) for model in models]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        if results:
+            self._ensure_monitor()
+        return results
+    
+    def preload_in_background(self, models: Optional[List[str]] = None, base_url: Optional[str] = None):
+        """在后台线程中预加载，不阻塞调用方"""
+        thread = threading.Thread(target=self.preload, args=(models, base_url), daemon=True)
+        thread.start()
+        return thread
+    
+    def _unload(self, base_url: str, model: str) -> bool:
+        try:
+            response = http_client.post(
+                f"{base_url}/api/generate",
+                json={"model": model, "prompt": "", "keep_alive": 0},
+                timeout=10
+            )
+            return response.status_code in [200, 404]
+        except Exception as e:
+            return False
+    
+    def release_for_image_models(self) -> List[str]:
+        """立即卸载所有已调度的模型，为图像模型让出显存"""
+        with self._lock:
+            tracked = list(self._last_used.keys())
+            self._last_used.clear()
+        return [model for base_url, model in tracked if self._unload(base_url, model)]
+    
+    @staticmethod
+    def _vram_free_gb() -> Optional[float]:
+        """获取当前GPU空闲显存(GB)，无法检测时返回None"""
+        try:
+            import torch
+            if torch.cuda.is_available():
+                free, total = torch.cuda.mem_get_info()
+                return free / 1024 ** 3
+        except Exception as e:
+            pass
+        return None
+    
+    def _ensure_monitor(self):
+        """按需启动后台空闲/显存检查线程"""
+        if self._monitor_thread is not None and self._monitor_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor_thread.start()
+    
+    def _monitor_loop(self):
+        while not self._stop_event.wait(max(float(self.config.get("check_interval", 15)), 1.0)):
+            try:
+                self.check_once()
+            except Exception as e:
+                pass
+    
+    def check_once(self) -> List[str]:
+        """执行一次空闲超时和显存压力检查，返回被卸载的模型"""
+        now = time.time()
+        expired = []
+        with self._lock:
+            for (base_url, model), last_used in list(self._last_used.items()):
+                idle_timeout = float(self._model_setting(model, "idle_timeout") or 0)
+                if idle_timeout > 0 and now - last_used >= idle_timeout:
+                    expired.append((base_url, model))
+                    del self._last_used[(base_url, model)]
+        
+        unloaded = [model for base_url, model in expired if self._unload(base_url, model)]
+        
+        min_free_gb = float(self.config.get("vram_min_free_gb") or 0)
+        if min_free_gb > 0:
+            free_gb = self._vram_free_gb()
+            if free_gb is not None and free_gb < min_free_gb:
+                unloaded.extend(self.release_for_image_models())
+        
+        return unloaded
+    
+    def status(self) -> Dict[str, Any]:
+        """返回调度器状态"""
+        now = time.time()
+        with self._lock:
+            models = [
+                {"name": model, "base_url": base_url, "idle_seconds": round(now - last_used, 1),
+                 "keep_alive": self.get_keep_alive(model)}
+                for (base_url, model), last_used in self._last_used.items()
+            ]
+        return {"config": dict(self.config), "models": models, "vram_free_gb": self._vram_free_gb()}
+
+
+# 全局调度器实例
+keep_alive_scheduler = OllamaKeepAliveScheduler()
+
+if WEB_AVAILABLE and keep_alive_scheduler.config.get("preload_on_startup"):
+    keep_alive_scheduler.preload_in_background()
+
 # Web API接口
 if WEB_AVAILABLE:
     @PromptServer.instance.routes.post("/ollama_service_control")
@@ -278,10 +766,38 @@ if WEB_AVAILABLE:
                 result = OllamaServiceManager.stop_ollama_service()
                 return web.json_response(result)
             
+            elif action == "preload":
+                # 工作流加载时由前端触发，预加载配置的模型
+                models = data.get('models')
+                keep_alive_scheduler.preload_in_background(models, data.get('url'))
+                return web.json_response({"success": True, "message": "模型预加载已开始"})
+            
+            elif action == "schedule":
+                # 获取或更新keep_alive调度配置
+                if isinstance(data.get('config'), dict):
+                    keep_alive_scheduler.update_config(data['config'])
+                return web.json_response({"success": True, **keep_alive_scheduler.status()})
+            
+            elif action == "release":
+                # 立即卸载调度器管理的模型
+                loop = asyncio.get_running_loop()
+                released = await loop.run_in_executor(None, keep_alive_scheduler.release_for_image_models)
+                return web.json_response({"success": True, "message": f"已释放: {', '.join(released) or '无'}"})
+            
             elif action == "unload":
-                result = OllamaServiceManager.unload_ollama_models()
+                # min_size_gb > 0 时仅卸载超过该大小的模型
+                min_size_gb = float(data.get('min_size_gb', 0) or 0)
+                result = await OllamaServiceManager.unload_all_endpoints_async(min_size_gb=min_size_gb)
                 return web.json_response(result)
             
+            elif action == "pool":
+                # 多端点连接池状态
+                return web.json_response({"success": True, "endpoints": endpoint_pool.stats()})
+            
+            elif action == "reasoning_stats":
+                # 推理模型关闭思考/截断节省的token与时间
+                return web.json_response({"success": True, "models": reasoning_stats.snapshot()})
+            
             else:
                 return web.json_response({
                     "success": False,
@@ -301,31 +817,10 @@ if WEB_AVAILABLE:
             data = await request.json()
             url = data.get('url', 'http://127.0.0.1:11434')
             
-            # 检查服务状态
-            if OllamaServiceManager.check_ollama_status() != "运行中":
-                return web.json_response([])
-            
-            # 获取模型列表
-            try:
-                # 使用提供的URL或默认URL
-                api_url = f"{url}/api/tags"
-                response = requests.get(api_url, timeout=5)
-                
-                if response.status_code == 200:
-                    models_data = response.json()
-                    # 提取模型名称
-                    model_names = []
-                    if 'models' in models_data:
-                        for model in models_data['models']:
-                            if 'name' in model:
-                                model_names.append(model['name'])
-                    
-                    return web.json_response(model_names)
-                else:
-                    return web.json_response([])
-                    
-            except Exception as api_error:
-                return web.json_response([])
+            # 从共享模型目录获取：缓存有效时立即返回，过期时合并到同一次刷新请求
+            loop = asyncio.get_running_loop()
+            model_names = await loop.run_in_executor(None, lambda: model_catalog.get_models(url, block=True))
+            return web.json_response(model_names or [])
                 
         except Exception as e:
             return web.json_response([], status=500)
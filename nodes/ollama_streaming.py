@@ -0,0 +1,236 @@
+"""
+Ollama Streaming
+Ollama流式生成 - 供各Ollama节点共享
+
+功能：
+- 逐块解析/api/generate返回的NDJSON
+- 通过PromptServer websocket事件推送部分文本，前端可实时显示
+- 检测到完整的指令句后主动断开连接，Ollama随即停止生成
+- 推理模型（deepseek-r1、qwen3等）：服务端支持时直接关闭思考，否则流式截断</think>之后的第一句指令，
+  并统计截断节省的token与时间（以同一模型未截断时的平均生成长度为基线）
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from server import PromptServer
+    WEB_AVAILABLE = True
+except ImportError:
+    WEB_AVAILABLE = False
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ollama_endpoint_pool import endpoint_pool
+from ollama_model_catalog import model_catalog
+
+# websocket事件名称，数据格式: {"node_id", "text", "done", "stopped_early"}
+STREAM_EVENT = "ollama_stream_progress"
+
+THINK_BLOCK_PATTERN = re.compile(r'<think>.*?</think>', re.S)
+# 以大写字母开头、以句末标点结束且后面已有空白的句子（排除3.5这类小数）
+SENTENCE_PATTERN = re.compile(r'[A-Z][^.!?\n]*[.!?](?=\s)')
+
+
+def visible_text(text: str) -> str:
+    """去掉已闭合的<think>块；思考尚未结束时返回空字符串"""
+    text = THINK_BLOCK_PATTERN.sub('', text)
+    if '<think>' in text:
+        return ''
+    return text
+
+
+def first_complete_instruction(text: str, min_words: int = 6) -> Optional[str]:
+    """
+    返回思考块之后的第一段完整指令（累计单词数达到min_words的句子为止）
+    尚未出现完整指令时返回None
+    """
+    visible = visible_text(text)
+    if not visible:
+        return None
+    for match in SENTENCE_PATTERN.finditer(visible):
+        candidate = visible[:match.end()].strip()
+        if len(candidate.split()) >= min_words:
+            return candidate
+    return None
+
+
+def instruction_complete(min_words: int = 6) -> Callable[[str], bool]:
+    """生成提前停止判断函数"""
+    return lambda text: first_complete_instruction(text, min_words) is not None
+
+
+class ReasoningStats:
+    """推理模型的节省统计（按模型累计）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, float]] = {}
+    
+    def record(self, model: str, mode: str, eval_count: int, elapsed_ms: float, num_predict: int,
+               stopped_early: bool):
+        """
+        记录一次推理模型生成
+        未截断的流式生成（思考开启并完整结束）作为基线，累计平均生成长度（不超过num_predict）；
+        只有实际被截断的生成才计入节省：基线长度减去本次的token数，时间按本次的平均每token耗时估算。
+        尚无基线时不做估算；关闭思考的请求没有可对比的基线，只计数
+        """
+        ms_per_token = elapsed_ms / eval_count if eval_count else 0.0
+        with self._lock:
+            stats = self._models.setdefault(model, {
+                "requests": 0, "think_disabled": 0, "stream_cut": 0,
+                "tokens_used": 0, "tokens_saved": 0, "time_saved_ms": 0.0,
+                "baseline_requests": 0, "baseline_tokens": 0,
+            })
+            stats["requests"] += 1
+            stats["tokens_used"] += eval_count
+            if mode == "think_disabled":
+                stats["think_disabled"] += 1
+            elif stopped_early:
+                stats["stream_cut"] += 1
+                if stats["baseline_requests"]:
+                    baseline = stats["baseline_tokens"] / stats["baseline_requests"]
+                    tokens_saved = max(round(baseline) - eval_count, 0)
+                    stats["tokens_saved"] += tokens_saved
+                    stats["time_saved_ms"] += tokens_saved * ms_per_token
+            elif eval_count:
+                stats["baseline_requests"] += 1
+                stats["baseline_tokens"] += min(eval_count, num_predict) if num_predict else eval_count
+    
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            snapshot = {}
+            for model, values in self._models.items():
+                values = dict(values)
+                requests = values.pop("baseline_requests")
+                tokens = values.pop("baseline_tokens")
+                values["baseline_tokens"] = round(tokens / requests, 1) if requests else None
+                values["time_saved_ms"] = round(values["time_saved_ms"], 1)
+                snapshot[model] = values
+            return snapshot
+
+
+# 全局实例
+reasoning_stats = ReasoningStats()
+
+
+def apply_reasoning_mode(payload: Dict[str, Any], model: str, base_url: Optional[str] = None) -> Optional[str]:
+    """
+    根据/api/show元数据调整请求
+    :return: "think_disabled"（已设置think=false）、"stream_cut"（需要流式截断）或None（非推理模型）
+    """
+    try:
+        reasoning, supports_think = model_catalog.get_reasoning_support(model, base_url)
+    except Exception as e:
+        return None
+    if not reasoning:
+        return None
+    if supports_think:
+        payload["think"] = False
+        return "think_disabled"
+    return "stream_cut"
+
+
+def record_reasoning_result(model: str, mode: Optional[str], result: Dict[str, Any], num_predict: int):
+    """记录推理模型的token与时间节省（流式与非流式结果均可）"""
+    if not mode:
+        return
+    eval_count = int(result.get("eval_count") or 0)
+    if "elapsed_ms" in result:
+        elapsed_ms = result["elapsed_ms"]
+    else:
+        # 非流式结果中的eval_duration单位为纳秒
+        elapsed_ms = (result.get("eval_duration") or 0) / 1e6
+    reasoning_stats.record(model, mode, eval_count, elapsed_ms, num_predict,
+                           bool(result.get("stopped_early")))
+
+
+def push_progress(node_id: Optional[str], text: str, done: bool = False,
+                  stopped_early: bool = False, event: str = STREAM_EVENT):
+    """向前端推送部分生成文本"""
+    if not WEB_AVAILABLE or not node_id:
+        return
+    try:
+        PromptServer.instance.send_sync(event, {
+            "node_id": node_id,
+            "text": text,
+            "done": done,
+            "stopped_early": stopped_early,
+        })
+    except Exception as e:
+        pass
+
+
+def stream_generate(payload: Dict[str, Any], model: str, base_url: Optional[str] = None,
+                    timeout: float = 60, node_id: Optional[str] = None,
+                    stop_when: Optional[Callable[[str], bool]] = None,
+                    push_interval: float = 0.1, event: str = STREAM_EVENT) -> Tuple[Dict[str, Any], str]:
+    """
+    流式调用/api/generate
+    :param stop_when: 接收当前累计文本，返回True时提前结束生成
+    :return: (结果字典, 实际使用的端点地址)
+             结果包含 response / thinking / stopped_early / first_token_ms / elapsed_ms / eval_count
+    """
+    start = time.perf_counter()
+    payload = {**payload, "stream": True}
+    response, endpoint_url = endpoint_pool.post(
+        "/api/generate", payload, model=model, base_url=base_url, timeout=timeout, stream=True
+    )
+
+    parts = []
+    thinking_parts = []
+    result: Dict[str, Any] = {
+        "stopped_early": False,
+        "first_token_ms": None,
+        "eval_count": 0,
+        "done_reason": None,
+    }
+    last_push = 0.0
+    try:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise Exception(chunk["error"])
+
+            piece = chunk.get("response", "")
+            thinking = chunk.get("thinking", "")
+            if thinking:
+                thinking_parts.append(thinking)
+            if piece:
+                if result["first_token_ms"] is None:
+                    result["first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                parts.append(piece)
+            result["eval_count"] += 1 if (piece or thinking) else 0
+
+            if chunk.get("done"):
+                result["eval_count"] = chunk.get("eval_count", result["eval_count"])
+                result["done_reason"] = chunk.get("done_reason")
+                break
+
+            if not piece:
+                continue
+            text = "".join(parts)
+            now = time.perf_counter()
+            if now - last_push >= push_interval:
+                push_progress(node_id, text, event=event)
+                last_push = now
+            if stop_when is not None and stop_when(text):
+                result["stopped_early"] = True
+                result["done_reason"] = "early_stop"
+                break
+    finally:
+        # 提前关闭连接会让Ollama取消剩余的生成，同时释放端点池中的这次请求
+        response.close()
+
+    result["response"] = "".join(parts)
+    result["thinking"] = "".join(thinking_parts)
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    push_progress(node_id, result["response"], done=True, stopped_early=result["stopped_early"], event=event)
+    return result, endpoint_url
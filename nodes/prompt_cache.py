@@ -0,0 +1,336 @@
+"""
+Prompt Cache
+提示词结果缓存 - 所有生成节点共享的磁盘缓存（SQLite）
+
+功能：
+- 以模型、系统提示词、用户输入、温度和种子的规范化哈希作为键
+- 相同种子重复执行时直接返回结果，不再调用LLM
+- TTL过期与条目数/字节数上限（按最近访问时间淘汰）
+- 服务重启后仍然有效
+- MemoryLRUCache：进程内O(1) LRU缓存（字节数统计、TTL、命中率）
+
+配置（环境变量）：
+- PROMPT_CACHE_DISABLED=1 关闭缓存
+- PROMPT_CACHE_TTL 过期时间（秒，默认7天）
+- PROMPT_CACHE_MAX_ENTRIES 最大条目数（默认5000）
+- PROMPT_CACHE_MAX_MB 最大体积（MB，默认64）
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from server import PromptServer
+    from aiohttp import web
+    WEB_AVAILABLE = True
+except ImportError:
+    WEB_AVAILABLE = False
+
+# 缓存数据库位置
+PROMPT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "user_data", "prompt_cache.sqlite3"
+)
+
+
+def _normalize(value: Any) -> Any:
+    """规范化缓存键中的值：折叠空白、浮点数取4位小数"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, float):
+        return round(value, 4)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if value is None or isinstance(value, (int, bool)):
+        return value
+    return str(value)
+
+
+class PromptCache:
+    """磁盘提示词缓存（线程安全）"""
+
+    def __init__(self, db_path: str = PROMPT_CACHE_PATH, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.db_path = db_path
+        self.enabled = os.getenv("PROMPT_CACHE_DISABLED", "0").lower() not in ("1", "true", "yes")
+        self.ttl = float(ttl if ttl is not None else os.getenv("PROMPT_CACHE_TTL", 7 * 24 * 3600))
+        self.max_entries = int(max_entries if max_entries is not None else os.getenv("PROMPT_CACHE_MAX_ENTRIES", 5000))
+        self.max_bytes = int(max_bytes if max_bytes is not None
+                             else float(os.getenv("PROMPT_CACHE_MAX_MB", 64)) * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _on_error(self, action: str, error: sqlite3.Error):
+        """
+        缓存读写失败（数据库被锁、只读或损坏等）不影响生成：读取视为未命中，写入直接跳过
+        只在第一次失败时输出日志（调用方持有锁）
+        """
+        self.errors += 1
+        if self.errors == 1:
+            print(f"[PromptCache] 缓存{action}失败，本次跳过缓存: {error}")
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """延迟打开数据库（调用方持有锁）"""
+        if self._conn is None:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS prompts (
+                        key TEXT PRIMARY KEY,
+                        namespace TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_prompts_accessed ON prompts(accessed_at)")
+                conn.commit()
+                self._conn = conn
+            except Exception as e:
+                print(f"[PromptCache] 打开缓存数据库失败: {e}")
+                self.enabled = False
+        return self._conn
+
+    @staticmethod
+    def make_key(namespace: str, model: str, system_prompt: Any = "", user_prompt: Any = "",
+                 temperature: Optional[float] = None, seed: Optional[int] = None, **extra) -> str:
+        """
+        生成缓存键
+        节点中包含随机选择的引导词时，应传入随机化之前的输入（描述、意图、风格等）
+        """
+        payload = _normalize({
+            "namespace": namespace,
+            "model": model,
+            "system": system_prompt,
+            "user": user_prompt,
+            "temperature": float(temperature) if temperature is not None else None,
+            "seed": seed,
+            "extra": extra,
+        })
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，过期或不存在时返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            now = time.time()
+            try:
+                row = conn.execute("SELECT value, created_at FROM prompts WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    if row is not None:
+                        conn.execute("DELETE FROM prompts WHERE key = ?", (key,))
+                        conn.commit()
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE prompts SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                conn.commit()
+            except sqlite3.Error as e:
+                self._on_error("读取", e)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str, namespace: str = ""):
+        """写入缓存并按上限淘汰"""
+        if not self.enabled or not value:
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            now = time.time()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO prompts (key, namespace, value, size, created_at, accessed_at, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (key, namespace, value, size, now, now)
+                )
+                self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                self._on_error("写入", e)
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    pass
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """删除过期条目，超出条目数或字节上限时按最近访问时间淘汰（失败时跳过，下次写入再淘汰）"""
+        try:
+            self._evict_rows(conn, now)
+        except sqlite3.Error as e:
+            self._on_error("淘汰", e)
+
+    def _evict_rows(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM prompts WHERE created_at < ?", (now - self.ttl,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prompts").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        excess_bytes = total - self.max_bytes
+        excess_count = count - self.max_entries
+        removed_keys = []
+        for key, size in conn.execute("SELECT key, size FROM prompts ORDER BY accessed_at ASC"):
+            if excess_count <= 0 and excess_bytes <= 0:
+                break
+            removed_keys.append((key,))
+            excess_count -= 1
+            excess_bytes -= size
+        conn.executemany("DELETE FROM prompts WHERE key = ?", removed_keys)
+
+    def clear(self, namespace: Optional[str] = None):
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            if namespace is None:
+                conn.execute("DELETE FROM prompts")
+            else:
+                conn.execute("DELETE FROM prompts WHERE namespace = ?", (namespace,))
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            entries, total = (0, 0)
+            if conn is not None:
+                try:
+                    entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prompts").fetchone()
+                except sqlite3.Error as e:
+                    self._on_error("统计", e)
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "bytes": total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+            }
+
+
+class MemoryLRUCache:
+    """进程内LRU缓存：O(1)读写，按条目数和字节数限制，支持TTL（线程安全）"""
+
+    def __init__(self, max_entries: int = 50, max_bytes: int = 4 * 1024 * 1024, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        if isinstance(value, (list, tuple)):
+            return sum(MemoryLRUCache._sizeof(v) for v in value)
+        return len(repr(value))
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = item
+            if time.time() >= expires_at:
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        # 键（通常是64字节的哈希）同样常驻内存，计入字节数
+        size = self._sizeof(key) + self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._data[key] = (value, size, time.time() + self.ttl)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# 全局实例
+prompt_cache = PromptCache()
+
+
+if WEB_AVAILABLE:
+    @PromptServer.instance.routes.get("/prompt_cache/stats")
+    async def get_prompt_cache_stats(request):
+        """提示词缓存统计"""
+        try:
+            return web.json_response({"success": True, **prompt_cache.stats()})
+        except Exception as e:
+            return web.json_response({"success": False, "message": str(e)}, status=500)
+    
+    @PromptServer.instance.routes.post("/prompt_cache/clear")
+    async def clear_prompt_cache(request):
+        """清空提示词缓存（可指定namespace）"""
+        try:
+            data = await request.json() if request.can_read_body else {}
+            prompt_cache.clear(data.get("namespace"))
+            return web.json_response({"success": True, **prompt_cache.stats()})
+        except Exception as e:
+            return web.json_response({"success": False, "message": str(e)}, status=500)
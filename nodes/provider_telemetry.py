@@ -0,0 +1,340 @@
+"""
+Provider Telemetry
+云端API提供商遥测 - 按提供商与模型统计延迟、吞吐与错误率，并为"auto"提供商选择路由
+
+功能：
+- 延迟直方图（固定桶，毫秒）、平均/最大延迟、指数滑动平均延迟
+- tokens/s（completion_tokens / 请求耗时）
+- 累计错误率与最近N次请求的错误率
+- 健康判断（熔断）：连续失败达到阈值或最近错误率过高时断开；冷却后半开，放行一个试探请求，成功则恢复
+- 定期保存到user_data，服务重启后保留
+
+配置（环境变量）：
+- PROVIDER_TELEMETRY_DISABLED=1 不保存到磁盘（仍在内存中统计）
+
+自检（熔断与恢复）：
+    python nodes/provider_telemetry.py
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+# 遥测数据保存位置
+TELEMETRY_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "user_data", "provider_telemetry.json"
+)
+
+# 直方图桶上界（毫秒），最后一个桶为溢出桶
+LATENCY_BUCKETS_MS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+RECENT_WINDOW = 20
+EWMA_ALPHA = 0.2
+# 健康判断
+FAILURE_THRESHOLD = 3
+FAILURE_COOLDOWN = 60.0
+MAX_RECENT_ERROR_RATE = 0.5
+SAVE_INTERVAL = 30.0
+
+
+def _new_stats() -> Dict[str, Any]:
+    return {
+        "requests": 0,
+        "errors": 0,
+        "latency_histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        "latency_total_ms": 0.0,
+        "latency_max_ms": 0.0,
+        "ewma_latency_ms": None,
+        "completion_tokens": 0,
+        "generation_seconds": 0.0,
+        "recent": [],
+        "consecutive_failures": 0,
+        "last_error": None,
+        "last_failure_at": None,
+        "last_success_at": None,
+    }
+
+
+def _bucket_index(latency_ms: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+def histogram_percentile(stats: Dict[str, Any], quantile: float) -> Optional[float]:
+    """由直方图估计分位数（返回所在桶的上界，溢出桶返回最大值）"""
+    histogram = stats["latency_histogram"]
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if count and seen >= rank:
+            if index < len(LATENCY_BUCKETS_MS):
+                return float(min(LATENCY_BUCKETS_MS[index], stats["latency_max_ms"]))
+            return stats["latency_max_ms"]
+    return stats["latency_max_ms"]
+
+
+HEALTHY = "healthy"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _failing(stats: Dict[str, Any]) -> bool:
+    recent = stats["recent"]
+    return (stats["consecutive_failures"] >= FAILURE_THRESHOLD
+            or bool(recent) and sum(recent) / len(recent) > MAX_RECENT_ERROR_RATE)
+
+
+def health_state(stats: Optional[Dict[str, Any]], now: Optional[float] = None) -> str:
+    """
+    healthy：正常路由
+    open：失败过多且距上次失败不足冷却时间，不路由
+    half_open：冷却已过，允许一个试探请求（成功后清空最近窗口并恢复）
+    """
+    if not stats or not _failing(stats):
+        return HEALTHY
+    now = time.time() if now is None else now
+    if stats["last_failure_at"] and now - stats["last_failure_at"] < FAILURE_COOLDOWN:
+        return OPEN
+    return HALF_OPEN
+
+
+def is_healthy(stats: Optional[Dict[str, Any]], now: Optional[float] = None) -> bool:
+    """可以接收请求（健康或半开）"""
+    return health_state(stats, now) != OPEN
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+def summarize(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """接口输出：原始计数加上派生指标"""
+    successes = stats["requests"] - stats["errors"]
+    recent = stats["recent"]
+    return {
+        "requests": stats["requests"],
+        "errors": stats["errors"],
+        "error_rate": round(stats["errors"] / stats["requests"], 3) if stats["requests"] else 0.0,
+        "recent_error_rate": round(sum(recent) / len(recent), 3) if recent else 0.0,
+        "avg_latency_ms": round(stats["latency_total_ms"] / successes, 1) if successes else None,
+        "ewma_latency_ms": _round(stats["ewma_latency_ms"]),
+        "p50_ms": _round(histogram_percentile(stats, 0.5)),
+        "p95_ms": _round(histogram_percentile(stats, 0.95)),
+        "max_latency_ms": round(stats["latency_max_ms"], 1),
+        "tokens_per_second": round(stats["completion_tokens"] / stats["generation_seconds"], 2)
+        if stats["generation_seconds"] else None,
+        "latency_histogram": dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS] + ["overflow"],
+                                      stats["latency_histogram"])),
+        "healthy": is_healthy(stats),
+        "state": health_state(stats),
+        "last_error": stats["last_error"],
+        "last_success_at": stats["last_success_at"],
+    }
+
+
+class ProviderTelemetry:
+    """按提供商与"提供商/模型"统计请求结果（线程安全）"""
+
+    def __init__(self, path: str = TELEMETRY_PATH, persist: Optional[bool] = None):
+        self.path = path
+        if persist is None:
+            persist = os.getenv("PROVIDER_TELEMETRY_DISABLED", "0").lower() not in ("1", "true", "yes")
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._providers: Dict[str, Dict[str, Any]] = {}
+        self._models: Dict[str, Dict[str, Any]] = {}
+        # 半开状态下正在进行的试探请求（提供商 -> 开始时间，不保存）
+        self._probes: Dict[str, float] = {}
+        self._dirty = False
+        self._last_save = time.time()
+        self._load()
+
+    def _load(self):
+        if not self.persist:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        # 只接受与当前直方图桶一致的记录
+        for target, section in ((self._providers, "providers"), (self._models, "models")):
+            for key, stats in (data.get(section) or {}).items():
+                if len(stats.get("latency_histogram", ())) == len(LATENCY_BUCKETS_MS) + 1:
+                    target[key] = {**_new_stats(), **stats}
+
+    def _update(self, stats: Dict[str, Any], latency_ms: float, ok: bool,
+                completion_tokens: int, error: Optional[str], now: float):
+        stats["requests"] += 1
+        stats["recent"] = (stats["recent"] + [0 if ok else 1])[-RECENT_WINDOW:]
+        if ok:
+            stats["latency_histogram"][_bucket_index(latency_ms)] += 1
+            stats["latency_total_ms"] += latency_ms
+            stats["latency_max_ms"] = max(stats["latency_max_ms"], latency_ms)
+            ewma = stats["ewma_latency_ms"]
+            stats["ewma_latency_ms"] = latency_ms if ewma is None else ewma + EWMA_ALPHA * (latency_ms - ewma)
+            if completion_tokens:
+                stats["completion_tokens"] += completion_tokens
+                stats["generation_seconds"] += latency_ms / 1000
+            if _failing(stats):
+                # 试探请求成功：丢弃断开前的失败记录
+                stats["recent"] = [0]
+            stats["consecutive_failures"] = 0
+            stats["last_success_at"] = now
+        else:
+            stats["errors"] += 1
+            stats["consecutive_failures"] += 1
+            stats["last_error"] = error
+            stats["last_failure_at"] = now
+
+    def record(self, provider: str, model: Optional[str], latency_s: float, ok: bool,
+               completion_tokens: int = 0, error: Optional[str] = None):
+        """记录一次请求结果（失败请求不计入延迟直方图）"""
+        now = time.time()
+        latency_ms = latency_s * 1000
+        with self._lock:
+            self._update(self._providers.setdefault(provider, _new_stats()),
+                         latency_ms, ok, completion_tokens, error, now)
+            self._update(self._models.setdefault(f"{provider}/{model or '-'}", _new_stats()),
+                         latency_ms, ok, completion_tokens, error, now)
+            self._probes.pop(provider, None)
+            self._dirty = True
+            due = now - self._last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def _available_locked(self, provider: str, now: float) -> bool:
+        """健康，或半开且没有进行中的试探请求"""
+        state = health_state(self._providers.get(provider), now)
+        if state == HALF_OPEN:
+            started = self._probes.get(provider)
+            return started is None or now - started >= FAILURE_COOLDOWN
+        return state == HEALTHY
+
+    def is_healthy(self, provider: str) -> bool:
+        with self._lock:
+            return self._available_locked(provider, time.time())
+
+    def claim(self, provider: str) -> bool:
+        """
+        准备向提供商发送请求：健康时直接放行；半开时只放行一个试探请求
+        :return: False表示提供商处于断开状态或已有试探请求
+        """
+        now = time.time()
+        with self._lock:
+            if not self._available_locked(provider, now):
+                return False
+            if health_state(self._providers.get(provider), now) == HALF_OPEN:
+                self._probes[provider] = now
+            return True
+
+    def fastest(self, candidates: Iterable[str]) -> Optional[str]:
+        """
+        候选提供商中当前最快的可用提供商（半开的提供商占用试探名额）
+        没有数据的提供商优先（先采样一次）；全部断开时选最近错误率最低的
+        """
+        candidates = list(candidates)
+        if not candidates:
+            return None
+        now = time.time()
+        with self._lock:
+            stats = {name: self._providers.get(name) for name in candidates}
+            available = [name for name in candidates if self._available_locked(name, now)]
+            if not available:
+                return min(candidates, key=lambda name: sum(stats[name]["recent"]) / max(len(stats[name]["recent"]), 1))
+            choice = min(available, key=lambda name: (stats[name] or {}).get("ewma_latency_ms") or 0.0)
+            if health_state(stats[choice], now) == HALF_OPEN:
+                self._probes[choice] = now
+            return choice
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "providers": {name: summarize(stats) for name, stats in self._providers.items()},
+                "models": {name: summarize(stats) for name, stats in self._models.items()},
+            }
+
+    def save(self):
+        if not self.persist:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "providers": json.loads(json.dumps(self._providers)),
+                "models": json.loads(json.dumps(self._models)),
+                "saved_at": time.time(),
+            }
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[ProviderTelemetry] 保存失败: {e}")
+
+    def reset(self, provider: Optional[str] = None):
+        with self._lock:
+            if provider is None:
+                self._providers.clear()
+                self._models.clear()
+            else:
+                self._providers.pop(provider, None)
+                for key in [k for k in self._models if k.startswith(f"{provider}/")]:
+                    del self._models[key]
+            self._dirty = True
+        self.save()
+
+
+# 全局实例
+provider_telemetry = ProviderTelemetry()
+atexit.register(provider_telemetry.save)
+
+
+def run_self_test() -> bool:
+    """熔断与恢复：断开 → 冷却后半开只放行一个试探 → 试探成功后恢复路由"""
+    telemetry = ProviderTelemetry(persist=False)
+    for _ in range(FAILURE_THRESHOLD):
+        telemetry.record("a", "m", 0.1, False, error="HTTP 503")
+    telemetry.record("b", "m", 0.5, True)
+    stats = telemetry._providers["a"]
+    start = stats["last_failure_at"]
+    checks = [
+        ("open after failures", health_state(stats, start + 1) == OPEN),
+        ("routes around open provider", telemetry.fastest(["a", "b"]) == "b"),
+        ("half-open after cooldown", health_state(stats, start + FAILURE_COOLDOWN + 1) == HALF_OPEN),
+        ("healthy check after an hour", is_healthy(stats, start + 3600)),
+    ]
+    # 模拟冷却结束
+    stats["last_failure_at"] = start - FAILURE_COOLDOWN - 1
+    checks.append(("probe routed to half-open provider", telemetry.fastest(["a", "b"]) == "a"))
+    checks.append(("only one probe in flight", telemetry.fastest(["a", "b"]) == "b"))
+    telemetry.record("a", "m", 0.1, True)
+    checks.append(("recovered after successful probe", health_state(telemetry._providers["a"]) == HEALTHY))
+    checks.append(("fastest again after recovery", telemetry.fastest(["a", "b"]) == "a"))
+    # 试探失败重新断开
+    for _ in range(FAILURE_THRESHOLD):
+        telemetry.record("a", "m", 0.1, False)
+    checks.append(("re-opened after failed probes", not telemetry.is_healthy("a")))
+
+    for name, passed in checks:
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    return all(passed for _, passed in checks)
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(0 if run_self_test() else 1)
@@ -0,0 +1,141 @@
+"""
+Request Batcher
+LLM请求并发层 - 独立的提示词生成并发执行，按后端限制并发数
+
+功能：
+- 按后端（主机地址/云端提供商）限制同时进行的请求数
+- 同一批次中完全相同的请求只发送一次
+- 结果保持输入顺序
+
+并发上限通过环境变量 LLM_MAX_CONCURRENCY 设置（默认4），也可以按后端调用set_limit调整。
+OpenAI兼容的/v1/chat/completions没有同步多提示词接口，因此批量请求以并发方式执行。
+
+基准测试：
+    python nodes/request_batcher.py
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Union
+from urllib.parse import urlsplit
+
+DEFAULT_CONCURRENCY = max(int(os.getenv("LLM_MAX_CONCURRENCY", 4)), 1)
+
+
+class RequestBatcher:
+    """按后端限流的并发执行器"""
+
+    def __init__(self, max_workers: int = 16, default_limit: int = DEFAULT_CONCURRENCY):
+        self.default_limit = default_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-batch")
+        self._limits: Dict[str, int] = {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+
+    def set_limit(self, backend: str, limit: int):
+        """设置后端并发上限（对之后获取的信号量生效）"""
+        with self._lock:
+            self._limits[backend] = max(int(limit), 1)
+            self._semaphores.pop(backend, None)
+
+    def get_limit(self, backend: str) -> int:
+        with self._lock:
+            return self._limits.get(backend, self.default_limit)
+
+    def _semaphore(self, backend: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(backend)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self._limits.get(backend, self.default_limit))
+                self._semaphores[backend] = semaphore
+            return semaphore
+
+    @contextmanager
+    def slot(self, backend: str):
+        """
+        占用后端的一个并发名额（单个请求也可使用，保证跨节点的总并发不超限）
+        同一线程内嵌套占用同一后端时不重复计数
+        """
+        held = getattr(self._held, "backends", None)
+        if held is None:
+            held = self._held.backends = set()
+        if backend in held:
+            yield
+            return
+        semaphore = self._semaphore(backend)
+        semaphore.acquire()
+        held.add(backend)
+        try:
+            yield
+        finally:
+            held.discard(backend)
+            semaphore.release()
+
+    def map(self, fn: Callable[..., Any], calls: Sequence[Dict[str, Any]],
+            backend: Union[str, Callable[[Dict[str, Any]], str]],
+            key_fn: Optional[Callable[[Dict[str, Any]], Hashable]] = None) -> List[Any]:
+        """
+        并发执行fn(**kwargs)，返回与calls顺序一致的结果
+        :param backend: 后端标识，或按单个请求参数返回后端标识的函数（各请求发往不同主机时按主机分别限流）
+        :param key_fn: 请求去重键，相同键的请求只执行一次
+        """
+        backend_of = backend if callable(backend) else (lambda kwargs: backend)
+        if len(calls) == 1:
+            with self.slot(backend_of(calls[0])):
+                return [fn(**calls[0])]
+
+        futures: Dict[Hashable, Any] = {}
+        order: List[Hashable] = []
+        for index, kwargs in enumerate(calls):
+            key = key_fn(kwargs) if key_fn is not None else index
+            order.append(key)
+            if key not in futures:
+                futures[key] = self._executor.submit(self._run, fn, kwargs, backend_of(kwargs))
+        return [futures[key].result() for key in order]
+
+    def _run(self, fn: Callable[..., Any], kwargs: Dict[str, Any], backend: str) -> Any:
+        with self.slot(backend):
+            return fn(**kwargs)
+
+
+def backend_key(url: str) -> str:
+    """后端标识：URL取scheme://host:port，其余（如提供商名称）原样使用"""
+    if "://" not in url:
+        return url
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+# 全局实例
+request_batcher = RequestBatcher()
+
+
+def broadcast_lists(**inputs: Any) -> List[Dict[str, Any]]:
+    """
+    把INPUT_IS_LIST节点收到的列表参数展开为逐项参数
+    较短的列表重复最后一个值（与ComfyUI的列表广播规则一致）
+    """
+    lists = {name: value if isinstance(value, list) else [value] for name, value in inputs.items()}
+    length = max((len(value) for value in lists.values() if value), default=0)
+    return [
+        {name: (value[min(i, len(value) - 1)] if value else None) for name, value in lists.items()}
+        for i in range(length)
+    ]
+
+
+if __name__ == "__main__":
+    import time
+
+    def fake_generation(prompt: str) -> str:
+        time.sleep(0.2)  # 模拟一次LLM请求
+        return prompt.upper()
+
+    prompts = [{"prompt": f"layer {i}"} for i in range(8)]
+    for limit in (1, 2, 4, 8):
+        batcher = RequestBatcher(default_limit=limit)
+        start = time.perf_counter()
+        batcher.map(fake_generation, prompts, backend="bench")
+        print(f"concurrency={limit}: {time.perf_counter() - start:.2f}s for {len(prompts)} requests")
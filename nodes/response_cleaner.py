@@ -0,0 +1,615 @@
+"""
+Response Cleaner
+模型响应规范化 - 各节点共享的响应清理函数
+
+所有正则在导入时预编译。一次扫描（scan_response）对响应中的关键片段分类：
+思考标签、代码围栏、引号、标题、分隔线、中文片段。各清理函数根据扫描结果跳过不可能命中的处理步骤，
+返回值与原先各节点内的实现逐字一致（见GOLDEN_CASES）。
+
+清理函数：
+- clean_api_response            KontextSuperPrompt API/Ollama模式
+- extract_prompt_from_api_output / extract_prompt_from_ollama_output  KontextSuperPrompt前端预览文本
+- clean_ollama_response         OllamaKontextPromptGenerator
+- clean_natural_language_output TextGenWebUIFluxKontextEnhancer
+- post_process_output           CustomModelPromptGenerator
+
+黄金用例与基准测试：
+    python nodes/response_cleaner.py [--iterations N]
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_API_RESPONSE = "Edit the selected area as requested"
+DEFAULT_OLLAMA_RESPONSE = "Apply professional editing to the selected area with high quality results"
+GENERIC_ENGLISH_INSTRUCTION = "Apply the requested editing to the marked area with professional quality"
+
+# 片段扫描：各类标记首字符互不相同，因此每类片段的有无判断是精确的；
+# 开头的字符集预查让引擎快速跳过普通文本
+_SEGMENT_PATTERN = re.compile(r'(?=[<`#\-"\u4e00-\u9fff])(?:</?think>|```|###|---|"|[\u4e00-\u9fff]+)')
+_TOKEN_KINDS = {'`': 'fence', '#': 'heading', '-': 'separator', '"': 'quote'}
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+
+# clean_api_response
+_API_ENGLISH_SENTENCE = re.compile(r'[A-Z][a-zA-Z\s,\.\-;:]+[\.]')
+_API_ENGLISH_PART = re.compile(r'[a-zA-Z][a-zA-Z\s,\.\-]+')
+_LONG_QUOTE = re.compile(r'"([^"]{30,})"')
+_NUMBERED_PROMPT_QUOTE = re.compile(r'(?:Prompt \d+:.*?)"([^"]+)"', re.DOTALL)
+_CODE_BLOCK = re.compile(r'```[^`]*?\n(.*?)\n```', re.DOTALL)
+_HEADING_LINE = re.compile(r'^###.*$', re.MULTILINE | re.IGNORECASE)
+_PROMPT_NUMBER_LINE = re.compile(r'^Prompt \d+:.*$', re.MULTILINE | re.IGNORECASE)
+_SEPARATOR_LINE = re.compile(r'^---.*$', re.MULTILINE | re.IGNORECASE)
+_PROMPT_PREFIX = re.compile(r'^.*?prompt:\s*', re.MULTILINE | re.IGNORECASE)
+_BLANK_LINES = re.compile(r'\n{2,}')
+
+# extract_prompt_from_ollama_output
+_GENERATED_PROMPT_CN = re.compile(r'生成的提示词[:：]\s*\n?(.+?)$', re.DOTALL)
+_GENERATED_PROMPT_EN = re.compile(r'(?:generated prompt:|prompt:)\s*(.+?)(?:\n\n|$)', re.IGNORECASE | re.DOTALL)
+
+# clean_ollama_response：按优先级排列的指令句（关键字用于跳过不可能命中的模式）
+_THINK_SENTENCE = re.compile(r'[A-Z][^.!?]*[.!?]')
+_INSTRUCTION_PATTERNS = [
+    (keyword, re.compile(pattern, re.IGNORECASE))
+    for keyword, pattern in (
+        ("transform", r'(Transform[^.!?]*[.!?])'),
+        ("remove", r'(Remove[^.!?]*[.!?])'),
+        ("add", r'(Add[^.!?]*[.!?])'),
+        ("enhance", r'(Enhance[^.!?]*[.!?])'),
+        ("apply", r'(Apply[^.!?]*[.!?])'),
+        ("change", r'(Change[^.!?]*[.!?])'),
+        ("convert", r'(Convert[^.!?]*[.!?])'),
+        ("selected", r'([A-Z][a-z]+\s+the\s+selected[^.!?]*[.!?])'),
+    )
+]
+_OLLAMA_ENGLISH_SENTENCE = re.compile(r'[A-Z][a-zA-Z\s,\.;:\-!?()]+[\.!?]')
+_LEADING_SYMBOLS = re.compile(r'^[:\-\s<>]+')
+_ANGLE_TAG = re.compile(r'[<>].*?[<>]')
+_WHITESPACE = re.compile(r'\s+')
+
+# clean_natural_language_output
+_ANNOTATION_REF = re.compile(r'\(annotation\s+\d+\)', re.IGNORECASE)
+_ANNOTATION_LABEL = re.compile(r'annotation\s+\d+:?', re.IGNORECASE)
+
+# post_process_output
+_CUSTOM_MODEL_PREFIXES = [
+    "根据您的编辑要求",
+    "以下是生成的提示词",
+    "生成的提示词如下",
+    "Based on your editing request",
+    "Here is the generated prompt",
+    "The generated prompt is"
+]
+_QUALITY_TAGS = ["high quality", "detailed", "professional", "8k", "masterpiece"]
+
+_PREVIEW_SKIP_PREFIXES = ('✅', '模型:', '输入:')
+
+
+def _token_kind(token: str) -> str:
+    first = token[0]
+    if first == '<':
+        return 'think_close' if token[1] == '/' else 'think_open'
+    return _TOKEN_KINDS.get(first, 'cjk')
+
+
+class ResponseScan:
+    """一次扫描得到的片段信息（标记位置按需计算）"""
+
+    __slots__ = ("text", "kinds", "_tokens")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.kinds = {_token_kind(token) for token in set(_SEGMENT_PATTERN.findall(text))}
+        self._tokens: Optional[List[Tuple[str, int, int]]] = None
+
+    @property
+    def tokens(self) -> List[Tuple[str, int, int]]:
+        """(类型, 起始, 结束) 列表"""
+        if self._tokens is None:
+            self._tokens = [(_token_kind(match.group()), match.start(), match.end())
+                            for match in _SEGMENT_PATTERN.finditer(self.text)]
+        return self._tokens
+
+    @property
+    def has_cjk(self) -> bool:
+        return "cjk" in self.kinds
+
+    @property
+    def has_think(self) -> bool:
+        return "think_open" in self.kinds
+
+    @property
+    def has_fence(self) -> bool:
+        return "fence" in self.kinds
+
+    @property
+    def has_heading(self) -> bool:
+        return "heading" in self.kinds
+
+    @property
+    def has_separator(self) -> bool:
+        return "separator" in self.kinds
+
+    @property
+    def has_quote(self) -> bool:
+        return "quote" in self.kinds
+
+    def segments(self) -> List[Tuple[str, int, int]]:
+        """
+        将标记配对为片段：think（思考块）、code（代码围栏）、quote（引号内容）、
+        heading（以###开头的行）、cjk（连续中文）
+        """
+        segments = []
+        open_think = open_fence = open_quote = None
+        for kind, start, end in self.tokens:
+            if kind == "think_open" and open_think is None:
+                open_think = start
+            elif kind == "think_close" and open_think is not None:
+                segments.append(("think", open_think, end))
+                open_think = None
+            elif kind == "fence":
+                if open_fence is None:
+                    open_fence = start
+                else:
+                    segments.append(("code", open_fence, end))
+                    open_fence = None
+            elif kind == "quote":
+                if open_quote is None:
+                    open_quote = start
+                else:
+                    segments.append(("quote", open_quote, end))
+                    open_quote = None
+            elif kind == "heading" and (start == 0 or self.text[start - 1] == "\n"):
+                line_end = self.text.find("\n", end)
+                segments.append(("heading", start, len(self.text) if line_end == -1 else line_end))
+            elif kind == "cjk":
+                segments.append(("cjk", start, end))
+        return segments
+
+
+def scan_response(text: str) -> ResponseScan:
+    return ResponseScan(text)
+
+
+def has_cjk(text: str) -> bool:
+    """是否包含中文字符（U+4E00-U+9FFF）"""
+    return _CJK_PATTERN.search(text) is not None
+
+
+def _folded(text: str) -> str:
+    """用于关键字预检查的小写文本（与re.IGNORECASE的匹配范围一致：ſ→s、ı→i）"""
+    return text.casefold().replace('ı', 'i')
+
+
+def clean_api_response(response: str) -> str:
+    """清理API响应，确保只输出英文提示词"""
+    if not response:
+        return DEFAULT_API_RESPONSE
+
+    scan = scan_response(response)
+
+    # 如果包含中文，进行强力处理
+    if scan.has_cjk:
+        # 尝试提取所有英文句子，取最长的
+        english_sentences = _API_ENGLISH_SENTENCE.findall(response)
+        if english_sentences:
+            longest = max(english_sentences, key=len)
+            if len(longest) > 30:
+                return longest.strip()
+
+        # 尝试提取任何英文片段，过滤太短的片段后合并
+        valid_parts = [p for p in _API_ENGLISH_PART.findall(response) if len(p) > 10]
+        if valid_parts:
+            english_text = ' '.join(valid_parts)
+            if len(english_text) > 20:
+                return english_text.strip()
+
+        return GENERIC_ENGLISH_INSTRUCTION
+
+    if scan.has_quote:
+        # 引号中的提示词（多个Prompt编号时同样优先取第一个长引号）
+        quoted_match = _LONG_QUOTE.search(response)
+        if quoted_match:
+            return quoted_match.group(1).strip()
+
+        if '### Prompt' in response or 'Prompt 1:' in response:
+            first_prompt_match = _NUMBERED_PROMPT_QUOTE.search(response)
+            if first_prompt_match:
+                return first_prompt_match.group(1).strip()
+
+    # 尝试提取代码块中的提示词
+    if scan.has_fence:
+        code_block_match = _CODE_BLOCK.search(response)
+        if code_block_match and len(code_block_match.group(1).strip()) > 20:
+            return code_block_match.group(1).strip()
+
+    # 清理标题和前缀（删除只清空行内容，不会产生新的关键字，因此可以按原文预检查）
+    cleaned = response.strip()
+    folded = _folded(cleaned)
+    if scan.has_heading:
+        cleaned = _HEADING_LINE.sub('', cleaned)
+    if 'prompt' in folded:
+        cleaned = _PROMPT_NUMBER_LINE.sub('', cleaned)
+    if scan.has_separator:
+        cleaned = _SEPARATOR_LINE.sub('', cleaned)
+    if 'prompt:' in folded:
+        cleaned = _PROMPT_PREFIX.sub('', cleaned)
+
+    # 清理多余空行
+    cleaned = _BLANK_LINES.sub('\n', cleaned).strip()
+
+    # 如果结果为空或太短，返回原始内容
+    if not cleaned or len(cleaned) < 10:
+        return response.strip()
+
+    return cleaned
+
+
+def _strip_quotes(line: str) -> str:
+    return line.strip('"').strip("'").strip()
+
+
+def extract_prompt_from_api_output(api_output: str) -> str:
+    """从API输出（前端预览文本）中提取纯净的提示词"""
+    # 方法1: "生成的提示词:"之后的第一个非空行
+    for marker in ('生成的提示词:', '生成的提示词：'):
+        if marker in api_output:
+            after_marker = api_output[api_output.index(marker) + len(marker):].strip()
+            if after_marker:
+                for line in after_marker.split('\n'):
+                    line = line.strip()
+                    if line and not line.startswith('✅'):
+                        return _strip_quotes(line)
+
+    # 方法2: 最后一个有意义的行（跳过调试信息与短标签）
+    for line in reversed(api_output.strip().split('\n')):
+        line = line.strip()
+        if line and not line.startswith(_PREVIEW_SKIP_PREFIXES) and len(line) > 20:
+            return _strip_quotes(line)
+
+    return api_output.strip()
+
+
+def extract_prompt_from_ollama_output(ollama_output: str) -> str:
+    """从Ollama输出（前端预览文本）中提取纯净的提示词"""
+    if '生成的提示词:' in ollama_output or '生成的提示词：' in ollama_output:
+        match = _GENERATED_PROMPT_CN.search(ollama_output)
+        if match:
+            return _strip_quotes(match.group(1).strip())
+
+    if 'prompt:' in ollama_output.lower():
+        match = _GENERATED_PROMPT_EN.search(ollama_output)
+        if match:
+            return _strip_quotes(match.group(1).strip())
+
+    # 提取最后一行有效内容
+    for line in reversed(ollama_output.strip().split('\n')):
+        line = line.strip()
+        if line and not line.startswith(_PREVIEW_SKIP_PREFIXES):
+            return _strip_quotes(line)
+
+    return ollama_output.strip()
+
+
+def clean_ollama_response(response: str) -> str:
+    """清理Ollama响应，提取实际的编辑指令"""
+    if not response:
+        return DEFAULT_OLLAMA_RESPONSE
+
+    # 1. 处理 <think> 标签 - 提取思考后的内容
+    if '<think>' in response:
+        think_end = response.find('</think>')
+        if think_end != -1:
+            after_think = response[think_end + 8:].strip()
+            if after_think:
+                response = after_think
+            else:
+                # </think> 后没有内容时，取思考内容中的最后一句
+                think_content = response[response.find('<think>') + 7:think_end]
+                sentences = _THINK_SENTENCE.findall(think_content)
+                if sentences:
+                    response = sentences[-1].strip()
+
+    # 2. 按优先级查找以动词开头的英文编辑指令句子
+    folded = _folded(response)
+    for keyword, pattern in _INSTRUCTION_PATTERNS:
+        if keyword in folded:
+            match = pattern.search(response)
+            if match:
+                return match.group(1).strip()
+
+    # 3. fallback - 最长的完整英文句子
+    english_sentences = _OLLAMA_ENGLISH_SENTENCE.findall(response)
+    if english_sentences:
+        longest = max(english_sentences, key=len)
+        if len(longest) > 15:
+            return longest.strip()
+
+    # 4. 最终清理：开头符号、标签、换行与多余空格
+    cleaned = _LEADING_SYMBOLS.sub('', response)
+    if '<' in cleaned or '>' in cleaned:
+        cleaned = _ANGLE_TAG.sub('', cleaned)
+    cleaned = _WHITESPACE.sub(' ', cleaned)
+
+    result = cleaned.strip()
+    return result if result else DEFAULT_OLLAMA_RESPONSE
+
+
+def clean_natural_language_output(instructions: str) -> str:
+    """Clean natural language output to remove technical details and annotation numbers"""
+    try:
+        if 'annotation' in _folded(instructions):
+            instructions = _ANNOTATION_REF.sub('', instructions)
+            instructions = _ANNOTATION_LABEL.sub('', instructions)
+
+        cleaned_lines = []
+        skip_section = False
+
+        for line in instructions.split('\n'):
+            line = line.strip()
+
+            # Skip technical instruction sections
+            if line.startswith('**Instruction:**') or line.startswith('**Instructions:**'):
+                skip_section = True
+                continue
+            elif line.startswith('**') and skip_section:
+                # End of instruction section
+                skip_section = False
+                continue
+            elif skip_section and (line.startswith('-') or line.startswith('*') or 'Apply' in line or 'Ensure' in line or 'Maintain' in line):
+                # Skip technical instruction items
+                continue
+            elif skip_section and not line:
+                # Skip empty lines in instruction sections
+                continue
+            else:
+                skip_section = False
+
+            # Keep non-technical content
+            if line and not line.startswith(('- Apply', '- Ensure', '- Maintain')):
+                cleaned_lines.append(line)
+
+        result = _WHITESPACE.sub(' ', ' '.join(cleaned_lines)).strip()
+
+        return result if result else instructions
+
+    except Exception as e:
+        # If cleaning fails, return original
+        return instructions
+
+
+def post_process_output(raw_output: str) -> str:
+    """后处理本地模型输出，提取干净的提示词"""
+    processed = raw_output.strip()
+
+    # 移除常见的前缀
+    for prefix in _CUSTOM_MODEL_PREFIXES:
+        if processed.lower().startswith(prefix.lower()):
+            processed = processed[len(prefix):].strip()
+            if processed.startswith("：") or processed.startswith(":"):
+                processed = processed[1:].strip()
+
+    # 移除多余的换行和空格
+    processed = " ".join(processed.split())
+
+    # 确保以高质量标签结尾
+    lowered = processed.lower()
+    if not any(tag in lowered for tag in _QUALITY_TAGS):
+        processed += ", high quality, detailed, professional"
+
+    return processed
+
+
+# 黄金用例：输入与原先各节点实现的输出（重构前生成），用于验证行为完全一致
+GOLDEN_CASES: Dict[str, List[Tuple[str, str]]] = {
+    'clean_api_response': [
+        ('',
+         'Edit the selected area as requested'),
+        ('Transform the selected area to deep blue while keeping the lighting natural.',
+         'Transform the selected area to deep blue while keeping the lighting natural.'),
+        ('Here is the prompt: Change the red car to a vintage green convertible with chrome details.',
+         'Change the red car to a vintage green convertible with chrome details.'),
+        ('### Prompt 1:\n"Transform the background into a sunset beach scene with warm golden light"\n\n### Prompt 2:\n"Replace the sky with a starry night"',
+         'Transform the background into a sunset beach scene with warm golden light'),
+        ('Prompt 1: make it "bright"\nPrompt 2: "Enhance the portrait with soft studio lighting and smooth skin"',
+         'Enhance the portrait with soft studio lighting and smooth skin'),
+        ('Prompt 1: "short"\n### Prompt 2: "tiny"',
+         'short'),
+        ('将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.',
+         'Transform the background into a clear blue sky with white clouds.'),
+        ('修改颜色 change the color of the shirt to crimson red 保持自然',
+         'change the color of the shirt to crimson red'),
+        ('完全中文的回答，没有英文。',
+         'Apply the requested editing to the marked area with professional quality'),
+        ('```\nEnhance the selected region with crisp details and vivid colors\n```',
+         'Enhance the selected region with crisp details and vivid colors'),
+        ('```text\nshort\n```\nSome other content here.',
+         '```text\nshort\n```\nSome other content here.'),
+        ('---\nPrompt: Remove the person from the left side and fill the background seamlessly\n---',
+         'Remove the person from the left side and fill the background seamlessly'),
+    ],
+    'extract_prompt_from_api_output': [
+        ('',
+         ''),
+        ('Transform the selected area to deep blue while keeping the lighting natural.',
+         'Transform the selected area to deep blue while keeping the lighting natural.'),
+        ('Here is the prompt: Change the red car to a vintage green convertible with chrome details.',
+         'Here is the prompt: Change the red car to a vintage green convertible with chrome details.'),
+        ('### Prompt 1:\n"Transform the background into a sunset beach scene with warm golden light"\n\n### Prompt 2:\n"Replace the sky with a starry night"',
+         'Replace the sky with a starry night'),
+        ('Prompt 1: make it "bright"\nPrompt 2: "Enhance the portrait with soft studio lighting and smooth skin"',
+         'Prompt 2: "Enhance the portrait with soft studio lighting and smooth skin'),
+        ('Prompt 1: "short"\n### Prompt 2: "tiny"',
+         'Prompt 1: "short"\n### Prompt 2: "tiny"'),
+        ('将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.',
+         '将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.'),
+        ('修改颜色 change the color of the shirt to crimson red 保持自然',
+         '修改颜色 change the color of the shirt to crimson red 保持自然'),
+        ('完全中文的回答，没有英文。',
+         '完全中文的回答，没有英文。'),
+        ('```\nEnhance the selected region with crisp details and vivid colors\n```',
+         'Enhance the selected region with crisp details and vivid colors'),
+        ('```text\nshort\n```\nSome other content here.',
+         'Some other content here.'),
+        ('---\nPrompt: Remove the person from the left side and fill the background seamlessly\n---',
+         'Prompt: Remove the person from the left side and fill the background seamlessly'),
+    ],
+    'extract_prompt_from_ollama_output': [
+        ('',
+         ''),
+        ('Transform the selected area to deep blue while keeping the lighting natural.',
+         'Transform the selected area to deep blue while keeping the lighting natural.'),
+        ('Here is the prompt: Change the red car to a vintage green convertible with chrome details.',
+         'Change the red car to a vintage green convertible with chrome details.'),
+        ('### Prompt 1:\n"Transform the background into a sunset beach scene with warm golden light"\n\n### Prompt 2:\n"Replace the sky with a starry night"',
+         'Replace the sky with a starry night'),
+        ('Prompt 1: make it "bright"\nPrompt 2: "Enhance the portrait with soft studio lighting and smooth skin"',
+         'Prompt 2: "Enhance the portrait with soft studio lighting and smooth skin'),
+        ('Prompt 1: "short"\n### Prompt 2: "tiny"',
+         '### Prompt 2: "tiny'),
+        ('将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.',
+         '将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.'),
+        ('修改颜色 change the color of the shirt to crimson red 保持自然',
+         '修改颜色 change the color of the shirt to crimson red 保持自然'),
+        ('完全中文的回答，没有英文。',
+         '完全中文的回答，没有英文。'),
+        ('```\nEnhance the selected region with crisp details and vivid colors\n```',
+         '```'),
+        ('```text\nshort\n```\nSome other content here.',
+         'Some other content here.'),
+        ('---\nPrompt: Remove the person from the left side and fill the background seamlessly\n---',
+         'Remove the person from the left side and fill the background seamlessly\n---'),
+    ],
+    'clean_ollama_response': [
+        ('',
+         'Apply professional editing to the selected area with high quality results'),
+        ('Transform the selected area to deep blue while keeping the lighting natural.',
+         'Transform the selected area to deep blue while keeping the lighting natural.'),
+        ('Here is the prompt: Change the red car to a vintage green convertible with chrome details.',
+         'Change the red car to a vintage green convertible with chrome details.'),
+        ('### Prompt 1:\n"Transform the background into a sunset beach scene with warm golden light"\n\n### Prompt 2:\n"Replace the sky with a starry night"',
+         '### Prompt 1: "Transform the background into a sunset beach scene with warm golden light" ### Prompt 2: "Replace the sky with a starry night"'),
+        ('Prompt 1: make it "bright"\nPrompt 2: "Enhance the portrait with soft studio lighting and smooth skin"',
+         'Prompt 1: make it "bright" Prompt 2: "Enhance the portrait with soft studio lighting and smooth skin"'),
+        ('Prompt 1: "short"\n### Prompt 2: "tiny"',
+         'Prompt 1: "short" ### Prompt 2: "tiny"'),
+        ('将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.',
+         'Transform the background into a clear blue sky with white clouds.'),
+        ('修改颜色 change the color of the shirt to crimson red 保持自然',
+         '修改颜色 change the color of the shirt to crimson red 保持自然'),
+        ('完全中文的回答，没有英文。',
+         '完全中文的回答，没有英文。'),
+        ('```\nEnhance the selected region with crisp details and vivid colors\n```',
+         '``` Enhance the selected region with crisp details and vivid colors ```'),
+        ('```text\nshort\n```\nSome other content here.',
+         'Some other content here.'),
+        ('---\nPrompt: Remove the person from the left side and fill the background seamlessly\n---',
+         'Prompt: Remove the person from the left side and fill the background seamlessly ---'),
+    ],
+    'clean_natural_language_output': [
+        ('',
+         ''),
+        ('Transform the selected area to deep blue while keeping the lighting natural.',
+         'Transform the selected area to deep blue while keeping the lighting natural.'),
+        ('Here is the prompt: Change the red car to a vintage green convertible with chrome details.',
+         'Here is the prompt: Change the red car to a vintage green convertible with chrome details.'),
+        ('### Prompt 1:\n"Transform the background into a sunset beach scene with warm golden light"\n\n### Prompt 2:\n"Replace the sky with a starry night"',
+         '### Prompt 1: "Transform the background into a sunset beach scene with warm golden light" ### Prompt 2: "Replace the sky with a starry night"'),
+        ('Prompt 1: make it "bright"\nPrompt 2: "Enhance the portrait with soft studio lighting and smooth skin"',
+         'Prompt 1: make it "bright" Prompt 2: "Enhance the portrait with soft studio lighting and smooth skin"'),
+        ('Prompt 1: "short"\n### Prompt 2: "tiny"',
+         'Prompt 1: "short" ### Prompt 2: "tiny"'),
+        ('将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.',
+         '将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.'),
+        ('修改颜色 change the color of the shirt to crimson red 保持自然',
+         '修改颜色 change the color of the shirt to crimson red 保持自然'),
+        ('完全中文的回答，没有英文。',
+         '完全中文的回答，没有英文。'),
+        ('```\nEnhance the selected region with crisp details and vivid colors\n```',
+         '``` Enhance the selected region with crisp details and vivid colors ```'),
+        ('```text\nshort\n```\nSome other content here.',
+         '```text short ``` Some other content here.'),
+        ('---\nPrompt: Remove the person from the left side and fill the background seamlessly\n---',
+         '--- Prompt: Remove the person from the left side and fill the background seamlessly ---'),
+    ],
+    'post_process_output': [
+        ('',
+         ', high quality, detailed, professional'),
+        ('Transform the selected area to deep blue while keeping the lighting natural.',
+         'Transform the selected area to deep blue while keeping the lighting natural., high quality, detailed, professional'),
+        ('Here is the prompt: Change the red car to a vintage green convertible with chrome details.',
+         'Here is the prompt: Change the red car to a vintage green convertible with chrome details., high quality, detailed, professional'),
+        ('### Prompt 1:\n"Transform the background into a sunset beach scene with warm golden light"\n\n### Prompt 2:\n"Replace the sky with a starry night"',
+         '### Prompt 1: "Transform the background into a sunset beach scene with warm golden light" ### Prompt 2: "Replace the sky with a starry night", high quality, detailed, professional'),
+        ('Prompt 1: make it "bright"\nPrompt 2: "Enhance the portrait with soft studio lighting and smooth skin"',
+         'Prompt 1: make it "bright" Prompt 2: "Enhance the portrait with soft studio lighting and smooth skin", high quality, detailed, professional'),
+        ('Prompt 1: "short"\n### Prompt 2: "tiny"',
+         'Prompt 1: "short" ### Prompt 2: "tiny", high quality, detailed, professional'),
+        ('将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds.',
+         '将背景改为蓝天白云。Transform the background into a clear blue sky with white clouds., high quality, detailed, professional'),
+        ('修改颜色 change the color of the shirt to crimson red 保持自然',
+         '修改颜色 change the color of the shirt to crimson red 保持自然, high quality, detailed, professional'),
+        ('完全中文的回答，没有英文。',
+         '完全中文的回答，没有英文。, high quality, detailed, professional'),
+        ('```\nEnhance the selected region with crisp details and vivid colors\n```',
+         '``` Enhance the selected region with crisp details and vivid colors ```, high quality, detailed, professional'),
+        ('```text\nshort\n```\nSome other content here.',
+         '```text short ``` Some other content here., high quality, detailed, professional'),
+        ('---\nPrompt: Remove the person from the left side and fill the background seamlessly\n---',
+         '--- Prompt: Remove the person from the left side and fill the background seamlessly ---, high quality, detailed, professional'),
+    ],
+}
+
+
+CLEANERS = {
+    "clean_api_response": clean_api_response,
+    "extract_prompt_from_api_output": extract_prompt_from_api_output,
+    "extract_prompt_from_ollama_output": extract_prompt_from_ollama_output,
+    "clean_ollama_response": clean_ollama_response,
+    "clean_natural_language_output": clean_natural_language_output,
+    "post_process_output": post_process_output,
+}
+
+
+def run_golden_tests() -> List[str]:
+    """运行黄金用例，返回失败描述列表（空列表表示全部通过）"""
+    failures = []
+    for name, cases in GOLDEN_CASES.items():
+        cleaner = CLEANERS[name]
+        for text, expected in cases:
+            actual = cleaner(text)
+            if actual != expected:
+                failures.append(f"{name}({text!r}): expected {expected!r}, got {actual!r}")
+    return failures
+
+
+def benchmark(iterations: int = 2000) -> Dict[str, float]:
+    """以全部黄金用例输入为语料，测量每个清理函数的平均单次耗时（微秒）"""
+    import time
+
+    corpus = list(dict.fromkeys(text for cases in GOLDEN_CASES.values() for text, _ in cases))
+    results = {}
+    for name, cleaner in CLEANERS.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for text in corpus:
+                cleaner(text)
+        results[name] = round((time.perf_counter() - start) * 1e6 / (iterations * len(corpus)), 3)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="响应清理黄金用例与基准测试")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    failures = run_golden_tests()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    total = sum(len(cases) for cases in GOLDEN_CASES.values())
+    print(f"golden cases: {total - len(failures)}/{total} passed")
+    for name, micros in benchmark(args.iterations).items():
+        print(f"{name:36s} {micros:8.3f} us/call")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,147 @@
+"""
+Structured Output
+结构化输出 - 让模型直接输出 {"instruction": "..."}，不再依赖正则从自由文本中提取指令
+
+各后端的约束方式：
+- Ollama：format参数传入JSON Schema
+- OpenAI兼容API：response_format（json_object）；提供商不支持时自动关闭并记住
+- TextGen WebUI：grammar_string（GBNF）
+- llama.cpp：LlamaGrammar（GBNF）
+
+解析失败时返回None，调用方退回原有的清理函数。
+
+配置（环境变量）：
+- STRUCTURED_OUTPUT=0 关闭结构化输出
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    from llama_cpp import LlamaGrammar
+    LLAMA_GRAMMAR_AVAILABLE = True
+except ImportError:
+    LLAMA_GRAMMAR_AVAILABLE = False
+
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no")
+
+INSTRUCTION_KEY = "instruction"
+
+INSTRUCTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        INSTRUCTION_KEY: {"type": "string", "minLength": 1},
+    },
+    "required": [INSTRUCTION_KEY],
+    "additionalProperties": False,
+}
+
+# 只允许单个instruction字段的JSON对象（字符串不允许换行等控制字符）
+INSTRUCTION_GBNF = r'''
+root   ::= "{" ws "\"instruction\"" ws ":" ws string ws "}"
+string ::= "\"" char+ "\""
+char   ::= [^"\\\x00-\x1f] | "\\" (["\\/bfnrt] | "u" hex hex hex hex)
+hex    ::= [0-9a-fA-F]
+ws     ::= [ ]?
+'''
+
+# 追加到系统提示词（OpenAI的json_object模式要求提示词中出现"JSON"）
+JSON_OUTPUT_RULE = (
+    'Respond with a single JSON object of the form {"instruction": "<the English editing instruction>"} '
+    'and nothing else.'
+)
+
+_THINK_BLOCK = re.compile(r'<think>.*?</think>', re.S)
+_JSON_OBJECT = re.compile(r'\{.*\}', re.S)
+
+# 不支持response_format的后端（返回说明response_format/JSON模式不受支持的400后记录）
+_unsupported_backends = set()
+_unsupported_lock = threading.Lock()
+_RESPONSE_FORMAT_ERROR = re.compile(r'response_format|json_object|json[ _-]?mode', re.I)
+
+
+def with_json_rule(system_prompt: str) -> str:
+    """在系统提示词末尾追加JSON输出要求"""
+    return f"{system_prompt.rstrip()}\n\n{JSON_OUTPUT_RULE}"
+
+
+def ollama_format() -> Dict[str, Any]:
+    """Ollama /api/generate 的format参数"""
+    return INSTRUCTION_SCHEMA
+
+
+def response_format_for(backend: str) -> Optional[Dict[str, Any]]:
+    """OpenAI兼容API的response_format参数，已知不支持的后端返回None"""
+    with _unsupported_lock:
+        if backend in _unsupported_backends:
+            return None
+    return {"type": "json_object"}
+
+
+def is_response_format_error(body: str) -> bool:
+    """400响应是否由response_format引起（上下文过长、模型名错误等其他400不算）"""
+    return bool(body) and bool(_RESPONSE_FORMAT_ERROR.search(body))
+
+
+def mark_response_format_unsupported(backend: str):
+    with _unsupported_lock:
+        _unsupported_backends.add(backend)
+
+
+def textgen_grammar_params() -> Dict[str, Any]:
+    """TextGen WebUI OpenAI兼容接口的额外参数"""
+    return {"grammar_string": INSTRUCTION_GBNF}
+
+
+def llama_grammar():
+    """
+    llama.cpp的GBNF语法对象
+    每次调用新建：旧版llama-cpp-python在采样时会修改语法状态，不同模型的推理可能同时进行，不能共享同一对象
+    """
+    if not LLAMA_GRAMMAR_AVAILABLE:
+        return None
+    try:
+        return LlamaGrammar.from_string(INSTRUCTION_GBNF, verbose=False)
+    except Exception as e:
+        print(f"[StructuredOutput] GBNF语法编译失败: {e}")
+        return None
+
+
+def parse_instruction(text: str) -> Optional[str]:
+    """
+    从模型输出中解析instruction字段
+    容忍思考块与代码围栏；不是合法JSON或字段为空时返回None
+    """
+    if not text:
+        return None
+    text = _THINK_BLOCK.sub('', text).strip()
+    if not text.startswith('{'):
+        match = _JSON_OBJECT.search(text)
+        if not match:
+            return None
+        text = match.group(0)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        match = _JSON_OBJECT.search(text)
+        if not match or match.group(0) == text:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    instruction = data.get(INSTRUCTION_KEY)
+    if not isinstance(instruction, str):
+        return None
+    instruction = " ".join(instruction.split())
+    return instruction or None
+
+
+def instruction_json_complete(text: str) -> bool:
+    """流式生成的提前停止条件：JSON对象已经闭合且可以解析"""
+    return text.rstrip().endswith('}') and parse_instruction(text) is not None
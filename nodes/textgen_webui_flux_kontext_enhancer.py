@@ -6,9 +6,12 @@ Converts Super Canvas layer data through Text Generation WebUI models to
 Flux Kontext-optimized structured editing instructions
 """
 
+import asyncio
 import json
 import time
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from typing import Dict, List, Any, Tuple, Optional
 from datetime import datetime
 
@@ -29,6 +32,18 @@ import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from guidance_manager import guidance_manager
+from http_client import http_client, get_circuit_breaker, PooledHTTPClient
+from prompt_cache import MemoryLRUCache
+from request_batcher import request_batcher, backend_key, broadcast_lists
+from response_cleaner import clean_natural_language_output
+from structured_output import STRUCTURED_OUTPUT_ENABLED, with_json_rule, textgen_grammar_params, parse_instruction
+
+FALLBACK_MODELS = ["textgen-webui-model-not-found"]
+
+# Model discovery: short connect timeout, no retries, all probes run concurrently
+PROBE_TIMEOUT = (1.0, 3.0)
+_probe_client = PooledHTTPClient(retries=0)
+_probe_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="textgen-probe")
 
 class TextGenWebUIFluxKontextEnhancer:
     """
@@ -43,14 +58,104 @@ class TextGenWebUIFluxKontextEnhancer:
     _cache_timestamp = 0
     _cache_duration = 10  # Cache for 10 seconds (longer than Ollama due to more stable service)
     _last_successful_url = None
+    _negative_until: Dict[str, float] = {}   # url -> time until which probing is skipped
+    _negative_backoff: Dict[str, float] = {}  # url -> current backoff in seconds
+    _refresh_lock = threading.Lock()
+    _refreshing = False
     _silent_mode = True  # Enable silent mode during INPUT_TYPES calls
     
+    # Result cache shared by all instances (ComfyUI recreates node instances freely)
+    _result_cache = MemoryLRUCache(max_entries=50, max_bytes=2 * 1024 * 1024, ttl=3600)
+    
+    @classmethod
+    def _probe_models(cls, api_url: str, api: str) -> Tuple[str, List[str]]:
+        """Probe a single URL/API combination for its model list (raises on failure)"""
+        if api == "openai":
+            # OpenAI-compatible API lists every available model
+            response = _probe_client.get(f"{api_url}/v1/models", timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            model_names = []
+            for model in response.json().get('data', []):
+                if isinstance(model, dict):
+                    name = model.get('id') or model.get('model') or model.get('name')
+                    if name:
+                        model_names.append(name)
+            return api_url, model_names
+        
+        # Native TextGen WebUI API returns the currently loaded model
+        response = _probe_client.get(f"{api_url}/api/v1/model", timeout=PROBE_TIMEOUT)
+        response.raise_for_status()
+        model_data = response.json()
+        model_name = None
+        if isinstance(model_data, dict):
+            model_name = (model_data.get('result') or 
+                        model_data.get('model_name') or 
+                        model_data.get('model'))
+        elif isinstance(model_data, str):
+            model_name = model_data
+        return api_url, [model_name] if model_name else []
+    
+    @classmethod
+    def _store_models(cls, model_list: List[str], successful_url: Optional[str] = None):
+        cls._cached_models = model_list
+        cls._cache_timestamp = time.time()
+        if successful_url:
+            cls._last_successful_url = successful_url
+            cls._negative_until.clear()
+            cls._negative_backoff.clear()
+    
     @classmethod
-    def get_available_models(cls, url=None, force_refresh=False, silent=None):
-        """Dynamically gets the list of available TextGen WebUI models"""
+    def _default_url(cls) -> str:
+        # Priority: environment variable > default value
+        return (os.getenv('TEXTGEN_WEBUI_URL') or 
+                os.getenv('TEXTGEN_URL') or 
+                os.getenv('TEXTGEN_HOST') or 
+                "http://127.0.0.1:5000")
+    
+    @classmethod
+    def _submit_probes(cls, url: str) -> list:
+        """Start probing the URL and the common local addresses with both APIs"""
+        urls_to_try = [url]
         
-        import time
-        import os
+        # Add common local address variants
+        if url not in ["http://127.0.0.1:7860", "http://localhost:7860", "http://0.0.0.0:7860"]:
+            urls_to_try.extend([
+                "http://127.0.0.1:7860",
+                "http://localhost:7860", 
+                "http://0.0.0.0:7860"
+            ])
+        
+        return [
+            _probe_executor.submit(cls._probe_models, test_url, api)
+            for test_url in dict.fromkeys(urls_to_try)
+            for api in ("openai", "native")
+        ]
+    
+    @classmethod
+    def _record_probe_failure(cls, url: str):
+        """No models detected: back off exponentially before probing this host again"""
+        backoff = min(cls._negative_backoff.get(url, 2.5) * 2, 300)
+        cls._negative_backoff[url] = backoff
+        cls._negative_until[url] = time.time() + backoff
+    
+    @classmethod
+    def _on_late_probe(cls, future):
+        """Probes that finish after the deadline still fill the cache if nothing was found yet"""
+        try:
+            api_url, model_names = future.result()
+        except Exception:
+            return
+        if model_names and (cls._cached_models is None or cls._cached_models == FALLBACK_MODELS):
+            cls._store_models(sorted(set(model_names)), api_url)
+    
+    @classmethod
+    def get_available_models(cls, url=None, force_refresh=False, silent=None, deadline: float = 3.0):
+        """
+        Dynamically gets the list of available TextGen WebUI models.
+        All candidate URLs and both APIs are probed concurrently with short timeouts; the
+        first success wins. Failures are cached with exponential backoff, and the wait is
+        bounded by `deadline` seconds (late successes still update the cache).
+        """
         current_time = time.time()
         
         # Use instance silent mode if not specified
@@ -59,11 +164,7 @@ class TextGenWebUIFluxKontextEnhancer:
         
         # Get TextGen WebUI URL configuration
         if url is None:
-            # Priority: environment variable > config file > default value
-            url = (os.getenv('TEXTGEN_WEBUI_URL') or 
-                   os.getenv('TEXTGEN_URL') or 
-                   os.getenv('TEXTGEN_HOST') or 
-                   "http://127.0.0.1:5000")
+            url = cls._default_url()
         
         # Check if cache is valid
         if (not force_refresh and 
@@ -71,131 +172,94 @@ class TextGenWebUIFluxKontextEnhancer:
             current_time - cls._cache_timestamp < cls._cache_duration):
             return cls._cached_models
         
-        def try_openai_api(api_url):
-            """Try to get model list via OpenAI-compatible API"""
-            try:
-                if not REQUESTS_AVAILABLE:
-                    return []
-                
-                response = requests.get(f"{api_url}/v1/models", timeout=10)
-                if response.status_code == 200:
-                    models_data = response.json()
-                    models = models_data.get('data', [])
-                    
-                    model_names = []
-                    for model in models:
-                        if isinstance(model, dict):
-                            name = model.get('id') or model.get('model') or model.get('name')
-                            if name:
-                                model_names.append(name)
-                    
-                    return model_names
-            except Exception as e:
-                if not silent:
-                    pass
-                return []
+        # Negative cache: don't probe unreachable hosts again until the backoff expires
+        if not force_refresh and current_time < cls._negative_until.get(url, 0):
+            return cls._cached_models or FALLBACK_MODELS
         
-        def try_native_api(api_url):
-            """Try to get model list via native TextGen WebUI API"""
-            try:
-                if not REQUESTS_AVAILABLE:
-                    return []
-                
-                response = requests.get(f"{api_url}/api/v1/model", timeout=10)
-                if response.status_code == 200:
-                    model_data = response.json()
-                    
-                    # TextGen WebUI returns current loaded model info
-                    model_name = None
-                    if isinstance(model_data, dict):
-                        model_name = (model_data.get('result') or 
-                                    model_data.get('model_name') or 
-                                    model_data.get('model'))
-                    elif isinstance(model_data, str):
-                        model_name = model_data
-                    
-                    return [model_name] if model_name else []
-            except Exception as e:
-                if not silent:
-                    pass
-                return []
-        
-        # Start model detection process
-        if not silent:
-            pass
+        if not REQUESTS_AVAILABLE:
+            return FALLBACK_MODELS
         
         # Try multiple URL formats
-        urls_to_try = [url]
-        
-        # Add common local address variants
-        if url not in ["http://127.0.0.1:7860", "http://localhost:7860", "http://0.0.0.0:7860"]:
-            urls_to_try.extend([
-                "http://127.0.0.1:7860",
-                "http://localhost:7860", 
-                "http://0.0.0.0:7860"
-            ])
-        
-        urls_to_try = list(dict.fromkeys(urls_to_try))
+        futures = cls._submit_probes(url)
         
         all_models = set()
         successful_url = None
-        
-        for test_url in urls_to_try:
-            try:
-                # Method 1: OpenAI-compatible API (preferred)
-                openai_models = try_openai_api(test_url)
-                if openai_models:
-                    all_models.update(openai_models)
-                    successful_url = test_url
-                    if not silent:
-                        pass
-                
-                # Method 2: Native API (fallback)
-                native_models = try_native_api(test_url)
-                if native_models:
-                    all_models.update(native_models)
-                    successful_url = test_url
-                    if not silent:
-                        pass
-                
-                # Exit early if models found
-                if all_models:
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                try:
+                    api_url, model_names = future.result()
+                except Exception:
+                    continue
+                if model_names:
+                    all_models.update(model_names)
+                    successful_url = api_url
                     break
-                    
-            except Exception as e:
-                if not silent:
-                    pass
-                continue
+        except FuturesTimeoutError:
+            pass
+        
+        if successful_url:
+            # Merge whatever the other API of the winning URL has already returned
+            for future in futures:
+                if future.done() and not future.exception():
+                    api_url, model_names = future.result()
+                    if api_url == successful_url:
+                        all_models.update(model_names)
+        else:
+            for future in futures:
+                if not future.done():
+                    future.add_done_callback(cls._on_late_probe)
         
         # Convert to sorted list
-        model_list = sorted(list(all_models))
+        model_list = sorted(all_models)
         
         if model_list:
-            if not silent:
-                pass
-            
-            # Update cache
-            cls._cached_models = model_list
-            cls._cache_timestamp = current_time
-            if successful_url:
-                cls._last_successful_url = successful_url
-            if not silent:
-                pass
-            
+            cls._store_models(model_list, successful_url)
             return model_list
         
-        # If no models detected, return fallback
-        if not silent:
-            pass
-        fallback_models = ["textgen-webui-model-not-found"]
-        if not silent:
-            pass
+        cls._record_probe_failure(url)
         
         # Cache fallback to avoid repeated error detection
-        cls._cached_models = fallback_models
-        cls._cache_timestamp = current_time
+        if cls._cached_models is None:
+            cls._cached_models = FALLBACK_MODELS
+            cls._cache_timestamp = current_time
         
-        return fallback_models
+        return cls._cached_models
+
+    @classmethod
+    def refresh_models_in_background(cls, url=None):
+        """
+        Refresh the model list without waiting for it (single-flight, honours the negative-cache backoff).
+        The probes run on `_probe_executor` and the first one that returns models updates the cache;
+        if every probe fails the host is backed off.
+        """
+        url = url or cls._default_url()
+        if not REQUESTS_AVAILABLE or time.time() < cls._negative_until.get(url, 0):
+            return
+        with cls._refresh_lock:
+            if cls._refreshing:
+                return
+            cls._refreshing = True
+        
+        futures = cls._submit_probes(url)
+        state = {"pending": len(futures), "found": False}
+        
+        def on_done(future):
+            try:
+                api_url, model_names = future.result()
+            except Exception:
+                api_url, model_names = None, []
+            with cls._refresh_lock:
+                state["pending"] -= 1
+                if model_names and not state["found"]:
+                    state["found"] = True
+                    cls._store_models(sorted(set(model_names)), api_url)
+                if state["pending"] == 0:
+                    cls._refreshing = False
+                    if not state["found"]:
+                        cls._record_probe_failure(url)
+        
+        for future in futures:
+            future.add_done_callback(on_done)
 
     @classmethod
     def refresh_model_cache(cls):
@@ -264,10 +328,12 @@ For more examples, please check guidance_template options."""
     def INPUT_TYPES(cls):
         # Use silent mode for INPUT_TYPES calls to avoid spam logs
         try:
-            if cls._cached_models is None:
-                available_models = cls.get_available_models(force_refresh=False, silent=True)
-            else:
-                available_models = cls._cached_models
+            # Never probe the backend here: ComfyUI calls INPUT_TYPES while building /object_info
+            available_models = cls._cached_models
+            if available_models is None or time.time() - cls._cache_timestamp >= cls._cache_duration:
+                cls.refresh_models_in_background()
+            if available_models is None:
+                available_models = FALLBACK_MODELS
             
             # If no models are detected, use a fallback option
             if not available_models or len(available_models) == 0:
@@ -387,26 +453,24 @@ For more examples, please check guidance_template options."""
     
     @classmethod
     def VALIDATE_INPUTS(cls, **kwargs):
-        """Validates input parameters"""
+        """
+        Validates input parameters.
+        Only the cached model list is consulted so queueing never waits on the backend;
+        a stale cache or an unknown model triggers a background refresh.
+        """
+        # INPUT_IS_LIST nodes may receive list values here as well
+        kwargs = {k: (v[0] if isinstance(v, list) and v else v) for k, v in kwargs.items()}
         model = kwargs.get('model', '')
         url = kwargs.get('url', 'http://127.0.0.1:7860')
         
-        # If model is empty, try to get available models and use the first one
-        if not model or model == '':
-            available_models = cls.get_available_models(url=url)
-            if available_models:
-                # Return True to indicate validation passed, ComfyUI will use the default value
-                return True
-        
-        # Check if the model is in the available list, try the cached list first
-        available_models = cls.get_available_models(url=url, force_refresh=False)
-        if model not in available_models and model not in ["No models found - Start TextGen WebUI service", "Error getting models - Check TextGen WebUI"]:
-            # If the model is not in the cache, force a refresh once
-            available_models = cls.get_available_models(url=url, force_refresh=True)
-            if model not in available_models:
-                # Don't return an error, let the user know but still proceed
-                return True
+        cached_models = cls._cached_models
+        cache_stale = cached_models is None or time.time() - cls._cache_timestamp >= cls._cache_duration
+        unknown_model = (bool(model) and cached_models is not None and model not in cached_models
+                         and model not in ["No models found - Start TextGen WebUI service", "Error getting models - Check TextGen WebUI"])
+        if cache_stale or unknown_model:
+            cls.refresh_models_in_background(url)
         
+        # Don't return an error for unknown models, generation reports problems itself
         return True
     
     RETURN_TYPES = ("STRING", "STRING")
@@ -415,18 +479,48 @@ For more examples, please check guidance_template options."""
         "system_prompt",           # The complete system prompt sent to the model
     )
     
+    # List inputs (e.g. several layer_info/edit_description values) are generated concurrently.
+    # ComfyUI stores every output as a list and maps downstream nodes over it, so returning one
+    # item per input item is the same contract as the implicit per-item execution used before:
+    # a single input still yields exactly one instruction.
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True)
+    
     FUNCTION = "enhance_flux_instructions"
     CATEGORY = "kontext_super_prompt/ai_enhanced"
     DESCRIPTION = "🤖 Kontext Super Prompt TextGen WebUI Enhancer - Generates optimized structured editing instructions via Text Generation WebUI models"
     
     def __init__(self):
-        # Initialize cache and logs
-        self.cache = {}
-        self.max_cache_size = 50
+        # Initialize logs (the result cache is class-level)
         self.debug_logs = []
         self.start_time = None
 
-    def enhance_flux_instructions(self, layer_info: str, edit_description: str, model: str, 
+    def enhance_flux_instructions(self, **inputs):
+        """
+        Generate instructions for every item of the (broadcast) input lists.
+        Items run concurrently up to the per-backend limit (LLM_MAX_CONCURRENCY);
+        identical items are sent once. Chat completions has no multi-prompt endpoint,
+        so each item is still its own request.
+        """
+        calls = broadcast_lists(**inputs)
+        if not calls:
+            return ([], [])
+        
+        def dedupe_key(call: Dict[str, Any]):
+            return tuple((name, id(value) if name == "image" else value) for name, value in sorted(call.items()))
+        
+        def call_backend(call: Dict[str, Any]) -> str:
+            return backend_key(call.get("url") or "http://127.0.0.1:5000")
+        
+        # Each item holds the slot of its own host, so items for different hosts don't share a limit
+        results = request_batcher.map(self._enhance_single, calls, backend=call_backend, key_fn=dedupe_key)
+        if len(calls) > 1:
+            backends = sorted({call_backend(call) for call in calls})
+            limits = ", ".join(f"{b} (limit {request_batcher.get_limit(b)})" for b in backends)
+            self._log_debug(f"📦 Generated {len(calls)} prompts concurrently on {limits}", True)
+        return ([instructions for instructions, _ in results], [system_prompt for _, system_prompt in results])
+    
+    def _enhance_single(self, layer_info: str, edit_description: str, model: str, 
                                 auto_unload_model: bool, editing_intent: str, processing_style: str,
                                 image=None, url: str = "http://127.0.0.1:5000", 
                                 temperature: float = 0.7, seed: int = 42,
@@ -446,10 +540,6 @@ For more examples, please check guidance_template options."""
             self._log_debug(f"❌ {error_msg}", debug_mode)
             return self._create_fallback_output(error_msg, debug_mode)
 
-        if not self._check_textgen_service(url):
-            error_msg = f"Error: Cannot connect to TextGen WebUI service at {url}. Please ensure TextGen WebUI is running with --api flag."
-            self._log_debug(f"❌ {error_msg}", debug_mode)
-            return self._create_fallback_output(error_msg, debug_mode)
 
         # Use intelligent mapping logic (reuse from Ollama enhancer)
         edit_instruction_type, guidance_style, guidance_template = self._map_intent_to_guidance(
@@ -495,11 +585,20 @@ For more examples, please check guidance_template options."""
                 guidance_style, guidance_template, seed, custom_guidance, load_saved_guidance
             )
             
-            # Check cache
-            if cache_key in self.cache:
-                self._log_debug(f"✅ Cache hit for key: {cache_key[:50]}...", debug_mode)
-                cached_result = self.cache[cache_key]
+            # Check cache (no network I/O on a hit)
+            cached_result = self._result_cache.get(cache_key)
+            if cached_result is not None:
+                self._log_debug(f"✅ Cache hit for key: {cache_key[:50]}... {self._format_cache_stats()}", debug_mode)
                 return (cached_result, system_prompt)
+            self._log_debug(f"🔍 Cache miss. {self._format_cache_stats()}", debug_mode)
+            
+            # The service is assumed healthy until requests fail; the breaker replaces the per-call health check
+            breaker = get_circuit_breaker(url)
+            if not breaker.allow_request():
+                error_msg = (f"Error: Cannot connect to TextGen WebUI service at {url} "
+                             f"(retrying in {breaker.retry_after():.0f}s). Please ensure TextGen WebUI is running with --api flag.")
+                self._log_debug(f"❌ {error_msg} Last error: {breaker.last_error}", debug_mode)
+                return self._create_fallback_output(error_msg, debug_mode)
 
             # Generate enhanced instructions
             enhanced_instructions = self._generate_with_textgen_webui(
@@ -508,13 +607,13 @@ For more examples, please check guidance_template options."""
             )
             
             if enhanced_instructions:
-                # Clean and format output
-                cleaned_instructions = self._clean_natural_language_output(enhanced_instructions)
+                # Structured output needs no cleanup; free-form output goes through the cleaner
+                cleaned_instructions = (parse_instruction(enhanced_instructions)
+                                        or self._clean_natural_language_output(enhanced_instructions))
                 
                 # Cache result
-                self.cache[cache_key] = cleaned_instructions
-                self._manage_cache()
-                self._log_debug("✅ Enhancement successful. Result cached.", debug_mode)
+                self._result_cache.set(cache_key, cleaned_instructions)
+                self._log_debug(f"✅ Enhancement successful. Result cached. {self._format_cache_stats()}", debug_mode)
                 
                 return (cleaned_instructions, system_prompt)
             else:
@@ -526,26 +625,6 @@ For more examples, please check guidance_template options."""
             self._log_debug(f"💥 {error_msg}\n{traceback.format_exc()}", debug_mode)
             return self._create_fallback_output(error_msg, debug_mode)
     
-    def _check_textgen_service(self, url: str) -> bool:
-        """Check if TextGen WebUI service is available"""
-        try:
-            if not REQUESTS_AVAILABLE:
-                return False
-            
-            # Try OpenAI API first
-            response = requests.get(f"{url}/v1/models", timeout=5)
-            if response.status_code == 200:
-                return True
-            
-            # Try native API as fallback
-            response = requests.get(f"{url}/api/v1/model", timeout=5)
-            if response.status_code == 200:
-                return True
-            
-            return False
-        except Exception as e:
-            return False
-    
     def _map_intent_to_guidance(self, editing_intent: str, processing_style: str) -> tuple:
         """Map editing intent and processing style to technical parameters"""
         
@@ -850,6 +929,11 @@ CRITICAL: Output in ENGLISH ONLY. Never use Chinese, Japanese, or any other lang
             if seed != 0:
                 generation_params["seed"] = seed
             
+            # Constrain output to {"instruction": ...} with a GBNF grammar
+            if STRUCTURED_OUTPUT_ENABLED:
+                generation_params.update(textgen_grammar_params())
+                system_prompt = with_json_rule(system_prompt)
+            
             # Build messages for chat completion
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -868,15 +952,25 @@ CRITICAL: Output in ENGLISH ONLY. Never use Chinese, Japanese, or any other lang
             }
             
             # Send request to TextGen WebUI OpenAI API
-            
+            breaker = get_circuit_breaker(url)
             try:
-                response = requests.post(
-                    f"{url}/v1/chat/completions",
-                    json=payload,
-                    timeout=300  # 5 minutes timeout
-                )
+                with request_batcher.slot(backend_key(url)):
+                    response = http_client.post(
+                        f"{url}/v1/chat/completions",
+                        json=payload,
+                        timeout=300  # 5 minutes timeout
+                    )
             except requests.exceptions.Timeout:
                 return self._generate_with_simplified_prompt(url, model, system_prompt, user_prompt, generation_params, debug_mode)
+            except Exception as e:
+                breaker.record_failure(str(e))
+                raise
+            
+            # Any non-5xx answer proves the service is reachable
+            if response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                breaker.record_success()
             
             if response.status_code == 200:
                 try:
@@ -935,7 +1029,17 @@ CRITICAL: Output in ENGLISH ONLY. Never use Chinese, Japanese, or any other lang
             }
             
             # Use shorter timeout
-            response = requests.post(f"{url}/v1/chat/completions", json=payload, timeout=60)
+            breaker = get_circuit_breaker(url)
+            try:
+                with request_batcher.slot(backend_key(url)):
+                    response = http_client.post(f"{url}/v1/chat/completions", json=payload, timeout=60)
+            except Exception as e:
+                breaker.record_failure(str(e))
+                raise
+            if response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                breaker.record_success()
             
             if response.status_code == 200:
                 result = response.json()
@@ -953,52 +1057,7 @@ CRITICAL: Output in ENGLISH ONLY. Never use Chinese, Japanese, or any other lang
 
     def _clean_natural_language_output(self, instructions: str) -> str:
         """Clean natural language output to remove technical details and annotation numbers"""
-        try:
-            import re
-            
-            instructions = re.sub(r'\(annotation\s+\d+\)', '', instructions, flags=re.IGNORECASE)
-            instructions = re.sub(r'annotation\s+\d+:?', '', instructions, flags=re.IGNORECASE)
-            
-            lines = instructions.split('\n')
-            cleaned_lines = []
-            skip_section = False
-            
-            for line in lines:
-                line = line.strip()
-                
-                # Skip technical instruction sections
-                if line.startswith('**Instruction:**') or line.startswith('**Instructions:**'):
-                    skip_section = True
-                    continue
-                elif line.startswith('**') and skip_section:
-                    # End of instruction section
-                    skip_section = False
-                    continue
-                elif skip_section and (line.startswith('-') or line.startswith('*') or 'Apply' in line or 'Ensure' in line or 'Maintain' in line):
-                    # Skip technical instruction items
-                    continue
-                elif skip_section and not line:
-                    # Skip empty lines in instruction sections
-                    continue
-                else:
-                    skip_section = False
-                
-                # Keep non-technical content
-                if line and not skip_section:
-                    # Additional cleanup
-                    if not (line.startswith('- Apply') or line.startswith('- Ensure') or line.startswith('- Maintain')):
-                        cleaned_lines.append(line)
-            
-            # Join and clean up spacing
-            result = ' '.join(cleaned_lines)
-            
-            result = re.sub(r'\s+', ' ', result).strip()
-            
-            return result if result else instructions
-            
-        except Exception as e:
-            # If cleaning fails, return original
-            return instructions
+        return clean_natural_language_output(instructions)
 
     def _get_cache_key(self, layer_info: str, edit_description: str, 
                       edit_instruction_type: str, model: str, temperature: float,
@@ -1009,11 +1068,11 @@ CRITICAL: Output in ENGLISH ONLY. Never use Chinese, Japanese, or any other lang
         content = f"{layer_info}|{edit_description}|{edit_instruction_type}|{model}|{temperature}|{guidance_style}|{guidance_template}|{seed}|{custom_guidance}|{load_saved_guidance}"
         return hashlib.md5(content.encode()).hexdigest()
     
-    def _manage_cache(self):
-        """Manage cache size"""
-        if len(self.cache) > self.max_cache_size:
-            oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k] if isinstance(self.cache[k], str) else 0)
-            del self.cache[oldest_key]
+    def _format_cache_stats(self) -> str:
+        """Format result cache statistics for the debug log"""
+        stats = self._result_cache.stats()
+        return (f"[cache: {stats['hits']} hits / {stats['misses']} misses, hit rate {stats['hit_rate']:.0%}, "
+                f"{stats['entries']} entries, {stats['bytes']} bytes, {stats['evictions']} evictions]")
 
     def _log_debug(self, message: str, debug_mode: bool):
         """Records debug information"""
@@ -1057,8 +1116,10 @@ if WEB_AVAILABLE:
             if "127.0.0.1" in url or "localhost" in url:
                 pass
             
-            # Use the same model detection logic as main node
-            model_names = TextGenWebUIFluxKontextEnhancer.get_available_models(url=url, force_refresh=True, silent=False)
+            # Use the same model detection logic as main node (off the event loop, it waits for the probes)
+            loop = asyncio.get_running_loop()
+            model_names = await loop.run_in_executor(
+                None, lambda: TextGenWebUIFluxKontextEnhancer.get_available_models(url=url, force_refresh=True, silent=False))
             
             if model_names:
                 pass
@@ -1078,6 +1139,14 @@ if WEB_AVAILABLE:
                 "models": []
             }, status=500)
 
+    @PromptServer.instance.routes.get("/textgen_webui_enhancer/cache_stats")
+    async def get_textgen_cache_stats(request):
+        """Result cache statistics (hits, misses, hit rate, entries, bytes, evictions)"""
+        try:
+            return web.json_response({"success": True, **TextGenWebUIFluxKontextEnhancer._result_cache.stats()})
+        except Exception as e:
+            return web.json_response({"success": False, "message": str(e)}, status=500)
+
 
 # Node registration
 NODE_CLASS_MAPPINGS = {
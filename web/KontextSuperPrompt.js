@@ -468,6 +468,16 @@ class KontextSuperPrompt {
         
         // 初始化UI
         this.initEditor();
+
+        // 后端Ollama流式生成的部分文本
+        this.addAPIEventListenerManaged('ollama_stream_progress', (event) => {
+            const detail = event.detail || {};
+            if (String(detail.node_id) !== String(this.node.id)) return;
+            this.tabData.ollama.generatedPrompt = detail.done ? detail.text : `⏳ ${detail.text}`;
+            if (this.currentCategory === 'ollama') {
+                this.updateCurrentTabPreview();
+            }
+        });
     }
 
     // 事件监听器管理方法 - 统一管理所有监听器以防止内存泄漏
@@ -3234,7 +3244,9 @@ class KontextSuperPrompt {
             { value: 'moonshot', text: 'Moonshot (Kimi)' },
             { value: 'gemini', text: 'Google Gemini' },
             { value: 'claude', text: 'Claude (Anthropic)' },
-            { value: 'openai', text: 'OpenAI' }
+            { value: 'openai', text: 'OpenAI' },
+            // auto：由后端按延迟统计路由到最快的已配置提供商（密钥读取环境变量）
+            { value: 'auto', text: '自动 (最快的可用提供商)' }
         ];
         providerOptions.forEach(provider => {
             const option = document.createElement('option');
@@ -3284,7 +3296,8 @@ class KontextSuperPrompt {
             'moonshot': ['moonshot-v1-8k', 'moonshot-v1-32k', 'moonshot-v1-128k'],
             'gemini': ['gemini-pro', 'gemini-2.0-flash-exp', 'gemini-1.5-pro', 'gemini-1.5-flash'],
             'claude': ['claude-3-5-sonnet-20241022', 'claude-3-5-haiku-20241022', 'claude-3-opus-20240229'],
-            'openai': ['gpt-3.5-turbo', 'gpt-4', 'gpt-4-turbo', 'gpt-4o', 'gpt-4o-mini', 'o1-mini', 'o1-preview']
+            'openai': ['gpt-3.5-turbo', 'gpt-4', 'gpt-4-turbo', 'gpt-4o', 'gpt-4o-mini', 'o1-mini', 'o1-preview'],
+            'auto': ['auto']
         };
         
         // 更新模型列表的函数
@@ -4105,10 +4118,22 @@ class KontextSuperPrompt {
             const response = await fetch('/ollama_converter/convert', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ model_name: model.name })
+                body: JSON.stringify({ model_name: model.name, async: true })
             });
             
-            const result = await response.json();
+            let result = await response.json();
+            
+            // 轮询后台转换任务，显示进度
+            while (result.job_id && (result.status === 'queued' || result.status === 'running')) {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const jobResponse = await fetch(`/ollama_converter/jobs/${result.job_id}`);
+                result = await jobResponse.json();
+                const percent = result.progress != null ? ` ${Math.round(result.progress * 100)}%` : '';
+                statusSpan.textContent = `正在转换模型: ${model.name}${percent} - ${result.stage || ''}`;
+            }
+            if (result.status) {
+                result.success = result.status === 'succeeded';
+            }
             
             if (result.success) {
                 button.textContent = '已转换';
@@ -7515,7 +7540,36 @@ class KontextSuperPrompt {
             }
         }
         
+        // auto模式：提供商由后端路由选择，浏览器端不直接调用API，
+        // 清空已生成的提示词，让节点执行时由process_api_mode生成
+        if (provider === 'auto') {
+            this.tabData.api.apiProvider = provider;
+            this.tabData.api.generatedPrompt = '';
+            this.updateCurrentTabPreview();
+            this.updateNodeWidgets({
+                tab_mode: 'api',
+                edit_mode: '远程API',
+                api_provider: provider,
+                api_key: '',
+                api_model: model,
+                api_editing_intent: intent,
+                api_processing_style: style,
+                api_seed: Math.floor(Math.random() * 1000000),
+                api_custom_guidance: style === 'custom_guidance' ? (this.apiConfig?.guidanceTextarea?.value || '') : '',
+                description: description,
+                generated_prompt: '',
+                constraint_prompts: '',
+                decorative_prompts: '',
+                operation_type: 'api_enhance'
+            });
+            this.notifyNodeUpdate();
+            this.isGeneratingAPI = false;
+            this.showNotification('自动模式：提示词将在节点执行时由后端生成', 'info');
+            return;
+        }
+        
         if (!apiKey) {
+            this.isGeneratingAPI = false;
             alert('请输入API密钥');
             return;
         }
@@ -126,7 +126,8 @@ app.registerExtension({
             nodeType.prototype.onModelFileChange = function(fileName) {
                 if (fileName && fileName.trim() && fileName !== "请将.gguf模型文件放入models/custom_prompt_models目录") {
                     if (fileName.endsWith('.gguf')) {
-                        this.updateModelStatus('模型文件已选择，等待加载...', 'ready');
+                        this.updateModelStatus('模型文件已选择，后台预加载中...', 'ready');
+                        this.preloadModel(fileName);
                     } else {
                         this.updateModelStatus('错误：需要.gguf格式的模型文件', 'error');
                     }
@@ -135,6 +136,29 @@ app.registerExtension({
                 }
             };
             
+            // 后台预加载模型，执行时无需等待加载
+            nodeType.prototype.preloadModel = async function(fileName) {
+                try {
+                    const response = await fetch('/custom_model_generator/preload', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({
+                            model_file: fileName,
+                            model_name: this.widgets.find(w => w.name === "model_name")?.value ?? "",
+                            custom_system_prompt: this.widgets.find(w => w.name === "custom_system_prompt")?.value ?? "",
+                            max_tokens: this.widgets.find(w => w.name === "max_tokens")?.value ?? 512,
+                            speculative_decoding: this.widgets.find(w => w.name === "speculative_decoding")?.value ?? "none"
+                        })
+                    });
+                    const result = await response.json();
+                    if (!result.success) {
+                        this.updateModelStatus('预加载失败: ' + (result.error || '未知错误'), 'error');
+                    }
+                } catch (error) {
+                    console.error("[Custom Model] 预加载模型失败:", error);
+                }
+            };
+            
             // 更新模型状态
             nodeType.prototype.updateModelStatus = function(message, status = 'default') {
                 if (this.modelStatusDiv) {
@@ -331,6 +331,20 @@ app.registerExtension({
                 this.resizable = false;
             };
             
+            const onConfigure = nodeType.prototype.onConfigure;
+            nodeType.prototype.onConfigure = function () {
+                if (onConfigure) {
+                    onConfigure.apply(this, arguments);
+                }
+                
+                // 加载工作流时预热调度器中配置的Ollama模型
+                api.fetchApi("/ollama_service_control", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ action: "preload" })
+                }).catch(error => console.warn("[Ollama Manager] 模型预加载失败:", error));
+            };
+            
             const onRemoved = nodeType.prototype.onRemoved;
             nodeType.prototype.onRemoved = function () {
                 if (this.ollamaUI) {